@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+'''Runs `check_all_producers` against a local mock network once per
+`--concurrency` value and prints wall time, peak memory and requests per
+second of each run.
+
+Peak memory is the process max rss, which only grows across runs, with
+`--tracemalloc` it is the peak of python allocations during each run instead,
+at the cost of a much slower interpreter.
+
+Every run gets a fresh reports db so learned timeouts and caches from one
+setting don't leak into the next. The mock network runs in the same process,
+so its own work and memory are part of the numbers.
+
+    python benchmarks/bench_gather.py -p 200 -c 10 -c 50 -c 100
+'''
+
+import time
+import resource
+import tempfile
+import tracemalloc
+
+from pathlib import Path
+from functools import partial
+
+import trio
+import click
+
+from bp_auditor.audit import check_all_producers
+from bp_auditor.mocknet import open_mocknet
+
+
+async def run_once(concurrency: int, db_location: str, deadline: float, **net):
+    async with open_mocknet(**net) as mocknet:
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        reports = await check_all_producers(
+            mocknet.chain_url,
+            db_location=db_location,
+            concurrency=concurrency,
+            top=len(mocknet.producers),
+            deadline=deadline,
+            resolver=mocknet.resolver(),
+            ssl_context=mocknet.client_ssl_context()
+        )
+        wall = time.perf_counter() - start
+
+    if tracemalloc.is_tracing():
+        _, peak = tracemalloc.get_traced_memory()
+
+    else:
+        # kilobytes on linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    ok = sum(report.get('bp_json') == 'ok' for report in reports)
+    return wall, peak, mocknet.requests, ok, len(reports)
+
+
+@click.command()
+@click.option('--producers', '-p', default=42)
+@click.option(
+    '--concurrency', '-c', type=int, multiple=True, default=[5, 10, 20, 50])
+@click.option('--latency', default=0.05)
+@click.option('--latency-sigma', default=0.5)
+@click.option('--failure-rate', default=0.05)
+@click.option('--timeout-rate', default=0.05)
+@click.option('--deadline', default=600)
+@click.option('--seed', default=1)
+@click.option('--tracemalloc', 'trace_memory', is_flag=True, default=False)
+def bench(
+    producers, concurrency, latency, latency_sigma,
+    failure_rate, timeout_rate, deadline, seed, trace_memory
+):
+    if trace_memory:
+        tracemalloc.start()
+
+    click.echo(
+        f'{"concurrency":>11} {"wall":>9} {"peak mem":>10} '
+        f'{"requests":>9} {"req/s":>8} {"ok":>9}')
+
+    for value in concurrency:
+        with tempfile.TemporaryDirectory() as tmp:
+            wall, peak, requests, ok, total = trio.run(partial(
+                run_once,
+                value,
+                str(Path(tmp) / 'reports.db'),
+                deadline,
+                producers=producers,
+                latency=latency,
+                latency_sigma=latency_sigma,
+                failure_rate=failure_rate,
+                timeout_rate=timeout_rate,
+                seed=seed
+            ))
+
+        click.echo(
+            f'{value:>11} {wall:>8.2f}s {peak / 2 ** 20:>8.1f}MB '
+            f'{requests:>9} {requests / wall:>8.1f} {f"{ok}/{total}":>9}')
+
+
+if __name__ == '__main__':
+    bench()
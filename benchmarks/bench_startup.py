@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+'''Cold start cost of each `bpaudit` subcommand: wall time of a fresh
+interpreter resolving the subcommand and printing its `--help`, which
+imports everything the subcommand's module imports, and the amount of
+modules loaded by then. The `python` row is a bare interpreter for
+reference, `bpaudit` is the group alone.
+
+Every value is the median of `--runs` fresh processes.
+
+    python benchmarks/bench_startup.py -n 20
+'''
+
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+import click
+
+
+_PROBE = '''
+import sys, json
+args = {args!r}
+if args is not None:
+    from bp_auditor.cli import bpaudit
+    try:
+        bpaudit(args, standalone_mode=False)
+
+    except Exception as e:
+        print(e, file=sys.stderr)
+
+print(json.dumps(len(sys.modules)))
+'''
+
+
+def run_once(args: list[str] | None) -> tuple[float, int]:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', _PROBE.format(args=args)],
+        capture_output=True, text=True, check=True
+    )
+    wall = time.perf_counter() - start
+    return wall, json.loads(result.stdout.splitlines()[-1])
+
+
+@click.command()
+@click.option('--runs', '-n', default=10)
+@click.option('--command', '-c', 'commands', multiple=True, default=None)
+def bench(runs, commands):
+    from bp_auditor.cli import COMMANDS
+
+    targets = [('python', None), ('bpaudit', ['--help'])]
+    targets += [
+        (name, [name, '--help']) for name in (commands or COMMANDS)]
+
+    click.echo(f'{"command":>10} {"wall":>9} {"modules":>8}')
+    for name, args in targets:
+        samples = [run_once(args) for _ in range(runs)]
+        wall = statistics.median(wall for wall, _ in samples)
+        modules = samples[-1][1]
+        click.echo(f'{name:>10} {wall * 1000:>7.1f}ms {modules:>8}')
+
+
+if __name__ == '__main__':
+    bench()
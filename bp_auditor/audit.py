@@ -1,161 +1,347 @@
 #!/usr/bin/env python3
 
+import ssl
 import logging
 
+from datetime import datetime, timedelta
+
 import trio
 
 from .queries import *
+from .db import (
+    read_http_cache,
+    store_http_cache,
+    read_cpu_aggregates,
+    store_cpu_aggregates,
+    read_cpu_scan_cursor,
+    store_cpu_scan_cursor,
+    read_latency_samples,
+    store_latency_samples,
+    read_endpoint_health,
+    store_endpoint_health
+)
+from .cpu import CPUAggregate, month_key
+from .session import AuditSession, HTTPCache
+from .checks import Check, CheckContext, CheckRunner, CPUBenchmarks
+from .dns import CachingResolver
+from .probes import EndpointProbes
+from .health import EndpointHealth
+from .timeouts import Timeouts
+from .timings import Timings, current_chain, current_owner, record_timing
+from .trace import traced_wait
+from .utils import NetworkError, MalformedJSONError
+
+
+# how far back latencies are kept to learn timeouts from
+LATENCY_WINDOW = timedelta(days=7)
+
+
+def load_cpu_benchmarks(
+    db_location: str,
+    chain_url: str,
+    month: str,
+    **kwargs
+) -> CPUBenchmarks:
+    '''`CPUBenchmarks` of `month` resuming from the aggregates and scan cursor
+    stored by previous runs, `kwargs` go to its constructor
+    '''
+    return CPUBenchmarks(
+        month,
+        aggregates={
+            aggregate['owner']: CPUAggregate(**aggregate)
+            for aggregate in read_cpu_aggregates(db_location, chain_url, month)
+        },
+        cursor=read_cpu_scan_cursor(db_location, chain_url, month),
+        **kwargs
+    )
 
 
-async def check_producer(chain_url: str, producer: dict, chain_id: str):
-    report = {'owner': producer['owner']}
-    url = producer['url']
-
-    if not url:
-        report['bp_json'] = f'NO URL ON CHAIN! owner: {producer["owner"]}'
-
-    report['url'] = url
-    try:
-        bp_json = await get_bp_json(url, chain_id)
-        logging.info(f'got bp json for {url}')
+def store_cpu_benchmarks(
+    db_location: str,
+    chain_url: str,
+    benchmarks: CPUBenchmarks
+):
+    store_cpu_aggregates(
+        db_location,
+        chain_url,
+        [aggregate.to_dict() for aggregate in benchmarks.aggregates.values()]
+    )
+    store_cpu_scan_cursor(
+        db_location, chain_url, benchmarks.month, benchmarks.cursor)
 
-    except BaseException as e:
-        report['bp_json'] = str(e)
-        return report
 
-    try:
-        validate_bp_json(bp_json)
+async def check_producer(
+    session: AuditSession,
+    chain_url: str,
+    producer: dict,
+    chain_id: str,
+    max_sockets: int = 4,
+    runner: CheckRunner | None = None,
+    probes: EndpointProbes | None = None,
+    cpu: CPUBenchmarks | None = None
+):
+    if runner is None:
+        runner = CheckRunner()
 
-    except MalformedJSONError as e:
-        report['bp_json'] = str(e)
-        return report
+    if probes is None:
+        probes = EndpointProbes()
 
-    report['bp_json'] = 'ok'
-    logging.info(f'bp json for {url} valid')
+    # cap the amount of sockets this producer's checks can have open
+    ctx = CheckContext(
+        session, chain_url, chain_id, producer,
+        trio.CapacityLimiter(max_sockets), probes,
+        cpu=cpu)
 
-    # check tls version on each ssl endpoint
-    ssl_endpoints = [
-        node
-        for node in bp_json['nodes']
-        if 'ssl_endpoint' in node and node['ssl_endpoint'] != ''
-    ]
-    report['ssl_endpoints'] = []
-    tlsv = None
-    for node in ssl_endpoints:
+    await runner.run(ctx)
 
-        try:
-            tlsv = await get_tls_version(node['ssl_endpoint'])
+    logging.info(f'finished checks for {producer["url"]}')
 
-        except NetworkError as e:
-            tlsv = str(e)
+    return ctx.report
 
-        report['ssl_endpoints'].append(
-            (node['node_type'], node['ssl_endpoint'], tlsv))
 
-    logging.info(f'checked ssl endpoint for {url}')
-
-    # check p2p node connect
-    p2p_endpoints = [
-        node
-        for node in bp_json['nodes']
-        if 'p2p_endpoint' in node and node['p2p_endpoint'] != ''
-    ]
-    report['p2p_endpoints'] = []
-    for node in p2p_endpoints:
+import traceback
+async def audit_producer(
+    session: AuditSession,
+    chain_url: str,
+    chain_id: str,
+    rank: int,
+    producer: dict,
+    limit: trio.CapacityLimiter,
+    sockets_per_producer: int = 4,
+    runner: CheckRunner | None = None,
+    probes: EndpointProbes | None = None,
+    cpu: CPUBenchmarks | None = None
+) -> dict:
+    '''Audit `producer` once a slot of `limit` frees up, never raises, an
+    audit that blew up returns a report carrying the exception. The report
+    gets the producer's `rank` and votes in the table snapshot it came from.
+    '''
+    current_owner.set(producer['owner'])
+    async with traced_wait(limit, 'wait producer slot'):
+        start = trio.current_time()
         try:
+            report = await check_producer(
+                session, chain_url, producer, chain_id,
+                max_sockets=sockets_per_producer,
+                runner=runner,
+                probes=probes,
+                cpu=cpu)
+
+        except BaseException as e:
+            # the audit itself got cancelled, not a producer failure
+            await trio.lowlevel.checkpoint_if_cancelled()
+
+            e_text = traceback.format_exc()
+            logging.critical(e_text)
+            report = {
+                'owner': producer['owner'],
+                'url': producer['url'],
+                'exception': e_text
+            }
+
+        record_timing('producer', producer['url'], trio.current_time() - start)
+
+    report['rank'] = rank
+    report['total_votes'] = float(producer['total_votes'])
+    return report
 
-            domain, port = node['p2p_endpoint'].split(':')
-            port = int(port)
 
-        except ValueError:
-            report['p2p_endpoints'].append(
-                (node['node_type'], node['p2p_endpoint'], 'error'))
+async def check_all_producers(
+    chain_url: str,
+    db_location: str = 'reports.db',
+    **kwargs
+) -> list[dict]:
+    '''Audit the top producers of a single chain, takes the same options as
+    `check_all_chains`
+    '''
+    results = await check_all_chains([chain_url], db_location, **kwargs)
+    return results[chain_url]
 
-        try:
-            await check_port(domain, port)
-            result = 'ok'
-
-        except NetworkError as e:
-            result = str(e)
-
-        report['p2p_endpoints'].append(
-            (node['node_type'], node['p2p_endpoint'], 'ok'))
-
-    logging.info(f'checked p2p endpoint for {url}')
-
-    # get api node for history query
-    api_endpoints = [
-        node
-        for node in bp_json['nodes']
-        if 'api_endpoint' in node and node['api_endpoint'] != ''
-    ]
-    report['api_endpoints'] = []
-    api_endpoint = None
-    for node in api_endpoints:
-        node_type = node['node_type']
-        if (node_type == 'query' or
-            node_type == 'full' or
-            'query' in node_type or
-            'full' in node_type):
-            api_endpoint = node['api_endpoint']
-
-        report['api_endpoints'].append(
-            (node['node_type'], node['api_endpoint']))
-
-    if api_endpoint:
-        logging.info(f'checking history for {api_endpoint}')
-        early_block, late_block = await check_history(chain_url, api_endpoint)
-
-    else:
-        early_block, late_block = ('couldn\'t figure out api endpoint' for i in range(2))
-
-    report['history'] = {
-        'early': early_block,
-        'late': late_block
-    }
 
-    logging.info(f'checked history for {url}')
+async def check_all_chains(
+    chain_urls: list[str],
+    db_location: str = 'reports.db',
+    concurrency: int = 10,
+    sockets_per_producer: int = 4,
+    connections: int = 32,
+    connections_per_host: int = 4,
+    transport=None,
+    checks: list[Check] | None = None,
+    probe_concurrency: int = 32,
+    cpu_mode: str = 'bulk',
+    top: int = 42,
+    active_only: bool = False,
+    deadline: float | None = None,
+    timings: Timings | None = None,
+    resolver: CachingResolver | None = None,
+    ssl_context: ssl.SSLContext | None = None,
+    recheck_dead: float = 24 * 3600
+) -> dict[str, list[dict]]:
+    '''Audit the top producers of every chain in `chain_urls` in one run,
+    returns the reports of each chain. All chains share the connection pool,
+    dns cache, endpoint probes, learned timeouts and `concurrency` producer
+    slots, producers running the same infrastructure on several chains get
+    their endpoints probed once.
+
+    `deadline` bounds the wall clock time of the whole run in seconds, checks
+    still going when it hits get cut short and leave their timeout
+    placeholders on the reports.
+
+    If `timings` is passed every outbound operation of the run records its
+    timing on it. `resolver` and `ssl_context` replace the run's hostname
+    resolver and the tls probes context, to point the run at a local network.
+
+    Endpoints that kept failing in previous runs fail fast unless a quick
+    connect works, they get a full check again every `recheck_dead` seconds.
+    '''
+    http_cache = HTTPCache(*read_http_cache(db_location))
+
+    month = month_key(datetime.utcnow())
+    cpu = {
+        chain_url: load_cpu_benchmarks(
+            db_location, chain_url, month, bulk=cpu_mode == 'bulk')
+        for chain_url in chain_urls
+    }
 
-    report['cpu'] = await get_avg_performance_this_month(
-        chain_url,
-        bp_json['producer_account_name']
-    )
+    timeouts = Timeouts(read_latency_samples(
+        db_location, datetime.utcnow() - LATENCY_WINDOW))
+    timeouts.start(deadline)
 
-    return report
+    # every name lookup done during the run goes through the shared cache
+    if resolver is None:
+        resolver = CachingResolver()
 
+    runner = CheckRunner(checks)
+    health = EndpointHealth(
+        read_endpoint_health(db_location),
+        recheck_after=timedelta(seconds=recheck_dead)
+    )
+    probes = EndpointProbes(
+        probe_concurrency,
+        ssl_context=ssl_context,
+        timeouts=timeouts,
+        health=health
+    )
+    limit = trio.CapacityLimiter(concurrency)
+    results = {}
 
-import traceback
-async def check_all_producers(
+    async def _check_chain(session: AuditSession, chain_url: str):
+        current_chain.set(chain_url)
+        # a chain that can't be read leaves no reports, the rest go on
+        results[chain_url] = []
+        try:
+            results[chain_url] = await _check_all_producers(
+                session,
+                chain_url,
+                sockets_per_producer=sockets_per_producer,
+                runner=runner,
+                probes=probes,
+                cpu=cpu[chain_url],
+                top=top,
+                active_only=active_only,
+                limit=limit
+            )
+
+        except (Exception, NetworkError, MalformedJSONError):
+            logging.exception(f'{chain_url}: could not audit producers')
+
+    previous_resolver = trio.socket.set_custom_hostname_resolver(resolver)
+    timings_token = timings.install() if timings is not None else None
+    try:
+        async with AuditSession(
+            connections=connections,
+            per_host=connections_per_host,
+            transport=transport,
+            http_cache=http_cache,
+            resolver=resolver,
+            timeouts=timeouts
+        ) as session:
+            async with trio.open_nursery() as n:
+                for chain_url in chain_urls:
+                    n.start_soon(_check_chain, session, chain_url)
+
+            logging.info(
+                f'chain query cache: {session.query_cache.hits} hits, '
+                f'{session.query_cache.misses} misses')
+            logging.info(
+                f'retries: {session.retry_policy.retries}, '
+                f'{session.retry_policy.denied} denied by host budgets')
+
+    finally:
+        trio.socket.set_custom_hostname_resolver(previous_resolver)
+        if timings_token is not None:
+            timings_token.var.reset(timings_token)
+
+        # what the run learned is kept even if it failed
+        runner.log_stats()
+        probes.log_stats()
+        resolver.log_stats()
+        logging.info(
+            f'bp json cache: {http_cache.hits} hits, {http_cache.misses} misses')
+        store_http_cache(db_location, http_cache.entries, http_cache.paths)
+        for chain_url, benchmarks in cpu.items():
+            store_cpu_benchmarks(db_location, chain_url, benchmarks)
+
+        store_latency_samples(
+            db_location,
+            timeouts.recorded,
+            prune_before=datetime.utcnow() - LATENCY_WINDOW
+        )
+        store_endpoint_health(db_location, health.entries)
+
+    return results
+
+
+async def _check_all_producers(
+    session: AuditSession,
     chain_url: str,
-    db_location: str = 'reports.db',
-    concurrency: int = 10
+    concurrency: int = 10,
+    sockets_per_producer: int = 4,
+    runner: CheckRunner | None = None,
+    probes: EndpointProbes | None = None,
+    cpu: CPUBenchmarks | None = None,
+    top: int = 42,
+    active_only: bool = False,
+    limit: trio.CapacityLimiter | None = None
 ):
-    chain_id = await get_chain_id(chain_url)
+    if runner is None:
+        runner = CheckRunner()
+
+    # eosmechanics:cpu results come from one scan shared by all producers
+    if cpu is None:
+        cpu = CPUBenchmarks(month_key(datetime.utcnow()))
+
+    # tls and p2p targets are shared by all producers of the run, so each
+    # unique endpoint gets probed once
+    if probes is None:
+        probes = EndpointProbes()
+
+    chain_id = await get_chain_id(session, chain_url)
     logging.info(f'{chain_url} chain id {chain_id}')
 
-    # get top 42 producers ordered by vote
-    producers = await get_all_producers(chain_url)
+    # snapshot of the top producers ordered by vote, the run audits exactly
+    # this set and stores each producer's rank with its report
+    producers = await get_all_producers(
+        session, chain_url, top=top, active_only=active_only)
+    logging.info(f'auditing {len(producers)} producers')
+
+    # producer slots, shared between chains audited in the same run
+    if limit is None:
+        limit = trio.CapacityLimiter(concurrency)
 
-    limit = trio.CapacityLimiter(concurrency)
     reports = []
-    async def get_report(_prod: dict):
-        async with limit:
-            try:
-                report = await check_producer(chain_url, _prod, chain_id)
-
-            except BaseException as e:
-                e_text = traceback.format_exc()
-                logging.critical(e_text)
-                report = {
-                    'url': _prod['url'],
-                    'exception': e_text
-                }
-
-        reports.append(report)
-        logging.info(f'finished report {len(reports)}/42')
+    async def get_report(rank: int, _prod: dict):
+        reports.append(await audit_producer(
+            session, chain_url, chain_id, rank, _prod, limit,
+            sockets_per_producer=sockets_per_producer,
+            runner=runner,
+            probes=probes,
+            cpu=cpu
+        ))
+        logging.info(f'finished report {len(reports)}/{len(producers)}')
 
     async with trio.open_nursery() as n:
-        for producer in producers:
-            n.start_soon(get_report, producer)
+        for rank, producer in enumerate(producers, start=1):
+            n.start_soon(get_report, rank, producer)
 
     return reports
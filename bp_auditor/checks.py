@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+
+import math
+import logging
+
+from datetime import datetime
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import trio
+
+from .queries import *
+from .session import AuditSession
+from .probes import EndpointProbes
+from .cpu import CPUAggregate, month_key
+from .utils import SingleFlight
+from .timings import current_check, record_timing
+from .trace import traced_wait
+
+
+'''Producer checks as plugins, each one declares which other checks it needs
+the output of, the runner starts every check as soon as those are done.
+
+A check writes its findings on `ctx.report` and returns an output for the
+checks that depend on it, returning None means there is nothing to go on and
+its dependents get skipped. Checks write a placeholder result first so a
+check cut short by its timeout still leaves a readable report entry.
+'''
+
+
+class CPUBenchmarks:
+    '''Run wide eosmechanics:cpu results, in bulk mode the first producer that
+    needs its result triggers one scan of the whole chain's benchmark actions
+    and every other producer reads its aggregate from it, otherwise each
+    producer pages through its own actions.
+
+    `aggregates` and `cursor` come from the previous run of the same month
+    and get updated in place so they can be persisted after the run.
+
+    The bulk scan runs once per run unless `rescan_after` is set, then a
+    result asked for more than `rescan_after` seconds after the last scan
+    resumes it from the cursor first.
+    '''
+
+    def __init__(
+        self,
+        month: str,
+        aggregates: dict[str, CPUAggregate] | None = None,
+        cursor: dict | None = None,
+        bulk: bool = True,
+        rescan_after: float = math.inf
+    ):
+        self.month = month
+        self.aggregates = aggregates if aggregates is not None else {}
+        self.cursor = cursor if cursor is not None else {}
+        self.bulk = bulk
+        self.rescan_after = rescan_after
+        self._flights = SingleFlight()
+        self._scanned_at: float | None = None
+        self._error = None
+
+    def _aggregate(self, producer: str) -> CPUAggregate:
+        if producer not in self.aggregates:
+            self.aggregates[producer] = CPUAggregate(producer, self.month)
+
+        return self.aggregates[producer]
+
+    async def _scan(self, session: AuditSession, chain_url: str):
+        self._error = await scan_cpu_benchmarks(
+            session, chain_url, self.month, self.aggregates, self.cursor)
+        self._scanned_at = trio.current_time()
+
+    async def result(
+        self,
+        session: AuditSession,
+        chain_url: str,
+        producer: str
+    ) -> str:
+        if not self.bulk:
+            return await get_avg_performance_this_month(
+                session, chain_url, producer,
+                aggregate=self._aggregate(producer))
+
+        if (
+            self._scanned_at is None or
+            trio.current_time() - self._scanned_at > self.rescan_after
+        ):
+            await self._flights.call('scan', self._scan, session, chain_url)
+
+        if self._error:
+            return self._error
+
+        return self._aggregate(producer).summary()
+
+
+class CheckContext:
+    '''State shared by every check of a single producer audit
+    '''
+
+    def __init__(
+        self,
+        session: AuditSession,
+        chain_url: str,
+        chain_id: str,
+        producer: dict,
+        sockets: trio.CapacityLimiter,
+        probes: EndpointProbes,
+        cpu: CPUBenchmarks | None = None
+    ):
+        self.session = session
+        self.chain_url = chain_url
+        self.chain_id = chain_id
+        self.producer = producer
+        self.sockets = sockets
+        self.probes = probes
+        if cpu is None:
+            cpu = CPUBenchmarks(month_key(datetime.utcnow()), bulk=False)
+
+        self.cpu = cpu
+        self.report = {'owner': producer['owner'], 'url': producer['url']}
+        self.durations: dict[str, float] = {}
+
+
+class Check:
+    '''Base class for producer checks, subclasses set `name`, `requires`,
+    optionally `timeout` in seconds (the ceiling of the timeout learned from
+    previous runs) and `concurrency` (max instances of this
+    check running at once across all producers) and implement `run`, which
+    gets the outputs of its required checks as keyword arguments.
+    '''
+
+    name: str = ''
+    requires: tuple[str, ...] = ()
+    timeout: float | None = 60
+    concurrency: int | None = None
+
+    async def run(self, ctx: CheckContext, **inputs):
+        raise NotImplementedError
+
+
+_registry: dict[str, type[Check]] = {}
+
+
+def register_check(cls: type[Check]) -> type[Check]:
+    '''Class decorator, makes a check part of the default check set
+    '''
+    _registry[cls.name] = cls
+    return cls
+
+
+def default_checks() -> list[Check]:
+    return [cls() for cls in _registry.values()]
+
+
+class CheckRunner:
+    '''Runs a set of checks as a dependency DAG for each producer, keeps the
+    per check concurrency limits and timing stats across the whole run
+    '''
+
+    def __init__(self, checks: list[Check] | None = None):
+        if checks is None:
+            checks = default_checks()
+
+        self.checks = {check.name: check for check in checks}
+        for check in checks:
+            for dep in check.requires:
+                if dep not in self.checks:
+                    raise ValueError(
+                        f'check {check.name} requires unknown check {dep}')
+
+        self._limits = {
+            check.name: trio.CapacityLimiter(check.concurrency)
+            for check in checks
+            if check.concurrency
+        }
+        self.stats: dict[str, list[float]] = defaultdict(list)
+
+    async def _run_check(
+        self,
+        ctx: CheckContext,
+        check: Check,
+        done: dict[str, trio.Event],
+        outputs: dict
+    ):
+        # tags every operation this check makes
+        current_check.set(check.name)
+        try:
+            for dep in check.requires:
+                await done[dep].wait()
+
+            inputs = {dep: outputs.get(dep) for dep in check.requires}
+            if any(value is None for value in inputs.values()):
+                logging.debug(
+                    f'skipping {check.name} for {ctx.report["owner"]}')
+                return
+
+            # learned from previous runs and bounded by the run deadline
+            timeout = ctx.session.timeouts.timeout(
+                f'check:{check.name}',
+                default=check.timeout if check.timeout else math.inf
+            )
+            start = trio.current_time()
+            with trio.move_on_after(timeout) as cs:
+                if check.name in self._limits:
+                    async with traced_wait(
+                        self._limits[check.name], f'wait {check.name} slot'
+                    ):
+                        outputs[check.name] = await check.run(ctx, **inputs)
+
+                else:
+                    outputs[check.name] = await check.run(ctx, **inputs)
+
+            duration = trio.current_time() - start
+            record_timing(
+                'check', check.name, duration,
+                error='timeout' if cs.cancelled_caught else None)
+            if cs.cancelled_caught:
+                logging.warning(
+                    f'{check.name} timed out for {ctx.report["owner"]}')
+
+            else:
+                ctx.session.timeouts.record(
+                    f'check:{check.name}', '', duration)
+
+            ctx.durations[check.name] = duration
+            self.stats[check.name].append(duration)
+
+        finally:
+            done[check.name].set()
+
+    async def run(self, ctx: CheckContext):
+        done = {name: trio.Event() for name in self.checks}
+        outputs = {}
+        async with trio.open_nursery() as n:
+            for check in self.checks.values():
+                n.start_soon(self._run_check, ctx, check, done, outputs)
+
+        return ctx.report
+
+    def log_stats(self):
+        for name, durations in self.stats.items():
+            logging.info(
+                f'check {name}: {len(durations)} runs, '
+                f'avg {sum(durations) / len(durations):.2f}s, '
+                f'max {max(durations):.2f}s')
+
+
+@register_check
+class BPJsonCheck(Check):
+    name = 'bp_json'
+
+    async def run(self, ctx: CheckContext):
+        url = ctx.producer['url']
+        if not url:
+            ctx.report['bp_json'] = (
+                f'NO URL ON CHAIN! owner: {ctx.producer["owner"]}')
+            return None
+
+        ctx.report['bp_json'] = 'timeout'
+        try:
+            bp_json = await get_bp_json(ctx.session, url, ctx.chain_id)
+            logging.info(f'got bp json for {url}')
+
+        except BaseException as e:
+            if isinstance(e, trio.Cancelled):
+                raise
+
+            ctx.report['bp_json'] = str(e)
+            return None
+
+        try:
+            validate_bp_json(bp_json)
+
+        except MalformedJSONError as e:
+            ctx.report['bp_json'] = str(e)
+            return None
+
+        ctx.report['bp_json'] = 'ok'
+        logging.info(f'bp json for {url} valid')
+        return bp_json
+
+
+def _nodes_with(bp_json: dict, key: str) -> list[dict]:
+    return [
+        node
+        for node in bp_json['nodes']
+        if key in node and node[key] != ''
+    ]
+
+
+@register_check
+class TLSCheck(Check):
+    name = 'tls'
+    requires = ('bp_json',)
+
+    async def run(self, ctx: CheckContext, bp_json: dict):
+        # check tls version on each ssl endpoint
+        ssl_endpoints = _nodes_with(bp_json, 'ssl_endpoint')
+        results = [
+            (node['node_type'], node['ssl_endpoint'], 'timeout')
+            for node in ssl_endpoints
+        ]
+        # handshake details for each endpoint, None if the probe failed
+        details = [None] * len(ssl_endpoints)
+        ctx.report['ssl_endpoints'] = results
+        ctx.report['ssl_details'] = details
+
+        async def _check(i: int, node: dict):
+            try:
+                result = await ctx.probes.tls(node['ssl_endpoint'], ctx.sockets)
+
+            except ValueError:
+                result = 'error'
+
+            tlsv = result
+            if isinstance(result, dict):
+                tlsv = result['version']
+                details[i] = result
+
+            results[i] = (node['node_type'], node['ssl_endpoint'], tlsv)
+
+        async with trio.open_nursery() as n:
+            for i, node in enumerate(ssl_endpoints):
+                n.start_soon(_check, i, node)
+
+        logging.info(f'checked ssl endpoint for {ctx.report["url"]}')
+        return results
+
+
+@register_check
+class P2PCheck(Check):
+    name = 'p2p'
+    requires = ('bp_json',)
+
+    async def run(self, ctx: CheckContext, bp_json: dict):
+        # check p2p node connect
+        p2p_endpoints = _nodes_with(bp_json, 'p2p_endpoint')
+        results = [
+            (node['node_type'], node['p2p_endpoint'], 'timeout')
+            for node in p2p_endpoints
+        ]
+        ctx.report['p2p_endpoints'] = results
+
+        async def _check(i: int, node: dict):
+            try:
+                result = await ctx.probes.p2p(node['p2p_endpoint'], ctx.sockets)
+
+            except ValueError:
+                result = 'error'
+
+            results[i] = (node['node_type'], node['p2p_endpoint'], result)
+
+        async with trio.open_nursery() as n:
+            for i, node in enumerate(p2p_endpoints):
+                n.start_soon(_check, i, node)
+
+        logging.info(f'checked p2p endpoint for {ctx.report["url"]}')
+        return results
+
+
+@register_check
+class HistoryCheck(Check):
+    name = 'history'
+    requires = ('bp_json',)
+
+    # amount of chain slices sampled for block retention
+    samples = 10
+
+    async def run(self, ctx: CheckContext, bp_json: dict):
+        # get api node for history query
+        api_endpoints = _nodes_with(bp_json, 'api_endpoint')
+        ctx.report['api_endpoints'] = []
+        api_endpoint = None
+        for node in api_endpoints:
+            node_type = node['node_type']
+            if (node_type == 'query' or
+                node_type == 'full' or
+                'query' in node_type or
+                'full' in node_type):
+                api_endpoint = node['api_endpoint']
+
+            ctx.report['api_endpoints'].append(
+                (node['node_type'], node['api_endpoint']))
+
+        if not api_endpoint:
+            ctx.report['history'] = {
+                'early': 'couldn\'t figure out api endpoint',
+                'late': 'couldn\'t figure out api endpoint'
+            }
+            return None
+
+        ctx.report['history'] = {'early': 'timeout', 'late': 'timeout'}
+
+        logging.info(f'checking history for {api_endpoint}')
+        target = urlparse(api_endpoint)
+        host = target.netloc
+        key = (
+            'history',
+            (target.hostname or '').lower(),
+            target.port or (443 if target.scheme == 'https' else 80)
+        )
+        async with traced_wait(ctx.sockets, 'wait producer sockets'):
+            error = await ctx.probes.liveness(key)
+
+        if error is not None:
+            ctx.report['history'] = {'early': error, 'late': error}
+            return ctx.report['history']
+
+        # every sample takes its own producer socket
+        start = trio.current_time()
+        ctx.report['history'] = await check_history(
+            ctx.session, ctx.chain_url, api_endpoint,
+            samples=self.samples,
+            timeout=ctx.session.timeouts.timeout('history', host),
+            sockets=ctx.sockets)
+
+        duration = trio.current_time() - start
+        results = list(ctx.report['history'].values())
+        if 'timeout' not in results:
+            ctx.session.timeouts.record('history', host, duration)
+
+        # the node answering any sample is enough to call it alive
+        errors = [result for result in results if isinstance(result, str)]
+        if len(errors) < len(results):
+            ctx.probes.health.record(key, True, latency=duration)
+
+        else:
+            ctx.probes.health.record(
+                key, False, error=errors[0] if errors else None)
+
+        logging.info(f'checked history for {ctx.report["url"]}')
+        return ctx.report['history']
+
+
+@register_check
+class CPUCheck(Check):
+    name = 'cpu'
+    requires = ('bp_json',)
+
+    # the first cpu check of a bulk run waits on the chain wide scan
+    timeout = 300
+
+    async def run(self, ctx: CheckContext, bp_json: dict):
+        ctx.report['cpu'] = 'timeout'
+        ctx.report['cpu'] = await ctx.cpu.result(
+            ctx.session,
+            ctx.chain_url,
+            bp_json['producer_account_name']
+        )
+        return ctx.report['cpu']
@@ -1,63 +1,77 @@
 #!/usr/bin/python3
 
-import logging
+from importlib import import_module
 
-from functools import partial
-
-import trio
 import click
 
-from .db import store_reports
-from .xlsx import produce_monthly_report
-from .audit import check_all_producers
-from .utils import install_sysmted_service
-from .telegram import send_file_over_telegram
 
+'''Subcommands live in their own modules under `bp_auditor.commands` and get
+imported only when invoked, so a timer driven `gather` doesn't pay for
+openpyxl or telebot, and works without them installed
+'''
+
+
+# name -> (module:attribute, short help)
+COMMANDS = {
+    'install': ('bp_auditor.commands.install:install', 'Systemd unit installer'),
+    'gather': ('bp_auditor.commands.gather:gather', 'Run the data gatherer'),
+    'serve': ('bp_auditor.commands.serve:serve', 'Run the rolling audit daemon'),
+    'timings': (
+        'bp_auditor.commands.timings:timings',
+        'Show the slowest operations of a run'
+    ),
+    'produce': (
+        'bp_auditor.commands.produce:produce', 'Produce the monthly report'),
+    'sendtg': (
+        'bp_auditor.commands.sendtg:sendtg',
+        'Send the monthly report over telegram'
+    ),
+    'prune': ('bp_auditor.commands.prune:prune', 'Roll up and prune old runs')
+}
+
+
+# top level module of an optional dependency -> extra that installs it
+OPTIONAL_MODULES = {
+    'openpyxl': 'xlsx',
+    'telebot': 'telegram',
+    'trustme': 'mocknet'
+}
+
+
+class LazyGroup(click.Group):
+    '''Group that resolves its subcommands from `COMMANDS` on first use,
+    listing them in `--help` doesn't import anything
+    '''
+
+    def list_commands(self, ctx):
+        return list(COMMANDS)
 
-@click.group()
+    def get_command(self, ctx, name):
+        if name not in COMMANDS:
+            return None
+
+        path, _ = COMMANDS[name]
+        module, attribute = path.split(':')
+        try:
+            return getattr(import_module(module), attribute)
+
+        except ImportError as e:
+            # anything else is a broken install or a bug, not a missing extra
+            missing = (e.name or '').split('.')[0]
+            if missing not in OPTIONAL_MODULES:
+                raise
+
+            raise click.ClickException(
+                f'{name} needs {missing}, which is not installed, install the '
+                f'"{OPTIONAL_MODULES[missing]}" extra')
+
+    def format_commands(self, ctx, formatter):
+        with formatter.section('Commands'):
+            formatter.write_dl([
+                (name, short_help) for name, (_, short_help) in COMMANDS.items()
+            ])
+
+
+@click.group(cls=LazyGroup)
 def bpaudit(*args, **kwargs):
     pass
-
-@bpaudit.command()
-@click.option('--chain', '-c', default='telos-mainnet')
-@click.option('--url', '-u', default='https://mainnet.telos.net')
-@click.option('--db', '-d', default='reports.db')
-@click.option('--log-level', '-l', default='INFO')
-def install(chain, url, db, log_level):
-    logging.basicConfig(level=log_level)
-    install_sysmted_service(chain, url, db)
-
-
-@bpaudit.command()
-@click.option('--url', '-u', default='https://mainnet.telos.net')
-@click.option('--db', '-d', default='reports.db')
-@click.option('--log-level', '-l', default='INFO')
-@click.option('--concurrency', '-c', default=10)
-def gather(url, db, log_level, concurrency):
-    logging.basicConfig(level=log_level)
-    reports = trio.run(
-        partial(
-            check_all_producers,
-            url,
-            db_location=db,
-            concurrency=concurrency
-        ))
-
-    logging.info('storing to db...')
-    store_reports(db, reports)
-    logging.info('done.')
-
-@bpaudit.command()
-@click.option('--db', '-d', default='reports.db')
-@click.option('--doc', '-D', default='report.xlsx')
-@click.option('--log-level', '-l', default='INFO')
-def produce(db, doc, log_level):
-    logging.basicConfig(level=log_level)
-    produce_monthly_report(db, doc)
-
-@bpaudit.command()
-@click.option('--doc', '-D', default='report.xlsx')
-@click.option('--log-level', '-l', default='INFO')
-def sendtg(doc, log_level):
-    logging.basicConfig(level=log_level)
-    send_file_over_telegram(doc)
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+import logging
+
+from functools import partial
+
+import trio
+import click
+
+from ..db import store_reports
+from ..audit import check_all_chains
+from ..timings import Timings
+from ..trace import ChromeTracer
+
+
+@click.command()
+@click.option(
+    '--url', '-u', multiple=True, default=['https://mainnet.telos.net'])
+@click.option('--db', '-d', default='reports.db')
+@click.option('--log-level', '-l', default='INFO')
+@click.option('--concurrency', '-c', default=10)
+@click.option('--sockets', '-s', default=4)
+@click.option('--connections', default=32)
+@click.option('--connections-per-host', default=4)
+@click.option('--probe-concurrency', default=32)
+@click.option(
+    '--cpu-mode', type=click.Choice(['bulk', 'producer']), default='bulk')
+@click.option('--top', default=42)
+@click.option('--active-only', is_flag=True, default=False)
+@click.option('--deadline', default=900)
+@click.option('--trace', type=click.Path(dir_okay=False), default=None)
+@click.option(
+    '--recheck-dead', default=24.0,
+    help='hours between full checks of known dead endpoints')
+def gather(
+    url, db, log_level, concurrency, sockets,
+    connections, connections_per_host, probe_concurrency, cpu_mode,
+    top, active_only, deadline, trace, recheck_dead
+):
+    '''Run the data gatherer
+    '''
+    logging.basicConfig(level=log_level)
+    timings = Timings()
+    tracer = ChromeTracer() if trace else None
+    results = trio.run(
+        partial(
+            check_all_chains,
+            list(url),
+            db_location=db,
+            concurrency=concurrency,
+            sockets_per_producer=sockets,
+            connections=connections,
+            connections_per_host=connections_per_host,
+            probe_concurrency=probe_concurrency,
+            cpu_mode=cpu_mode,
+            top=top,
+            active_only=active_only,
+            deadline=deadline,
+            timings=timings,
+            recheck_dead=recheck_dead * 3600
+        ),
+        instruments=[tracer] if tracer else []
+    )
+
+    if tracer:
+        logging.info(f'writing trace to {trace}...')
+        tracer.write(trace)
+
+    logging.info('storing to db...')
+    for chain_url, reports in results.items():
+        if not reports:
+            logging.warning(f'{chain_url}: no reports, nothing stored')
+            continue
+
+        store_reports(
+            db,
+            reports,
+            timings=[
+                record for record in timings.records
+                if record['chain'] == chain_url
+            ],
+            chain=chain_url
+        )
+
+    logging.info('done.')
@@ -0,0 +1,20 @@
+#!/usr/bin/python3
+
+import logging
+
+import click
+
+from ..utils import install_sysmted_service
+
+
+@click.command()
+@click.option('--chain', '-c', default='telos-mainnet')
+@click.option('--url', '-u', default='https://mainnet.telos.net')
+@click.option('--db', '-d', default='reports.db')
+@click.option('--serve', is_flag=True, default=False)
+@click.option('--log-level', '-l', default='INFO')
+def install(chain, url, db, serve, log_level):
+    '''Systemd unit installer
+    '''
+    logging.basicConfig(level=log_level)
+    install_sysmted_service(chain, url, db, serve=serve)
@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+
+import logging
+
+import click
+
+from ..xlsx import produce_monthly_report
+
+
+@click.command()
+@click.option('--db', '-d', default='reports.db')
+@click.option('--doc', '-D', default='report.xlsx')
+@click.option('--since', '-s', type=click.DateTime(), default=None)
+@click.option(
+    '--chain', '-c', default=None,
+    help='Chain api url, required if the db holds runs of several chains')
+@click.option('--log-level', '-l', default='INFO')
+def produce(db, doc, since, chain, log_level):
+    '''Produce the monthly report
+    '''
+    logging.basicConfig(level=log_level)
+    try:
+        produce_monthly_report(db, doc, since=since, chain=chain)
+
+    except ValueError as e:
+        raise click.UsageError(str(e))
@@ -0,0 +1,32 @@
+#!/usr/bin/python3
+
+import logging
+
+from datetime import datetime, timedelta
+
+import click
+
+from ..db import rollup_runs_before, vacuum_db
+from ..cpu import month_key, month_start
+from ..evaluate import evaluate_report
+
+
+@click.command()
+@click.option('--db', '-d', default='reports.db')
+@click.option(
+    '--keep-days', '-k', default=90,
+    help='Runs older than this get rolled up, whole months at a time')
+@click.option('--vacuum/--no-vacuum', default=True)
+@click.option('--log-level', '-l', default='info')
+def prune(db, keep_days, vacuum, log_level):
+    '''Roll up and prune old runs
+    '''
+    logging.basicConfig(level=log_level.upper())
+
+    cutoff = month_start(
+        month_key(datetime.utcnow() - timedelta(days=keep_days)))
+    pruned = rollup_runs_before(db, cutoff, evaluate_report)
+    if vacuum:
+        vacuum_db(db)
+
+    click.echo(f'rolled up {pruned} runs from before {cutoff:%Y-%m-%d}')
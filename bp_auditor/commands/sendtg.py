@@ -0,0 +1,17 @@
+#!/usr/bin/python3
+
+import logging
+
+import click
+
+from ..telegram import send_file_over_telegram
+
+
+@click.command()
+@click.option('--doc', '-D', default='report.xlsx')
+@click.option('--log-level', '-l', default='INFO')
+def sendtg(doc, log_level):
+    '''Send the monthly report over telegram
+    '''
+    logging.basicConfig(level=log_level)
+    send_file_over_telegram(doc)
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+
+import logging
+
+import trio
+import click
+
+from ..serve import RollingAuditor
+
+
+@click.command()
+@click.option(
+    '--url', '-u', multiple=True, default=['https://mainnet.telos.net'])
+@click.option('--db', '-d', default='reports.db')
+@click.option('--log-level', '-l', default='INFO')
+@click.option('--interval', '-i', default=6.0, help='hours between audits')
+@click.option('--concurrency', '-c', default=4)
+@click.option('--sockets', '-s', default=4)
+@click.option('--connections', default=32)
+@click.option('--connections-per-host', default=4)
+@click.option('--probe-concurrency', default=32)
+@click.option('--refresh', default=600)
+@click.option(
+    '--cpu-mode', type=click.Choice(['bulk', 'producer']), default='bulk')
+@click.option('--top', default=42)
+@click.option('--active-only', is_flag=True, default=False)
+@click.option('--snapshot-hour', type=click.IntRange(0, 23), default=0)
+@click.option(
+    '--recheck-dead', default=24.0,
+    help='hours between full checks of known dead endpoints')
+def serve(
+    url, db, log_level, interval, concurrency, sockets,
+    connections, connections_per_host, probe_concurrency, refresh,
+    cpu_mode, top, active_only, snapshot_hour, recheck_dead
+):
+    '''Run the rolling audit daemon
+    '''
+    logging.basicConfig(level=log_level)
+    auditor = RollingAuditor(
+        list(url),
+        db_location=db,
+        interval=interval * 3600,
+        concurrency=concurrency,
+        sockets_per_producer=sockets,
+        connections=connections,
+        connections_per_host=connections_per_host,
+        probe_concurrency=probe_concurrency,
+        refresh=refresh,
+        cpu_mode=cpu_mode,
+        top=top,
+        active_only=active_only,
+        snapshot_hour=snapshot_hour,
+        recheck_dead=recheck_dead * 3600
+    )
+    try:
+        trio.run(auditor.run)
+
+    except KeyboardInterrupt:
+        logging.info('stopped.')
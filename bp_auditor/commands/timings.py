@@ -0,0 +1,22 @@
+#!/usr/bin/python3
+
+import click
+
+from ..db import read_run_timings
+from ..timings import summarize_timings
+
+
+@click.command()
+@click.option('--db', '-d', default='reports.db')
+@click.option('--run', '-r', type=int, default=None)
+@click.option('--limit', '-n', default=10)
+def timings(db, run, limit):
+    '''Show the slowest operations of a run
+    '''
+    run_id, records = read_run_timings(db, run_id=run)
+    if not records:
+        click.echo('no timings recorded')
+        return
+
+    click.echo(f'run {run_id}, {len(records)} timed operations\n')
+    click.echo(summarize_timings(records, limit=limit))
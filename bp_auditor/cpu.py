@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import math
+
+from datetime import datetime
+
+
+'''Running aggregate of a producer's eosmechanics:cpu benchmark results for a
+month, persisted between runs so each run only folds in the actions that
+came after the last one it saw
+'''
+
+
+# relative accuracy of the percentile sketch buckets
+SKETCH_GAMMA = 1.05
+
+
+def month_key(ts: datetime) -> str:
+    return ts.strftime('%Y-%m')
+
+
+def month_start(month: str) -> datetime:
+    return datetime.strptime(month, '%Y-%m')
+
+
+class CPUAggregate:
+
+    def __init__(
+        self,
+        owner: str,
+        month: str,
+        count: int = 0,
+        total: float = 0,
+        min_us: float | None = None,
+        max_us: float | None = None,
+        sketch: dict[int, int] | None = None,
+        last_timestamp: str | None = None,
+        last_global_sequence: int = 0
+    ):
+        self.owner = owner
+        self.month = month
+        self.count = count
+        self.total = total
+        self.min_us = min_us
+        self.max_us = max_us
+        self.sketch = sketch if sketch is not None else {}
+        self.last_timestamp = last_timestamp
+        self.last_global_sequence = last_global_sequence
+
+    def add(self, cpu_us: float):
+        self.count += 1
+        self.total += cpu_us
+        self.min_us = cpu_us if self.min_us is None else min(self.min_us, cpu_us)
+        self.max_us = cpu_us if self.max_us is None else max(self.max_us, cpu_us)
+
+        bucket = math.ceil(math.log(max(cpu_us, 1), SKETCH_GAMMA))
+        self.sketch[bucket] = self.sketch.get(bucket, 0) + 1
+
+    def fold(self, action: dict) -> bool:
+        '''Add a hyperion action to the aggregate, returns False if it was
+        already folded in on a previous run
+        '''
+        global_sequence = action.get('global_sequence', 0)
+        if global_sequence and global_sequence <= self.last_global_sequence:
+            return False
+
+        self.add(action['cpu_usage_us'])
+        self.last_global_sequence = max(
+            self.last_global_sequence, global_sequence)
+        self.last_timestamp = action.get(
+            '@timestamp', action.get('timestamp', self.last_timestamp))
+        return True
+
+    @property
+    def average(self) -> float | None:
+        return self.total / self.count if self.count else None
+
+    def percentile(self, q: float) -> float | None:
+        '''Approximate `q` (0 to 1) percentile, within SKETCH_GAMMA of the
+        real value
+        '''
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self.sketch):
+            seen += self.sketch[bucket]
+            if seen > rank:
+                return min(SKETCH_GAMMA ** bucket, self.max_us)
+
+        return self.max_us
+
+    def to_dict(self) -> dict:
+        return {
+            'owner': self.owner,
+            'month': self.month,
+            'count': self.count,
+            'total': self.total,
+            'min_us': self.min_us,
+            'max_us': self.max_us,
+            'sketch': self.sketch,
+            'last_timestamp': self.last_timestamp,
+            'last_global_sequence': self.last_global_sequence
+        }
+
+    def summary(self) -> str:
+        if not self.count:
+            return 'bp hasn\'t called eosmechanics:cpu this month'
+
+        return f'{self.average:.2f} us'
@@ -1,48 +1,1206 @@
 #!/usr/bin/env python3
 
+import zlib
 import json
 import sqlite3
+import hashlib
 
 from datetime import datetime
 
+from .timings import TIMING_FIELDS
 
-def store_reports(db_location: str, reports: list[dict]):
-    # Connect to or create a new SQLite database
+
+'''Reports database, each gather run gets a row in `runs`, each producer
+audited on that run a row in `producer_reports` and each individual check
+result a row on its check table.
+'''
+
+
+def _execute_script(conn, script: str):
+    # unlike `executescript` this keeps every statement in the current
+    # transaction, so a failed migration gets rolled back as a whole
+    for statement in script.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _migrate_v1(conn):
+    _execute_script(conn, '''
+        CREATE TABLE runs (
+            id INTEGER PRIMARY KEY,
+            timestamp TIMESTAMP NOT NULL
+        );
+        CREATE INDEX runs_timestamp ON runs (timestamp);
+
+        CREATE TABLE producer_reports (
+            id INTEGER PRIMARY KEY,
+            run_id INTEGER NOT NULL REFERENCES runs (id),
+            timestamp TIMESTAMP NOT NULL,
+            owner TEXT,
+            url TEXT,
+            bp_json TEXT,
+            exception TEXT
+        );
+        CREATE INDEX producer_reports_timestamp
+            ON producer_reports (timestamp);
+        CREATE INDEX producer_reports_owner_timestamp
+            ON producer_reports (owner, timestamp);
+        CREATE INDEX producer_reports_run ON producer_reports (run_id);
+
+        CREATE TABLE tls_checks (
+            report_id INTEGER NOT NULL REFERENCES producer_reports (id),
+            position INTEGER NOT NULL,
+            node_type TEXT,
+            endpoint TEXT,
+            result TEXT
+        );
+        CREATE INDEX tls_checks_report ON tls_checks (report_id);
+
+        CREATE TABLE p2p_checks (
+            report_id INTEGER NOT NULL REFERENCES producer_reports (id),
+            position INTEGER NOT NULL,
+            node_type TEXT,
+            endpoint TEXT,
+            result TEXT
+        );
+        CREATE INDEX p2p_checks_report ON p2p_checks (report_id);
+
+        CREATE TABLE api_endpoints (
+            report_id INTEGER NOT NULL REFERENCES producer_reports (id),
+            position INTEGER NOT NULL,
+            node_type TEXT,
+            endpoint TEXT
+        );
+        CREATE INDEX api_endpoints_report ON api_endpoints (report_id);
+
+        CREATE TABLE history_checks (
+            report_id INTEGER NOT NULL REFERENCES producer_reports (id),
+            sample TEXT NOT NULL,
+            block_id TEXT,
+            block_num INTEGER,
+            error TEXT
+        );
+        CREATE INDEX history_checks_report ON history_checks (report_id);
+
+        CREATE TABLE cpu_checks (
+            report_id INTEGER PRIMARY KEY REFERENCES producer_reports (id),
+            avg_us REAL,
+            result TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS http_cache (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            body BLOB,
+            updated TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS bp_json_paths (
+            url TEXT PRIMARY KEY,
+            path TEXT
+        );
+    ''')
+
+
+def _migrate_v2(conn):
+    _execute_script(conn, '''
+        CREATE TABLE render_cache (
+            run_id INTEGER NOT NULL REFERENCES runs (id),
+            position INTEGER NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            version INTEGER NOT NULL,
+            row TEXT NOT NULL
+        );
+        CREATE INDEX render_cache_run ON render_cache (run_id);
+        CREATE INDEX render_cache_timestamp ON render_cache (timestamp)
+    ''')
+
+
+def _migrate_v3(conn):
+    # tls handshake details, all null when the probe failed
+    for column in [
+        'version TEXT',
+        'cipher TEXT',
+        'alpn TEXT',
+        'cert_expiry TIMESTAMP',
+        'connect_time REAL',
+        'handshake_time REAL'
+    ]:
+        conn.execute(f'ALTER TABLE tls_checks ADD COLUMN {column}')
+
+
+def _migrate_v4(conn):
+    _execute_script(conn, '''
+        CREATE TABLE cpu_aggregates (
+            chain TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            month TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            total REAL NOT NULL,
+            min_us REAL,
+            max_us REAL,
+            sketch TEXT NOT NULL,
+            last_timestamp TEXT,
+            last_global_sequence INTEGER NOT NULL,
+            PRIMARY KEY (chain, owner, month)
+        )
+    ''')
+
+
+def _migrate_v5(conn):
+    _execute_script(conn, '''
+        CREATE TABLE cpu_scan_cursors (
+            chain TEXT NOT NULL,
+            month TEXT NOT NULL,
+            last_timestamp TEXT,
+            last_global_sequence INTEGER NOT NULL,
+            PRIMARY KEY (chain, month)
+        )
+    ''')
+
+
+def _migrate_v6(conn):
+    # position and votes of the producer in the table snapshot the run audited
+    for column in ['rank INTEGER', 'total_votes REAL']:
+        conn.execute(f'ALTER TABLE producer_reports ADD COLUMN {column}')
+
+
+def _migrate_v7(conn):
+    _execute_script(conn, '''
+        CREATE TABLE latency_samples (
+            kind TEXT NOT NULL,
+            host TEXT NOT NULL,
+            duration REAL NOT NULL,
+            timestamp TIMESTAMP NOT NULL
+        );
+        CREATE INDEX latency_samples_timestamp
+            ON latency_samples (timestamp);
+    ''')
+
+
+def _migrate_v8(conn):
+    _execute_script(conn, '''
+        CREATE TABLE request_timings (
+            run_id INTEGER NOT NULL REFERENCES runs (id),
+            owner TEXT,
+            check_name TEXT,
+            kind TEXT NOT NULL,
+            target TEXT,
+            attempt INTEGER,
+            dns REAL,
+            connect REAL,
+            tls REAL,
+            first_byte REAL,
+            total REAL,
+            bytes INTEGER,
+            status INTEGER,
+            error TEXT
+        );
+        CREATE INDEX request_timings_run ON request_timings (run_id);
+    ''')
+
+
+def _migrate_v9(conn):
+    # api url of the chain the run audited, null on runs stored before
+    conn.execute('ALTER TABLE runs ADD COLUMN chain TEXT')
+
+
+def _migrate_v10(conn):
+    # latest report of each producer written by the serve daemon as audits
+    # complete, the daily snapshot run is taken from here
+    _execute_script(conn, '''
+        CREATE TABLE live_reports (
+            chain TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            report TEXT NOT NULL,
+            PRIMARY KEY (chain, owner)
+        )
+    ''')
+
+
+def _migrate_v11(conn):
+    _execute_script(conn, '''
+        CREATE TABLE endpoint_health (
+            kind TEXT NOT NULL,
+            host TEXT NOT NULL,
+            port INTEGER NOT NULL,
+            last_success TIMESTAMP,
+            last_check TIMESTAMP,
+            last_full_check TIMESTAMP,
+            consecutive_failures INTEGER NOT NULL,
+            latency REAL,
+            last_error TEXT,
+            PRIMARY KEY (kind, host, port)
+        )
+    ''')
+
+
+def _migrate_v12(conn):
+    # tracebacks repeat run after run, keep each distinct one once
+    _execute_script(conn, '''
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY,
+            digest TEXT NOT NULL UNIQUE,
+            body BLOB NOT NULL
+        );
+        ALTER TABLE producer_reports
+            ADD COLUMN exception_id INTEGER REFERENCES messages (id);
+
+        CREATE TABLE monthly_rollups (
+            chain TEXT NOT NULL,
+            month TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            runs INTEGER NOT NULL,
+            exceptions INTEGER NOT NULL,
+            bp_json_ok INTEGER NOT NULL,
+            tls_ok INTEGER NOT NULL,
+            p2p_ok INTEGER NOT NULL,
+            history_ok INTEGER NOT NULL,
+            cpu_green INTEGER NOT NULL,
+            cpu_yellow INTEGER NOT NULL,
+            cpu_red INTEGER NOT NULL,
+            PRIMARY KEY (chain, month, owner)
+        )
+    ''')
+
+    for (text,) in conn.execute(
+        'SELECT DISTINCT exception FROM producer_reports '
+        'WHERE exception IS NOT NULL'
+    ).fetchall():
+        conn.execute(
+            'UPDATE producer_reports SET exception_id = ?, exception = NULL '
+            'WHERE exception = ?',
+            (_message_id(conn, text), text)
+        )
+
+
+# each entry upgrades the schema by one version, tracked by user_version
+_migrations = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+    _migrate_v8,
+    _migrate_v9,
+    _migrate_v10,
+    _migrate_v11,
+    _migrate_v12
+]
+
+
+# first byte of every compressed payload, tells how to read the rest
+_PAYLOAD_ZLIB = b'\x01'
+
+
+def _compress(data: bytes) -> bytes:
+    return _PAYLOAD_ZLIB + zlib.compress(data)
+
+
+def _decompress(payload: bytes | str) -> bytes:
+    '''Inverse of `_compress`, payloads stored before compression come back
+    as they are
+    '''
+    if isinstance(payload, str):
+        return payload.encode('utf-8')
+
+    if payload[:1] == _PAYLOAD_ZLIB:
+        return zlib.decompress(payload[1:])
+
+    return payload
+
+
+def _pack(value) -> bytes:
+    return _compress(json.dumps(value).encode('utf-8'))
+
+
+def _unpack(payload: bytes | str):
+    return json.loads(_decompress(payload))
+
+
+def _message_id(conn, text: str) -> int:
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    conn.execute(
+        'INSERT OR IGNORE INTO messages (digest, body) VALUES (?, ?)',
+        (digest, _compress(text.encode('utf-8')))
+    )
+    return conn.execute(
+        'SELECT id FROM messages WHERE digest = ?', (digest,)).fetchone()[0]
+
+
+def open_db(db_location: str) -> sqlite3.Connection:
+    '''Connect to or create the reports database and bring its schema up to
+    date
+    '''
     conn = sqlite3.connect(db_location)
 
-    # Create a table with timestamp and text columns
-    conn.execute('''CREATE TABLE IF NOT EXISTS reports
-                     (timestamp TIMESTAMP, text BLOB)''')
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for i, migration in enumerate(
+        _migrations[version:], start=version + 1):
+        conn.execute('BEGIN')
+        try:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {i}')
+            conn.execute('COMMIT')
 
-    # Convert the JSON document to a string
-    json_str = json.dumps(reports)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
 
-    # Get the current UTC timestamp
-    now = datetime.utcnow()
+    # import the old one json blob per run table, done once the schema is
+    # up to date so the rows go through the current insert code
+    legacy = conn.execute(
+        'SELECT name FROM sqlite_master '
+        'WHERE type = \'table\' AND name = \'reports\'').fetchone()
 
-    # Insert the JSON document and timestamp into the table
-    conn.execute("INSERT INTO reports (timestamp, text) VALUES (?, ?)", (now, json_str))
+    if legacy:
+        with conn:
+            for timestamp, text in conn.execute(
+                'SELECT timestamp, text FROM reports ORDER BY rowid'
+            ).fetchall():
+                _insert_run(conn, timestamp, json.loads(text))
 
-    # Commit the changes to the database
-    conn.commit()
+            conn.execute('DROP TABLE reports')
+
+    return conn
+
+
+def _parse_cpu(cpu: str) -> float | None:
+    if isinstance(cpu, str) and cpu.endswith(' us'):
+        try:
+            return float(cpu.split(' ')[0])
+
+        except ValueError:
+            ...
+
+    return None
+
+
+_TLS_DETAILS = [
+    'version',
+    'cipher',
+    'alpn',
+    'cert_expiry',
+    'connect_time',
+    'handshake_time'
+]
+
+
+def _insert_report(conn, run_id: int, timestamp: str, report: dict):
+    exception = report.get('exception')
+    cursor = conn.execute(
+        'INSERT INTO producer_reports '
+        '(run_id, timestamp, owner, url, bp_json, exception_id, '
+        'rank, total_votes) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (
+            run_id,
+            timestamp,
+            report.get('owner'),
+            report.get('url'),
+            report.get('bp_json'),
+            _message_id(conn, exception) if exception is not None else None,
+            report.get('rank'),
+            report.get('total_votes')
+        )
+    )
+    report_id = cursor.lastrowid
+
+    ssl_endpoints = report.get('ssl_endpoints', [])
+    ssl_details = report.get('ssl_details', [None] * len(ssl_endpoints))
+    rows = []
+    for i, ((node_type, endpoint, result), details) in enumerate(
+        zip(ssl_endpoints, ssl_details)):
+        details = details or {}
+        rows.append((
+            report_id, i, json.dumps(node_type), endpoint, result,
+            *(details.get(field) for field in _TLS_DETAILS)
+        ))
+
+    conn.executemany(
+        'INSERT INTO tls_checks '
+        '(report_id, position, node_type, endpoint, result, '
+        f'{", ".join(_TLS_DETAILS)}) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        rows
+    )
+
+    conn.executemany(
+        'INSERT INTO p2p_checks '
+        '(report_id, position, node_type, endpoint, result) '
+        'VALUES (?, ?, ?, ?, ?)',
+        [
+            (report_id, i, json.dumps(node_type), endpoint, result)
+            for i, (node_type, endpoint, result) in enumerate(
+                report.get('p2p_endpoints', []))
+        ]
+    )
+
+    conn.executemany(
+        'INSERT INTO api_endpoints '
+        '(report_id, position, node_type, endpoint) VALUES (?, ?, ?, ?)',
+        [
+            (report_id, i, json.dumps(node_type), endpoint)
+            for i, (node_type, endpoint) in enumerate(
+                report.get('api_endpoints', []))
+        ]
+    )
+
+    for sample, result in report.get('history', {}).items():
+        if isinstance(result, str):
+            row = (report_id, sample, None, None, result)
+
+        else:
+            block_id, block_num = result
+            row = (report_id, sample, block_id, block_num, None)
+
+        conn.execute(
+            'INSERT INTO history_checks '
+            '(report_id, sample, block_id, block_num, error) '
+            'VALUES (?, ?, ?, ?, ?)',
+            row
+        )
+
+    if 'cpu' in report:
+        conn.execute(
+            'INSERT INTO cpu_checks (report_id, avg_us, result) '
+            'VALUES (?, ?, ?)',
+            (report_id, _parse_cpu(report['cpu']), report['cpu'])
+        )
+
+
+def _insert_run(
+    conn,
+    timestamp: str,
+    reports: list[dict],
+    timings: list[dict] | None = None,
+    chain: str | None = None
+) -> int:
+    run_id = conn.execute(
+        'INSERT INTO runs (timestamp, chain) VALUES (?, ?)',
+        (timestamp, chain)
+    ).lastrowid
+
+    for report in reports:
+        _insert_report(conn, run_id, timestamp, report)
+
+    conn.executemany(
+        'INSERT INTO request_timings '
+        f'(run_id, {", ".join(TIMING_FIELDS)}) '
+        f'VALUES (?, {", ".join("?" * len(TIMING_FIELDS))})',
+        [
+            (run_id, *(record[field] for field in TIMING_FIELDS))
+            for record in timings or []
+        ]
+    )
+
+    return run_id
+
+
+def store_reports(
+    db_location: str,
+    reports: list[dict],
+    timings: list[dict] | None = None,
+    chain: str | None = None
+):
+    conn = open_db(db_location)
+
+    # Get the current UTC timestamp
+    now = str(datetime.utcnow())
+
+    with conn:
+        _insert_run(conn, now, reports, timings, chain)
 
-    # Close the connection to the database
     conn.close()
 
 
-def read_all_reports_from(db_location: str, ts: datetime):
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_location)
-    c = conn.cursor()
+def _read_reports(conn, where: str, params: tuple):
+    '''Rebuild report dicts, in the same shape `check_producer` returns them,
+    for all producer_reports rows matching `where`, ordered by run
+    '''
+    rows = conn.execute(
+        'SELECT producer_reports.id, run_id, timestamp, owner, url, bp_json, '
+        'exception, messages.body, rank, total_votes FROM producer_reports '
+        'LEFT JOIN messages ON messages.id = producer_reports.exception_id '
+        f'WHERE {where} ORDER BY run_id, producer_reports.id',
+        params
+    ).fetchall()
 
-    # Select all rows from the table with timestamp greater than or equal to the first day of the current month
-    c.execute("SELECT * FROM reports WHERE timestamp >= ?", (ts,))
+    reports = {}
+    for (report_id, run_id, timestamp, owner, url, bp_json, exception,
+        message, rank, total_votes) in rows:
+        if message is not None:
+            exception = _decompress(message).decode('utf-8')
 
-    for row in c:
-        timestamp, text = row
-        reports = json.loads(text)
+        report = {'owner': owner, 'url': url}
+        # runs before the producer snapshot was recorded have no rank
+        if rank is not None:
+            report['rank'] = rank
+            report['total_votes'] = total_votes
 
+        if exception is not None:
+            report['exception'] = exception
+
+        else:
+            report['bp_json'] = bp_json
+
+        if bp_json == 'ok':
+            report['ssl_endpoints'] = []
+            report['p2p_endpoints'] = []
+            report['api_endpoints'] = []
+
+        reports[report_id] = (run_id, timestamp, report)
+
+    ids = f'SELECT id FROM producer_reports WHERE {where}'
+
+    for report_id, node_type, endpoint, result, *details in conn.execute(
+        'SELECT report_id, node_type, endpoint, result, '
+        f'{", ".join(_TLS_DETAILS)} FROM tls_checks '
+        f'WHERE report_id IN ({ids}) ORDER BY report_id, position',
+        params
+    ):
+        report = reports[report_id][2]
+        report.setdefault('ssl_endpoints', []).append(
+            [json.loads(node_type), endpoint, result])
+        report.setdefault('ssl_details', []).append(
+            dict(zip(_TLS_DETAILS, details)) if details[0] else None)
+
+    for report in [report for _, _, report in reports.values()]:
+        # older runs didn't record handshake details
+        if not any(report.get('ssl_details', [])):
+            report.pop('ssl_details', None)
+
+    for report_id, node_type, endpoint, result in conn.execute(
+        'SELECT report_id, node_type, endpoint, result FROM p2p_checks '
+        f'WHERE report_id IN ({ids}) ORDER BY report_id, position',
+        params
+    ):
+        reports[report_id][2].setdefault('p2p_endpoints', []).append(
+            [json.loads(node_type), endpoint, result])
+
+    for report_id, node_type, endpoint in conn.execute(
+        'SELECT report_id, node_type, endpoint FROM api_endpoints '
+        f'WHERE report_id IN ({ids}) ORDER BY report_id, position',
+        params
+    ):
+        reports[report_id][2].setdefault('api_endpoints', []).append(
+            [json.loads(node_type), endpoint])
+
+    for report_id, sample, block_id, block_num, error in conn.execute(
+        'SELECT report_id, sample, block_id, block_num, error '
+        f'FROM history_checks WHERE report_id IN ({ids})',
+        params
+    ):
+        history = reports[report_id][2].setdefault('history', {})
+        history[sample] = error if error is not None else [block_id, block_num]
+
+    for report_id, result in conn.execute(
+        f'SELECT report_id, result FROM cpu_checks WHERE report_id IN ({ids})',
+        params
+    ):
+        reports[report_id][2]['cpu'] = result
+
+    return reports.values()
+
+
+def _select_runs(conn, ts: datetime, chain: str | None) -> list[tuple]:
+    if chain is None:
+        return conn.execute(
+            'SELECT id, timestamp FROM runs WHERE timestamp >= ? ORDER BY id',
+            (str(ts),)
+        ).fetchall()
+
+    return conn.execute(
+        'SELECT id, timestamp FROM runs '
+        'WHERE timestamp >= ? AND chain = ? ORDER BY id',
+        (str(ts), chain)
+    ).fetchall()
+
+
+def read_run_chains(db_location: str, ts: datetime) -> list[str]:
+    '''Chain api urls of the runs stored since `ts`, runs from before chains
+    were recorded are left out
+    '''
+    conn = open_db(db_location)
+    chains = [
+        chain
+        for (chain,) in conn.execute(
+            'SELECT DISTINCT chain FROM runs '
+            'WHERE timestamp >= ? AND chain IS NOT NULL ORDER BY chain',
+            (str(ts),)
+        )
+    ]
+    conn.close()
+    return chains
+
+
+def read_all_reports_from(
+    db_location: str,
+    ts: datetime,
+    chain: str | None = None
+):
+    '''Yield (timestamp, reports) for every run since `ts`, one run at a time
+    so only a single run is ever decoded in memory. With `chain` only the runs
+    of that chain api url are read, which excludes runs stored before chains
+    were recorded.
+    '''
+    conn = open_db(db_location)
+
+    runs = _select_runs(conn, ts, chain)
+
+    for run_id, timestamp in runs:
+        reports = [
+            report
+            for _run_id, _timestamp, report in _read_reports(
+                conn, 'run_id = ?', (run_id,))
+        ]
         yield (timestamp, reports)
 
-    # Close the connection to the database
+    conn.close()
+
+
+def read_rendered_rows_from(
+    db_location: str,
+    ts: datetime,
+    version: int,
+    render,
+    chain: str | None = None
+):
+    '''Yield (timestamp, rows) for every run since `ts`, where rows are the
+    already rendered reports of that run. Runs rendered before with the same
+    `version` come straight from the render cache, new ones get rendered
+    with `render(timestamp, report)` and cached for the next call. With
+    `chain` only the runs of that chain api url are read, which excludes runs
+    stored before chains were recorded.
+    '''
+    conn = open_db(db_location)
+
+    runs = _select_runs(conn, ts, chain)
+
+    cached = set(row[0] for row in conn.execute(
+        'SELECT DISTINCT run_id FROM render_cache '
+        'WHERE timestamp >= ? AND version = ?',
+        (str(ts), version)
+    ))
+
+    for run_id, timestamp in runs:
+        if run_id in cached:
+            rows = [
+                _unpack(row)
+                for (row,) in conn.execute(
+                    'SELECT row FROM render_cache '
+                    'WHERE run_id = ? ORDER BY position',
+                    (run_id,)
+                )
+            ]
+
+        else:
+            rows = [
+                render(timestamp, report)
+                for _run_id, _timestamp, report in _read_reports(
+                    conn, 'run_id = ?', (run_id,))
+            ]
+
+            with conn:
+                conn.execute(
+                    'DELETE FROM render_cache WHERE run_id = ?', (run_id,))
+                conn.executemany(
+                    'INSERT INTO render_cache '
+                    '(run_id, position, timestamp, version, row) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [
+                        (run_id, i, timestamp, version, _pack(row))
+                        for i, row in enumerate(rows)
+                    ]
+                )
+
+        yield (timestamp, rows)
+
+    conn.close()
+
+
+def read_producer_reports(
+    db_location: str,
+    owner: str,
+    ts: datetime = datetime.min
+) -> list[tuple[str, dict]]:
+    '''Get (timestamp, report) for each run since `ts` for a single producer
+    '''
+    conn = open_db(db_location)
+
+    reports = [
+        (timestamp, report)
+        for _run_id, timestamp, report in _read_reports(
+            conn, 'owner = ? AND timestamp >= ?', (owner, str(ts)))
+    ]
+
+    conn.close()
+    return reports
+
+
+def read_http_cache(db_location: str) -> tuple[dict, dict]:
+    '''Load the conditional GET cache entries and the last working bp.json
+    path for each producer url
+    '''
+    conn = open_db(db_location)
+
+    entries = {
+        url: {
+            'etag': etag,
+            'last_modified': last_modified,
+            'body': _decompress(body)
+        }
+        for url, etag, last_modified, body in conn.execute(
+            'SELECT url, etag, last_modified, body FROM http_cache')
+    }
+    paths = dict(conn.execute('SELECT url, path FROM bp_json_paths'))
+
+    conn.close()
+    return entries, paths
+
+
+def store_http_cache(db_location: str, entries: dict, paths: dict):
+    conn = open_db(db_location)
+
+    now = str(datetime.utcnow())
+    with conn:
+        conn.execute('DELETE FROM http_cache')
+        conn.executemany(
+            'INSERT INTO http_cache (url, etag, last_modified, body, updated) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [
+                (
+                    url, e['etag'], e['last_modified'],
+                    _compress(e['body']), now
+                )
+                for url, e in entries.items()
+            ]
+        )
+        conn.execute('DELETE FROM bp_json_paths')
+        conn.executemany(
+            'INSERT INTO bp_json_paths (url, path) VALUES (?, ?)',
+            list(paths.items())
+        )
+
+    conn.close()
+
+
+_CPU_AGGREGATE_FIELDS = [
+    'owner',
+    'month',
+    'count',
+    'total',
+    'min_us',
+    'max_us',
+    'sketch',
+    'last_timestamp',
+    'last_global_sequence'
+]
+
+
+def read_cpu_aggregates(db_location: str, chain: str, month: str) -> list[dict]:
+    '''Load the eosmechanics:cpu running aggregates of every producer on
+    `chain` for `month`
+    '''
+    conn = open_db(db_location)
+
+    aggregates = []
+    for row in conn.execute(
+        f'SELECT {", ".join(_CPU_AGGREGATE_FIELDS)} FROM cpu_aggregates '
+        'WHERE chain = ? AND month = ?',
+        (chain, month)
+    ):
+        aggregate = dict(zip(_CPU_AGGREGATE_FIELDS, row))
+        aggregate['sketch'] = {
+            int(bucket): count
+            for bucket, count in json.loads(aggregate['sketch']).items()
+        }
+        aggregates.append(aggregate)
+
+    conn.close()
+    return aggregates
+
+
+def store_cpu_aggregates(db_location: str, chain: str, aggregates: list[dict]):
+    conn = open_db(db_location)
+
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO cpu_aggregates '
+            f'(chain, {", ".join(_CPU_AGGREGATE_FIELDS)}) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [
+                (
+                    chain,
+                    *(
+                        json.dumps(aggregate[field])
+                        if field == 'sketch' else aggregate[field]
+                        for field in _CPU_AGGREGATE_FIELDS
+                    )
+                )
+                for aggregate in aggregates
+            ]
+        )
+
+    conn.close()
+
+
+def read_cpu_scan_cursor(db_location: str, chain: str, month: str) -> dict:
+    '''Where the bulk eosmechanics:cpu scan of `chain` stopped on `month`,
+    empty if it hasn't run yet
+    '''
+    conn = open_db(db_location)
+
+    row = conn.execute(
+        'SELECT last_timestamp, last_global_sequence FROM cpu_scan_cursors '
+        'WHERE chain = ? AND month = ?',
+        (chain, month)
+    ).fetchone()
+
+    conn.close()
+
+    if row is None:
+        return {}
+
+    return {'last_timestamp': row[0], 'last_global_sequence': row[1]}
+
+
+def store_cpu_scan_cursor(
+    db_location: str,
+    chain: str,
+    month: str,
+    cursor: dict
+):
+    if not cursor:
+        return
+
+    conn = open_db(db_location)
+
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO cpu_scan_cursors '
+            '(chain, month, last_timestamp, last_global_sequence) '
+            'VALUES (?, ?, ?, ?)',
+            (
+                chain, month,
+                cursor.get('last_timestamp'),
+                cursor.get('last_global_sequence', 0)
+            )
+        )
+
+    conn.close()
+
+
+def read_latency_samples(
+    db_location: str,
+    since: datetime
+) -> dict[tuple[str, str], list[float]]:
+    '''Durations of successful network operations recorded since `since`,
+    keyed by operation kind and host
+    '''
+    conn = open_db(db_location)
+
+    samples = {}
+    for kind, host, duration in conn.execute(
+        'SELECT kind, host, duration FROM latency_samples WHERE timestamp >= ?',
+        (str(since),)
+    ):
+        samples.setdefault((kind, host), []).append(duration)
+
+    conn.close()
+    return samples
+
+
+def store_latency_samples(
+    db_location: str,
+    samples: dict[tuple[str, str], list[float]],
+    prune_before: datetime | None = None
+):
+    '''Record a run's latency samples, dropping the ones older than
+    `prune_before`
+    '''
+    conn = open_db(db_location)
+
+    now = str(datetime.utcnow())
+    with conn:
+        conn.executemany(
+            'INSERT INTO latency_samples (kind, host, duration, timestamp) '
+            'VALUES (?, ?, ?, ?)',
+            [
+                (kind, host, duration, now)
+                for (kind, host), durations in samples.items()
+                for duration in durations
+            ]
+        )
+
+        if prune_before:
+            conn.execute(
+                'DELETE FROM latency_samples WHERE timestamp < ?',
+                (str(prune_before),)
+            )
+
+    conn.close()
+
+
+def read_run_timings(
+    db_location: str,
+    run_id: int | None = None
+) -> tuple[int | None, list[dict]]:
+    '''Timing records of run `run_id`, the latest run that has any if not
+    given, returns the run id along with them
+    '''
+    conn = open_db(db_location)
+
+    if run_id is None:
+        run_id = conn.execute(
+            'SELECT MAX(run_id) FROM request_timings').fetchone()[0]
+
+    records = [
+        dict(zip(TIMING_FIELDS, row))
+        for row in conn.execute(
+            f'SELECT {", ".join(TIMING_FIELDS)} FROM request_timings '
+            'WHERE run_id = ?',
+            (run_id,)
+        )
+    ]
+
+    conn.close()
+    return run_id, records
+
+
+def store_live_report(db_location: str, chain: str, report: dict):
+    '''Replace the latest report of `report`'s owner on `chain`
+    '''
+    conn = open_db(db_location)
+
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO live_reports '
+            '(chain, owner, timestamp, report) VALUES (?, ?, ?, ?)',
+            (
+                chain,
+                report['owner'],
+                str(datetime.utcnow()),
+                _pack(report)
+            )
+        )
+
+    conn.close()
+
+
+def read_live_reports(
+    db_location: str,
+    chain: str,
+    since: datetime | None = None
+) -> list[dict]:
+    '''Latest report of every producer on `chain`, only the ones written
+    after `since` if given
+    '''
+    conn = open_db(db_location)
+
+    reports = [
+        _unpack(report)
+        for (report,) in conn.execute(
+            'SELECT report FROM live_reports '
+            'WHERE chain = ? AND timestamp >= ? ORDER BY owner',
+            (chain, str(since or datetime.min))
+        )
+    ]
+
+    conn.close()
+    return reports
+
+
+_HEALTH_FIELDS = [
+    'last_success',
+    'last_check',
+    'last_full_check',
+    'consecutive_failures',
+    'latency',
+    'last_error'
+]
+
+
+def _parse_timestamp(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+def read_endpoint_health(
+    db_location: str
+) -> dict[tuple[str, str, int], dict]:
+    '''Health history of every probed endpoint keyed by kind, host and port
+    '''
+    conn = open_db(db_location)
+
+    entries = {}
+    for kind, host, port, *fields in conn.execute(
+        f'SELECT kind, host, port, {", ".join(_HEALTH_FIELDS)} '
+        'FROM endpoint_health'
+    ):
+        entry = dict(zip(_HEALTH_FIELDS, fields))
+        for field in ['last_success', 'last_check', 'last_full_check']:
+            entry[field] = _parse_timestamp(entry[field])
+
+        entries[(kind, host, port)] = entry
+
+    conn.close()
+    return entries
+
+
+def store_endpoint_health(
+    db_location: str,
+    entries: dict[tuple[str, str, int], dict]
+):
+    conn = open_db(db_location)
+
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO endpoint_health '
+            f'(kind, host, port, {", ".join(_HEALTH_FIELDS)}) '
+            f'VALUES (?, ?, ?, {", ".join("?" * len(_HEALTH_FIELDS))})',
+            [
+                (
+                    kind, host, port,
+                    *(
+                        str(entry[field])
+                        if isinstance(entry[field], datetime)
+                        else entry[field]
+                        for field in _HEALTH_FIELDS
+                    )
+                )
+                for (kind, host, port), entry in entries.items()
+            ]
+        )
+
+    conn.close()
+
+
+_ROLLUP_COUNTS = [
+    'runs',
+    'exceptions',
+    'bp_json_ok',
+    'tls_ok',
+    'p2p_ok',
+    'history_ok',
+    'cpu_green',
+    'cpu_yellow',
+    'cpu_red'
+]
+
+
+def _delete_run(conn, run_id: int):
+    reports = 'SELECT id FROM producer_reports WHERE run_id = ?'
+    for table in [
+        'tls_checks', 'p2p_checks', 'api_endpoints', 'history_checks',
+        'cpu_checks'
+    ]:
+        conn.execute(
+            f'DELETE FROM {table} WHERE report_id IN ({reports})', (run_id,))
+
+    for table in ['producer_reports', 'render_cache', 'request_timings']:
+        conn.execute(f'DELETE FROM {table} WHERE run_id = ?', (run_id,))
+
+    conn.execute('DELETE FROM runs WHERE id = ?', (run_id,))
+
+
+def rollup_runs_before(db_location: str, ts: datetime, evaluate) -> int:
+    '''Fold every run older than `ts` into the monthly rollups of its chain
+    and delete it, `evaluate(timestamp, report)` judges each report the way
+    the monthly report does. Each run is folded and deleted in a single
+    transaction, returns how many were.
+    '''
+    conn = open_db(db_location)
+
+    runs = conn.execute(
+        'SELECT id, timestamp, chain FROM runs WHERE timestamp < ? ORDER BY id',
+        (str(ts),)
+    ).fetchall()
+
+    # exception reports of the legacy format only carry the producer url,
+    # they get the owner of any other report of that url or the url itself,
+    # read before runs start getting deleted
+    owners = dict(conn.execute(
+        'SELECT url, owner FROM producer_reports '
+        'WHERE url IS NOT NULL AND owner IS NOT NULL ORDER BY id'
+    ))
+
+    for run_id, timestamp, chain in runs:
+        month = timestamp[:7]
+        rows = []
+        for _run_id, _timestamp, report in _read_reports(
+            conn, 'run_id = ?', (run_id,)):
+            row = evaluate(timestamp, report)
+            rows.append((
+                chain or '', month,
+                report.get('owner') or owners.get(
+                    report.get('url'), report.get('url') or ''),
+                1,
+                int(row['exception'] is not None),
+                int(report.get('bp_json') == 'ok'),
+                int(bool(row['tls'])),
+                int(bool(row['p2p'])),
+                int(bool(row['history'])),
+                int(row['cpu_rank'] == 0),
+                int(row['cpu_rank'] == 1),
+                int(row['cpu_rank'] == 2)
+            ))
+
+        with conn:
+            conn.executemany(
+                'INSERT INTO monthly_rollups '
+                f'(chain, month, owner, {", ".join(_ROLLUP_COUNTS)}) '
+                f'VALUES (?, ?, ?, {", ".join("?" * len(_ROLLUP_COUNTS))}) '
+                'ON CONFLICT (chain, month, owner) DO UPDATE SET ' +
+                ', '.join(
+                    f'{field} = {field} + excluded.{field}'
+                    for field in _ROLLUP_COUNTS
+                ),
+                rows
+            )
+            _delete_run(conn, run_id)
+
+    with conn:
+        conn.execute(
+            'DELETE FROM messages WHERE id NOT IN ('
+            'SELECT exception_id FROM producer_reports '
+            'WHERE exception_id IS NOT NULL)'
+        )
+
+    conn.close()
+    return len(runs)
+
+
+def read_monthly_rollups(
+    db_location: str,
+    chain: str | None = None
+) -> list[dict]:
+    '''Monthly compliance counts of every producer, of runs already rolled
+    up, runs stored before chains were recorded have an empty chain
+    '''
+    conn = open_db(db_location)
+
+    fields = ['chain', 'month', 'owner', *_ROLLUP_COUNTS]
+    query = f'SELECT {", ".join(fields)} FROM monthly_rollups'
+    params = ()
+    if chain is not None:
+        query += ' WHERE chain = ?'
+        params = (chain,)
+
+    rollups = [
+        dict(zip(fields, row))
+        for row in conn.execute(query + ' ORDER BY chain, month, owner', params)
+    ]
+
+    conn.close()
+    return rollups
+
+
+def vacuum_db(db_location: str):
+    '''Give the space freed by deleted rows back to the filesystem
+    '''
+    conn = open_db(db_location)
+    conn.execute('VACUUM')
     conn.close()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import socket
+import logging
+
+from collections import defaultdict
+
+import trio
+
+from .utils import SingleFlight
+from .timings import add_dns_time
+
+
+'''Per run hostname resolution cache, installed as trio's custom hostname
+resolver so every connection made during a gather (asks requests, tls
+probes, p2p port checks) goes through it
+'''
+
+
+class CachingResolver(trio.abc.HostnameResolver):
+    '''Caches `getaddrinfo` answers for `ttl` seconds and failures for
+    `negative_ttl` seconds, concurrent lookups of the same name share a
+    single thread pool call. Answers are cached independent of the port so
+    the api, ssl and p2p endpoints of a host share one lookup.
+
+    The duration of every real lookup is recorded per host in `timings`.
+
+    `overrides` maps host names to the address they should resolve to, like
+    an /etc/hosts of the run.
+    '''
+
+    def __init__(
+        self,
+        ttl: float = 300,
+        negative_ttl: float = 60,
+        overrides: dict[str, str] | None = None
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.overrides = overrides if overrides is not None else {}
+        self._cache: dict = {}
+        self._flights = SingleFlight()
+        self.timings: dict[str, list[float]] = defaultdict(list)
+        self.hits = 0
+        self.misses = 0
+
+    async def _lookup(self, host, port, family, type, proto, flags):
+        start = trio.current_time()
+        name = host.decode() if isinstance(host, bytes) else host
+        try:
+            result = await trio.to_thread.run_sync(
+                socket.getaddrinfo,
+                self.overrides.get(name, host), port, family, type, proto, flags,
+                cancellable=True
+            )
+            expires = trio.current_time() + self.ttl
+
+        except socket.gaierror as e:
+            result = e
+            expires = trio.current_time() + self.negative_ttl
+
+        self.timings[name].append(trio.current_time() - start)
+
+        return result, expires
+
+    async def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        start = trio.current_time()
+        try:
+            return await self._getaddrinfo(
+                host, port, family, type, proto, flags)
+
+        finally:
+            # time spent resolving, cached or not, counts towards the dns
+            # phase of the operation that needed it
+            add_dns_time(trio.current_time() - start)
+
+    async def _getaddrinfo(self, host, port, family, type, proto, flags):
+        # service names can't be swapped in after the fact, resolve those
+        # with the port as part of the key
+        shared = port is None or isinstance(port, int)
+        lookup_port = None if shared else port
+        key = (host, lookup_port, family, type, proto, flags)
+
+        entry = self._cache.get(key)
+        if entry and entry[1] > trio.current_time():
+            self.hits += 1
+            result = entry[0]
+
+        else:
+            self.misses += 1
+            entry = await self._flights.call(
+                key, self._lookup, host, lookup_port, family, type, proto, flags)
+
+            self._cache[key] = entry
+            result = entry[0]
+
+        if isinstance(result, BaseException):
+            raise result
+
+        if not shared or port is None:
+            return result
+
+        return [
+            (_family, _type, _proto, canonname, (sockaddr[0], port, *sockaddr[2:]))
+            for _family, _type, _proto, canonname, sockaddr in result
+        ]
+
+    async def getnameinfo(self, sockaddr, flags):
+        return await trio.to_thread.run_sync(
+            socket.getnameinfo, sockaddr, flags, cancellable=True)
+
+    def log_stats(self, slowest: int = 5):
+        logging.info(
+            f'dns cache: {self.hits} hits, {self.misses} misses, '
+            f'{len(self.timings)} hosts resolved')
+
+        worst = sorted(
+            ((max(durations), host) for host, durations in self.timings.items()),
+            reverse=True
+        )[:slowest]
+        for duration, host in worst:
+            logging.info(f'dns: {host} took {duration:.3f}s')
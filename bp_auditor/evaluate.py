@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import json
+
+from .utils import history_sample_order
+
+
+'''Turns a stored producer report into the pass/fail results and cell texts
+shown on the monthly report, kept apart from the xlsx rendering so other
+consumers don't need openpyxl
+'''
+
+
+# bump whenever the evaluation below changes, so rows cached by the
+# monthly report render cache get recomputed
+RENDER_VERSION = 2
+
+
+def cpu_rank(cpu: str) -> int | None:
+    '''0 for green, 1 for yellow, 2 for red, None if there is no value
+    '''
+    if 'us' not in cpu:
+        return None
+
+    try:
+        val = float(cpu.split(' ')[0])
+
+    except ValueError:
+        return None
+
+    if val >= 0 and val <= 300:
+        return 0
+
+    elif val > 300 and val < 500:
+        return 1
+
+    return 2
+
+
+def evaluate_report(timestamp: str, report: dict) -> dict:
+    row = {
+        'owner': report['owner'],
+        'timestamp': timestamp,
+        'exception': report.get('exception'),
+        'cells': [],
+        'tls': False,
+        'p2p': False,
+        'history': False,
+        'cpu_rank': None
+    }
+
+    if row['exception'] is not None:
+        row['cells'] = [timestamp, row['exception']]
+        return row
+
+    ssl_report = ''
+    if 'ssl_endpoints' in report:
+        for ssl_endpoint in report['ssl_endpoints']:
+            capabilities, url, tlsv = ssl_endpoint
+            row['tls'] = row['tls'] or (
+                ('query' in capabilities and tlsv in ['TLSv1.3', 'TLSv1.2']) or
+                ('full' in capabilities and tlsv in ['TLSv1.3', 'TLSv1.2'])
+            )
+            ssl_report += f'{json.dumps(capabilities)}, {tlsv}\n'
+
+    p2p_report = ''
+    if 'p2p_endpoints' in report:
+        for p2p_endpoint in report['p2p_endpoints']:
+            capabilities, url, status = p2p_endpoint
+            row['p2p'] = row['p2p'] or ('seed' in capabilities and status == 'ok')
+            p2p_report += f'{json.dumps(capabilities)}, {status}\n'
+
+    hist_report = ''
+    if 'history' in report:
+        # coverage map of chain slice to sampled block or error text
+        history = report['history']
+        available = []
+        missing = []
+        for label in sorted(history, key=history_sample_order):
+            if len(history[label]) == 2:
+                available.append(label)
+
+            else:
+                missing.append(label)
+
+        for label in ['early', 'late']:
+            result = history.get(label, 'not sampled')
+            hist_report += f'{label}: '
+            if len(result) == 2:
+                _id, block_num = result
+                hist_report += f'{block_num}\n'
+
+            else:
+                hist_report += result + '\n'
+
+        if len(history) > 2:
+            hist_report += f'coverage: {len(available)}/{len(history)}\n'
+            if missing:
+                hist_report += f'missing: {", ".join(missing)}\n'
+
+        row['history'] = 'early' in available and 'late' in available
+
+    cpu = report['cpu'] if 'cpu' in report else ''
+    row['cpu_rank'] = cpu_rank(cpu)
+
+    row['cells'] = [
+        timestamp,
+        report['url'],
+        report['bp_json'],
+        ssl_report,
+        p2p_report,
+        hist_report,
+        cpu
+    ]
+    return row
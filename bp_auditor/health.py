@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timedelta
+
+
+'''Health history of every endpoint the auditor probes, kept on the reports
+db between runs. Endpoints that failed several runs in a row are known dead,
+they get a cheap liveness probe before their full check and fail straight
+away if it doesn't connect, so they stop costing a full timeout every run.
+They still get a full check once in a while so recoveries get noticed.
+'''
+
+
+class EndpointHealth:
+    '''Per endpoint last success, consecutive failures and typical latency,
+    keyed by probe kind, host and port.
+
+    An endpoint is known dead after `threshold` failures in a row, as long
+    as its last full check is less than `recheck_after` old. `alpha` weighs
+    each new latency in the moving average.
+    '''
+
+    def __init__(
+        self,
+        entries: dict[tuple[str, str, int], dict] | None = None,
+        threshold: int = 3,
+        recheck_after: timedelta = timedelta(days=1),
+        liveness_timeout: float = 2,
+        alpha: float = 0.2
+    ):
+        self.entries = entries if entries is not None else {}
+        self.threshold = threshold
+        self.recheck_after = recheck_after
+        self.liveness_timeout = liveness_timeout
+        self.alpha = alpha
+        self.fast_failed = 0
+
+    def known_dead(self, key: tuple[str, str, int]) -> bool:
+        entry = self.entries.get(key)
+        if entry is None or entry['consecutive_failures'] < self.threshold:
+            return False
+
+        last_full_check = entry['last_full_check']
+        return (
+            last_full_check is not None and
+            datetime.utcnow() - last_full_check < self.recheck_after
+        )
+
+    def record(
+        self,
+        key: tuple[str, str, int],
+        ok: bool,
+        latency: float | None = None,
+        error: str | None = None,
+        full: bool = True
+    ):
+        '''Outcome of a check of `key`, `full` if it was the complete check
+        and not just the liveness probe
+        '''
+        now = datetime.utcnow()
+        entry = self.entries.setdefault(key, {
+            'last_success': None,
+            'last_check': None,
+            'last_full_check': None,
+            'consecutive_failures': 0,
+            'latency': None,
+            'last_error': None
+        })
+        entry['last_check'] = now
+        if full:
+            entry['last_full_check'] = now
+
+        if not ok:
+            entry['consecutive_failures'] += 1
+            entry['last_error'] = error
+            return
+
+        entry['consecutive_failures'] = 0
+        entry['last_success'] = now
+        entry['last_error'] = None
+        if latency is not None:
+            entry['latency'] = (
+                latency if entry['latency'] is None
+                else self.alpha * latency + (1 - self.alpha) * entry['latency']
+            )
+
+    def failures(self, key: tuple[str, str, int]) -> int:
+        entry = self.entries.get(key)
+        return entry['consecutive_failures'] if entry else 0
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+import ssl
+import json
+import math
+import random
+import socket
+
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse, parse_qs
+
+import trio
+import trustme
+
+from .cpu import month_key, month_start
+from .dns import CachingResolver
+from .queries import create_ssl_context
+
+
+'''Local stand-in for a whole antelope network, serves the chain api and
+hyperion for the chain plus the bp.json, api node, tls and p2p endpoints of
+every producer, all on 127.0.0.1. Producers live under `bpN.mocknet` host
+names, point a gather at it with the resolver and ssl context it hands out.
+
+Meant for reproducible tests and benchmarks of a whole gather run.
+'''
+
+
+CHAIN_ID = 'cc' * 32
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Server Error'}
+
+
+class MockProducer:
+    '''Profile of a single producer on the mock network, `state` is "ok",
+    "failing" (serves its bp.json but its api node answers 500, its tls
+    endpoint never handshakes and its p2p port refuses connections) or
+    "hanging" (its bp.json host never answers)
+    '''
+
+    def __init__(self, index: int, state: str, first_block: int):
+        self.index = index
+        self.owner = f'producer{index}'
+        self.host = f'bp{index}.mocknet'
+        self.state = state
+        self.first_block = first_block
+        # a third of the producers publish a chains.json
+        self.chains_json = index % 3 == 0
+
+
+class MockNet:
+    '''Configurable mock network:
+
+    - `producers`: amount of registered producers
+    - `latency` and `latency_sigma`: median and shape of the lognormal
+      delay added to every http response, in seconds
+    - `failure_rate` and `timeout_rate`: fraction of producers whose
+      infrastructure is broken or unresponsive
+    - `cpu_actions`: eosmechanics:cpu benchmarks per producer this month
+    - `seed`: makes the producer profiles and latencies reproducible
+    '''
+
+    def __init__(
+        self,
+        producers: int = 42,
+        latency: float = 0.01,
+        latency_sigma: float = 0.5,
+        failure_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        head_block: int = 100_000,
+        cpu_actions: int = 10,
+        seed: int | None = None
+    ):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.head_block = head_block
+        self.random = random.Random(seed)
+        self.requests = 0
+
+        self.producers = []
+        for i in range(producers):
+            roll = self.random.random()
+            state = 'ok'
+            if roll < failure_rate:
+                state = 'failing'
+
+            elif roll < failure_rate + timeout_rate:
+                state = 'hanging'
+
+            self.producers.append(MockProducer(
+                i, state, self.random.randint(1, head_block // 2)))
+
+        self._by_host = {producer.host: producer for producer in self.producers}
+
+        month = month_key(datetime.utcnow())
+        start = month_start(month)
+        self.actions = []
+        for i in range(cpu_actions):
+            for producer in self.producers:
+                sequence = len(self.actions) + 1
+                timestamp = start + timedelta(minutes=sequence)
+                self.actions.append({
+                    '@timestamp': timestamp.isoformat(timespec='milliseconds'),
+                    'global_sequence': sequence,
+                    'producer': producer.owner,
+                    'cpu_usage_us': self.random.randint(100, 600)
+                })
+
+        self._ca = trustme.CA()
+        self._server_context = ssl.create_default_context(
+            ssl.Purpose.CLIENT_AUTH)
+        # single label wildcards like *.mocknet aren't matched by openssl
+        self._ca.issue_cert(*self._by_host).configure_cert(
+            self._server_context)
+
+        self.http_port = None
+        self.tls_port = None
+        self.tls_hanging_port = None
+        self.p2p_port = None
+        self.closed_port = None
+
+    # client side
+
+    @property
+    def chain_url(self) -> str:
+        return f'http://chain.mocknet:{self.http_port}'
+
+    def resolver(self) -> CachingResolver:
+        '''Resolver that sends every mocknet host name to 127.0.0.1
+        '''
+        hosts = {'chain.mocknet': '127.0.0.1'}
+        for producer in self.producers:
+            hosts[producer.host] = '127.0.0.1'
+
+        return CachingResolver(overrides=hosts)
+
+    def client_ssl_context(self) -> ssl.SSLContext:
+        '''Tls probe context that trusts the mocknet certificate authority
+        '''
+        context = create_ssl_context()
+        self._ca.configure_trust(context)
+        return context
+
+    # server side
+
+    def _delay(self) -> float:
+        return min(
+            self.random.lognormvariate(math.log(self.latency), self.latency_sigma),
+            self.latency * 10
+        )
+
+    def _block(self, block_num: int, full: bool) -> dict:
+        block = {
+            'id': f'{block_num:08x}' + '00' * 28,
+            'block_num': block_num,
+            'timestamp': '2023-01-01T00:00:00.000',
+            'producer': self.producers[block_num % len(self.producers)].owner,
+            'confirmed': 0,
+            'previous': f'{block_num - 1:08x}' + '00' * 28,
+            'transaction_mroot': '00' * 32,
+            'action_mroot': '00' * 32,
+            'schedule_version': 1,
+            'producer_signature': 'SIG_K1_mock',
+            'ref_block_prefix': block_num
+        }
+        if full:
+            block.update(new_producers=None, transactions=[])
+
+        return block
+
+    def _get_block(self, path: str, body: dict, first_block: int):
+        if path.endswith('/get_block_info'):
+            block_num = int(body['block_num'])
+
+        else:
+            block_num = int(body['block_num_or_id'])
+
+        if block_num < first_block or block_num > self.head_block:
+            return 400, {'code': 400, 'message': 'unknown block'}
+
+        return 200, self._block(block_num, path.endswith('/get_block'))
+
+    def _get_table_rows(self, body: dict):
+        start = int(body.get('lower_bound') or 0)
+        end = min(start + int(body.get('limit', 10)), len(self.producers))
+        more = end < len(self.producers)
+        return 200, {
+            'rows': [
+                {
+                    'owner': producer.owner,
+                    'url': f'http://{producer.host}:{self.http_port}',
+                    'total_votes': str(float(1_000_000 - producer.index)),
+                    'is_active': 1
+                }
+                for producer in self.producers[start:end]
+            ],
+            'more': more,
+            'next_key': str(end) if more else ''
+        }
+
+    def _get_actions(self, query: dict):
+        after = query.get('after', [''])[0]
+        skip = int(query.get('skip', ['0'])[0])
+        limit = int(query.get('limit', ['10'])[0])
+        producer = query.get('producer', [None])[0]
+        actions = [
+            action for action in self.actions
+            if action['@timestamp'] >= after and
+            (producer is None or action['producer'] == producer)
+        ]
+        return 200, {'actions': actions[skip:skip + limit]}
+
+    def _bp_json(self, producer: MockProducer) -> dict:
+        http = f'http://{producer.host}:{self.http_port}'
+        if producer.state == 'failing':
+            tls, p2p = self.tls_hanging_port, self.closed_port
+
+        else:
+            tls, p2p = self.tls_port, self.p2p_port
+
+        return {
+            'producer_account_name': producer.owner,
+            'org': {'candidate_name': producer.owner},
+            'nodes': [
+                {
+                    'node_type': ['query'],
+                    'api_endpoint': http,
+                    'ssl_endpoint': f'https://{producer.host}:{tls}'
+                },
+                {
+                    'node_type': 'seed',
+                    'p2p_endpoint': f'{producer.host}:{p2p}'
+                }
+            ]
+        }
+
+    async def _handle(self, method: str, host: str, target: str, body: bytes):
+        url = urlparse(target)
+        path = url.path
+        data = json.loads(body) if body else {}
+
+        if host == 'chain.mocknet':
+            if path == '/v1/chain/get_info':
+                return 200, {
+                    'chain_id': CHAIN_ID, 'head_block_num': self.head_block}
+
+            if path == '/v1/chain/get_table_rows':
+                return self._get_table_rows(data)
+
+            if path in ['/v1/chain/get_block', '/v1/chain/get_block_info']:
+                return self._get_block(path, data, 1)
+
+            if path == '/v2/history/get_actions':
+                return self._get_actions(parse_qs(url.query))
+
+            return 404, {}
+
+        producer = self._by_host.get(host)
+        if producer is None:
+            return 404, {}
+
+        if producer.state == 'hanging':
+            await trio.sleep_forever()
+
+        if path == '/chains.json':
+            if not producer.chains_json:
+                return 404, {}
+
+            return 200, {'chains': {CHAIN_ID: '/bp.mocknet.json'}}
+
+        if path == ('/bp.mocknet.json' if producer.chains_json else '/bp.json'):
+            return 200, self._bp_json(producer)
+
+        if path in ['/v1/chain/get_block', '/v1/chain/get_block_info']:
+            if producer.state == 'failing':
+                return 500, {'code': 500, 'message': 'internal error'}
+
+            return self._get_block(path, data, producer.first_block)
+
+        return 404, {}
+
+    async def _serve_http(self, stream: trio.abc.Stream):
+        buffer = b''
+        try:
+            # keep-alive loop, one request after the other
+            while True:
+                while b'\r\n\r\n' not in buffer:
+                    data = await stream.receive_some(65536)
+                    if not data:
+                        return
+
+                    buffer += data
+
+                head, buffer = buffer.split(b'\r\n\r\n', 1)
+                lines = head.decode('latin-1').split('\r\n')
+                method, target, _ = lines[0].split(' ', 2)
+                headers = {
+                    key.strip().lower(): value.strip()
+                    for key, value in (
+                        line.split(':', 1) for line in lines[1:] if ':' in line)
+                }
+
+                length = int(headers.get('content-length', 0))
+                while len(buffer) < length:
+                    data = await stream.receive_some(65536)
+                    if not data:
+                        return
+
+                    buffer += data
+
+                body, buffer = buffer[:length], buffer[length:]
+
+                self.requests += 1
+                await trio.sleep(self._delay())
+                status, payload = await self._handle(
+                    method, headers.get('host', '').split(':')[0], target, body)
+
+                raw = json.dumps(payload).encode('utf-8')
+                await stream.send_all(
+                    f'HTTP/1.1 {status} {_REASONS[status]}\r\n'
+                    'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(raw)}\r\n'
+                    'Connection: keep-alive\r\n\r\n'.encode('latin-1') + raw
+                )
+
+        except (trio.BrokenResourceError, trio.ClosedResourceError):
+            return
+
+    async def _serve_tls(self, stream: trio.SSLStream):
+        try:
+            await stream.do_handshake()
+            await stream.aclose()
+
+        except (trio.BrokenResourceError, trio.ClosedResourceError):
+            return
+
+    async def _serve_hanging(self, stream: trio.abc.Stream):
+        await trio.sleep_forever()
+
+    async def _serve_p2p(self, stream: trio.abc.Stream):
+        await stream.aclose()
+
+    async def serve(self, task_status=trio.TASK_STATUS_IGNORED):
+        '''Open every listener and serve until cancelled, reports started
+        once all ports are known
+        '''
+        http = await trio.open_tcp_listeners(0, host='127.0.0.1')
+        tls = await trio.open_ssl_over_tcp_listeners(
+            0, self._server_context, host='127.0.0.1')
+        hanging = await trio.open_tcp_listeners(0, host='127.0.0.1')
+        p2p = await trio.open_tcp_listeners(0, host='127.0.0.1')
+
+        self.http_port = http[0].socket.getsockname()[1]
+        self.tls_port = tls[0].transport_listener.socket.getsockname()[1]
+        self.tls_hanging_port = hanging[0].socket.getsockname()[1]
+        self.p2p_port = p2p[0].socket.getsockname()[1]
+
+        # a port nobody listens on, connections to it get refused
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.closed_port = sock.getsockname()[1]
+        sock.close()
+
+        async with trio.open_nursery() as n:
+            n.start_soon(trio.serve_listeners, self._serve_http, http)
+            n.start_soon(trio.serve_listeners, self._serve_tls, tls)
+            n.start_soon(trio.serve_listeners, self._serve_hanging, hanging)
+            n.start_soon(trio.serve_listeners, self._serve_p2p, p2p)
+            task_status.started()
+
+
+@asynccontextmanager
+async def open_mocknet(**kwargs):
+    '''Run a `MockNet` built with `kwargs` for the duration of the block
+    '''
+    net = MockNet(**kwargs)
+    async with trio.open_nursery() as n:
+        await n.start(net.serve)
+        yield net
+        n.cancel_scope.cancel()
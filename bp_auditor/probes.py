@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import ssl
+import math
+import logging
+
+from urllib.parse import urlparse
+
+import trio
+
+from .utils import NetworkError, SingleFlight
+from .timeouts import Timeouts
+from .health import EndpointHealth
+from .trace import traced_wait
+from .queries import probe_tls, check_port, create_ssl_context
+
+
+'''Endpoint probes shared by every producer in a gather run, producers often
+list the same host:port under several node types and shared infrastructure
+shows up on several producers' bp.json, each unique target gets probed once
+and its result handed to every report entry that references it
+'''
+
+
+def normalize_ssl_endpoint(endpoint: str) -> tuple[str, int]:
+    '''Accepts urls and bare host[:port], raises ValueError if there is no
+    host in the endpoint
+    '''
+    endpoint = endpoint.strip()
+    if '//' not in endpoint:
+        endpoint = f'https://{endpoint}'
+
+    target = urlparse(endpoint)
+    if not target.hostname:
+        raise ValueError(f'no host in ssl endpoint {endpoint!r}')
+
+    return (
+        target.hostname.lower(),
+        target.port if target.port else 443
+    )
+
+
+def normalize_p2p_endpoint(endpoint: str) -> tuple[str, int]:
+    '''Raises ValueError if the endpoint is not host:port
+    '''
+    domain, port = endpoint.strip().split(':')
+    return domain.lower(), int(port)
+
+
+class EndpointProbes:
+    '''Run wide memo of tls and p2p probe results, concurrent requests for
+    the same target join the probe already in flight, `concurrency` caps the
+    amount of probes running at once across all producers, every tls probe
+    shares a single ssl context and each probe gets the timeout `timeouts`
+    learned for its target.
+
+    Results are kept for `ttl` seconds, the whole run by default, long lived
+    processes set it so targets get probed again.
+
+    Every outcome lands on `health`, targets it knows dead only get a full
+    probe if a quick connect to them works.
+    '''
+
+    def __init__(
+        self,
+        concurrency: int = 32,
+        ssl_context: ssl.SSLContext | None = None,
+        timeouts: Timeouts | None = None,
+        ttl: float = math.inf,
+        health: EndpointHealth | None = None
+    ):
+        if ssl_context is None:
+            ssl_context = create_ssl_context()
+
+        self.ssl_context = ssl_context
+        self.timeouts = timeouts if timeouts is not None else Timeouts()
+        self.ttl = ttl
+        self.health = health if health is not None else EndpointHealth()
+        self._limit = trio.CapacityLimiter(concurrency)
+        self._flights = SingleFlight()
+        self._results: dict = {}
+        self.requests = 0
+
+    async def _probe(self, key, sockets: trio.CapacityLimiter, probe, *args):
+        kind, host, port = key
+        async with (
+            traced_wait(sockets, 'wait producer sockets'),
+            traced_wait(self._limit, 'wait probe slot')
+        ):
+            result = await self.liveness(key)
+            if result is None:
+                start = trio.current_time()
+                try:
+                    result = await probe(
+                        *args,
+                        timeout=self.timeouts.timeout(kind, f'{host}:{port}'))
+                    duration = trio.current_time() - start
+                    self.timeouts.record(kind, f'{host}:{port}', duration)
+                    self.health.record(key, True, latency=duration)
+
+                except NetworkError as e:
+                    result = str(e)
+                    self.health.record(key, False, error=result)
+
+        self._results[key] = (trio.current_time() + self.ttl, result)
+        return result
+
+    async def liveness(self, key: tuple[str, str, int]) -> str | None:
+        '''Error text if the `(kind, host, port)` target is known dead and
+        still refuses a quick connect, None if it deserves its full check.
+        Callers hold the sockets the connect uses.
+        '''
+        if not self.health.known_dead(key):
+            return None
+
+        _, host, port = key
+        try:
+            await check_port(host, port, timeout=self.health.liveness_timeout)
+
+        except NetworkError as e:
+            self.health.record(key, False, error=str(e), full=False)
+            self.health.fast_failed += 1
+            return f'{e}, failing for {self.health.failures(key)} checks'
+
+        return None
+
+    async def _get(self, key, sockets: trio.CapacityLimiter, probe, *args):
+        self.requests += 1
+        if key in self._results:
+            expires, result = self._results[key]
+            if trio.current_time() < expires:
+                return result
+
+        return await self._flights.call(
+            key, self._probe, key, sockets, probe, *args)
+
+    async def tls(
+        self,
+        endpoint: str,
+        sockets: trio.CapacityLimiter
+    ) -> dict | str:
+        '''`probe_tls` result for `endpoint` or the error text, raises
+        ValueError on malformed endpoints
+        '''
+        host, port = normalize_ssl_endpoint(endpoint)
+        netloc = f'[{host}]' if ':' in host else host
+        return await self._get(
+            ('tls', host, port), sockets,
+            probe_tls, f'https://{netloc}:{port}', self.ssl_context
+        )
+
+    async def p2p(self, endpoint: str, sockets: trio.CapacityLimiter) -> str:
+        '''"ok" if `endpoint` accepts connections, the error text otherwise,
+        raises ValueError on malformed endpoints
+        '''
+        host, port = normalize_p2p_endpoint(endpoint)
+
+        async def _check(timeout: float):
+            await check_port(host, port, timeout=timeout)
+            return 'ok'
+
+        return await self._get(('p2p', host, port), sockets, _check)
+
+    def log_stats(self):
+        logging.info(
+            f'endpoint probes: {self.requests} references, '
+            f'{len(self._results)} unique targets probed, '
+            f'{self.health.fast_failed} known dead failed fast')
@@ -1,75 +1,126 @@
 #!/usr/bin/env python3
 
-import time
 import json
+import logging
 
-import asks
-
-from ..utils import call_with_retry, MalformedJSONError
+from ..utils import call_with_retry, cached_query, MalformedJSONError
 
 
 '''This module is meant for standard antelope io queries
 '''
 
 
-async def get_producer_schedule(url: str):
+@cached_query(ttl=60)
+async def get_producer_schedule(session, url: str):
     response = await call_with_retry(
-        asks.get, f'{url}/v1/chain/get_producer_schedule')
+        session.get, f'{url}/v1/chain/get_producer_schedule')
     return response.json()
 
 
-async def get_all_producers(url: str):
+@cached_query(ttl=60)
+async def get_all_producers(
+    session,
+    url: str,
+    top: int = 42,
+    active_only: bool = False,
+    page_size: int | None = None,
+    max_pages: int = 20
+) -> list[dict]:
+    '''Top `top` rows of the eosio producers table ordered by votes, pages
+    through the votes index following `next_key` until enough producers are
+    read or the table ends. With `active_only` unregistered producers are
+    skipped and don't count towards `top`.
+
+    Rows that tie on votes can make `next_key` point back at rows already
+    read, the scan stops once a page brings no new producer, `next_key`
+    repeats or after `max_pages` pages.
+    '''
     producers = []
-    lower = 0
-    while len(producers) < 42:
+    seen = set()
+    next_key = None
+    for _ in range(max_pages):
+        # always a full page, skipped rows would otherwise shrink the next
+        # ones down to a single row
+        params = {
+            'json': True,
+            'code': 'eosio',
+            'scope': 'eosio',
+            'table': 'producers',
+            'index_position': 2,
+            'key_type': 'float64',
+            'limit': page_size if page_size else top
+        }
+        if next_key is not None:
+            params['lower_bound'] = next_key
+
         response = await call_with_retry(
-            asks.post,
-            f'{url}/v1/chain/get_table_rows',
-            json={
-                'json': 'true',
-                'code': 'eosio',
-                'scope': 'eosio',
-                'table': 'producers',
-                'index_position': 2,
-                'key_type': 'float64',
-                'lower': lower,
-                'limit': 42
-            }
-        )
+            session.post, f'{url}/v1/chain/get_table_rows', json=params)
         response = response.json()
 
-        producers += response['rows']
+        known = len(seen)
+        for row in response['rows']:
+            if row['owner'] in seen:
+                continue
 
-        lower = response['rows'][0]['total_votes']
+            seen.add(row['owner'])
+            if active_only and not row.get('is_active', 1):
+                continue
 
-    return producers
+            producers.append(row)
+            if len(producers) == top:
+                return producers
 
+        last_key = next_key
+        next_key = response.get('next_key')
+        if not response.get('more') or not next_key:
+            break
 
-_info = None
-_last_time = 0
-async def get_info(url: str):
-    '''Simple get info query with 4 second cache
-    '''
-    global _info, _last_time
-    now = time.time()
-    if now - _last_time > 4 or not _info:
-        _last_time = now
-        response = await call_with_retry(
-            asks.get, f'{url}/v1/chain/get_info')
-        _info = response.json()
+        if len(seen) == known or next_key == last_key:
+            logging.warning(
+                f'{url}: producer table scan stuck at {next_key}, '
+                f'stopping at {len(producers)} producers')
+            break
 
-    return _info
+    return producers
+
+
+# head block moves every half second, a few seconds stale is close enough
+# for picking history samples
+@cached_query(ttl=4)
+async def get_info(session, url: str):
+    response = await call_with_retry(
+        session.get, f'{url}/v1/chain/get_info')
+    return response.json()
 
-async def get_chain_id(url: str):
-    result = await get_info(url)
+@cached_query(ttl=3600)
+async def get_chain_id(session, url: str):
+    result = await get_info(session, url)
     return result['chain_id']
 
 
-async def get_block(node_url: str, block_num: int) -> dict:
+async def get_block(session, node_url: str, block_num: int) -> dict:
     url = f"{node_url}/v1/chain/get_block"
     params = {"block_num_or_id": str(block_num)}
     response = await call_with_retry(
-        asks.post, url, json=params)
+        session.post, url, json=params)
+    try:
+        return response.json()
+
+    except json.JSONDecodeError as e:
+        return response.text
+
+
+async def get_block_info(session, node_url: str, block_num: int) -> dict | None:
+    '''Header only version of `get_block`, None if the node doesn't expose
+    the endpoint
+    '''
+    url = f"{node_url}/v1/chain/get_block_info"
+    params = {"block_num": block_num}
+    response = await call_with_retry(
+        session.post, url, json=params)
+    if response.status_code == 404:
+        return None
+
     try:
         return response.json()
 
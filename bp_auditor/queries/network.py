@@ -5,54 +5,115 @@ import socket
 
 import trio
 
+from datetime import datetime
 from urllib.parse import urlparse
 
 from ..utils import NetworkError
+from ..timings import timed
 
 
-async def get_tls_version(url):
-
+def create_ssl_context() -> ssl.SSLContext:
+    '''Context for tls probes, loading the CA store is expensive so it is
+    meant to be created once per run and shared by every probe
+    '''
+    context = ssl.create_default_context()
+    context.set_alpn_protocols(['h2', 'http/1.1'])
+    return context
+
+
+async def probe_tls(
+    url: str,
+    ssl_context: ssl.SSLContext | None = None,
+    timeout: float = 10
+) -> dict:
+    '''Single tls handshake against `url`, returns the negotiated version,
+    cipher, alpn protocol, certificate expiry and how long the tcp connect and
+    the handshake took in seconds
+    '''
     target = urlparse(url)
+    if ssl_context is None:
+        ssl_context = create_ssl_context()
 
-    context = ssl.create_default_context()
+    ssock = None
     try:
-        with trio.move_on_after(10) as cscope:
-            ssock = await trio.open_ssl_over_tcp_stream(
+        with (
+            timed('tls', url) as record,
+            trio.move_on_after(timeout) as cscope
+        ):
+            start = trio.current_time()
+            stream = await trio.open_tcp_stream(
                 target.hostname,
-                target.port if target.port else 443,
-                ssl_context=context
+                target.port if target.port else 443
             )
+            connected = trio.current_time()
+            record['connect'] = connected - start - (record['dns'] or 0)
+
+            ssock = trio.SSLStream(
+                stream, ssl_context, server_hostname=target.hostname)
+            await ssock.do_handshake()
+            handshaked = trio.current_time()
+            record['tls'] = handshaked - connected
 
         if cscope.cancelled_caught:
+            record['error'] = 'timeout'
             raise NetworkError('timeout connecting to endpoint')
 
-    except OSError as e:
-        raise NetworkError(str(e))
+    except BaseException as e:
+        if ssock is not None:
+            await trio.aclose_forcefully(ssock)
 
-    except trio.BrokenResourceError as e:
-        raise NetworkError(str(e))
+        if isinstance(e, OSError):
+            raise NetworkError(str(e))
 
-    try:
-        await ssock.do_handshake()
+        if isinstance(e, trio.BrokenResourceError):
+            if isinstance(e.__cause__, ssl.SSLError):
+                raise NetworkError(str(e.__cause__))
+
+            raise NetworkError(str(e))
+
+        raise
+
+    cert = ssock.getpeercert()
+    cert_expiry = None
+    if cert and 'notAfter' in cert:
+        cert_expiry = str(datetime.utcfromtimestamp(
+            ssl.cert_time_to_seconds(cert['notAfter'])))
+
+    cipher = ssock.cipher()
+    result = {
+        'version': ssock.version(),
+        'cipher': cipher[0] if cipher else None,
+        'alpn': ssock.selected_alpn_protocol(),
+        'cert_expiry': cert_expiry,
+        # name resolution left out, same as the timing record
+        'connect_time': record['connect'],
+        'handshake_time': handshaked - connected
+    }
+
+    with trio.move_on_after(1):
+        await ssock.aclose()
 
-    except ssl.SSLCertVerificationError as e:
-        raise NetworkError(str(e))
+    return result
 
-    except trio.BrokenResourceError as e:
-        raise NetworkError(str(e))
 
-    tls_version = ssock.cipher()[1]
-    await ssock.aclose()
-    return tls_version
+async def get_tls_version(url, ssl_context: ssl.SSLContext | None = None):
+    return (await probe_tls(url, ssl_context=ssl_context))['version']
 
 
 async def check_port(domain, port: int, timeout=5):
     try:
-        with trio.move_on_after(timeout) as cs:
+        with (
+            timed('p2p', f'{domain}:{port}') as record,
+            trio.move_on_after(timeout) as cs
+        ):
+            start = trio.current_time()
             s = await trio.open_tcp_stream(domain, port)
+            record['connect'] = (
+                trio.current_time() - start - (record['dns'] or 0))
             await s.aclose()
 
         if cs.cancelled_caught:
+            record['error'] = 'timeout'
             raise NetworkError(
                 f'Connection to {domain}:{port} timed out after {timeout} seconds')
 
@@ -7,10 +7,12 @@ import socket
 
 from datetime import datetime
 
-import asks
 import trio
 
 from ..utils import *
+from ..cpu import CPUAggregate, month_key, month_start
+from ..timings import timed
+from ..trace import traced_wait
 
 from .antelope import *
 
@@ -22,20 +24,27 @@ def urljoin(base_url: str, path: str):
     return base_url + path
 
 
-async def get_bp_json(url: str, chain_id: str):
+BP_JSON_PATHS = ['chains.json', 'bp.json', 'telos.json']
+
+
+async def get_bp_json(session, url: str, chain_id: str):
     # https://github.com/eosrio/bp-info-standard
 
-    try:
-        response = await call_with_retry(
-            asks.get, urljoin(url,'chains.json'))
+    # try the path that worked last run first, then the standard fallbacks
+    cache = session.http_cache
+    paths = list(BP_JSON_PATHS)
+    if url in cache.paths:
+        paths.remove(cache.paths[url])
+        paths.insert(0, cache.paths[url])
 
-        if response.status_code == 404:
+    try:
+        for path in paths:
             response = await call_with_retry(
-                asks.get, urljoin(url, 'bp.json'))
+                session.conditional_get, urljoin(url, path))
 
-            if response.status_code == 404:
-                response = await call_with_retry(
-                    asks.get, urljoin(url, 'telos.json'))
+            if response.status_code != 404:
+                cache.paths[url] = path
+                break
 
     except ssl.SSLCertVerificationError as e:
         raise NetworkError(str(e))
@@ -44,6 +53,7 @@ async def get_bp_json(url: str, chain_id: str):
         raise NetworkError(str(e))
 
     if response.status_code == 404:
+        cache.paths.pop(url, None)
         raise NetworkError('404: bp json not found')
 
     try:
@@ -57,7 +67,7 @@ async def get_bp_json(url: str, chain_id: str):
             sub_url = data[chain_id]
 
             response = await call_with_retry(
-                asks.get,
+                session.conditional_get,
                 urljoin(url, sub_url)
             )
 
@@ -72,98 +82,208 @@ async def get_bp_json(url: str, chain_id: str):
         raise MalformedJSONError('json decode error')
 
 
-async def check_history(chain_url: str, url: str):
-    chain_info = await get_info(chain_url)
+async def _sample_block(session, url: str, block_num: int):
+    with timed('block', f'{url}#{block_num}'):
+        return await _fetch_sample_block(session, url, block_num)
 
-    head_block_num = chain_info['head_block_num']
 
-    # get two samples
-    early_block = None
+async def _fetch_sample_block(session, url: str, block_num: int):
+    block = None
     try:
-        with trio.move_on_after(5) as cs:
-            early_block = await get_block(
-                url, get_random_block_number(head_block_num, 10))
+        # header only endpoint first, full block on nodes without it,
+        # remembered so later samples skip the 404
+        if session.has_block_info(url):
+            block = await get_block_info(session, url, block_num)
+            validate = validate_block_info
+            if block is None:
+                session.block_info_missing[url] = trio.current_time()
 
-        if cs.cancelled_caught:
-            early = 'timeout'
+        if block is None:
+            block = await get_block(session, url, block_num)
+            validate = validate_block
 
-        else:
-            if 'code' in early_block and early_block['code'] <= 400:
-                early = f'{early_block["code"]}: not found'
+        if 'code' in block and block['code'] <= 400:
+            return f'{block["code"]}: not found'
 
-            else:
-                validate_block(early_block)
-                early = (early_block['id'], early_block['block_num'])
+        validate(block)
+        return (block['id'], block['block_num'])
 
     except BaseException as e:
-        if early_block and isinstance(early_block, str):
-            early = early_block
-
-        else:
-            early = str(e)
-
-    late_block = None
-    try:
-        with trio.move_on_after(5) as cs:
-            late_block = await get_block(
-                url, get_random_block_number(head_block_num, 90))
-
-        if cs.cancelled_caught:
-            late = 'timeout'
-
-        else:
-            if 'code' in late_block and late_block['code'] <= 400:
-                late = f'{late_block["code"]}: not found'
-
-            else:
-                validate_block(late_block)
-                late = (late_block['id'], late_block['block_num'])
-
-    except BaseException as e:
-        if late_block and isinstance(late_block, str):
-            late = late_block
-
-        else:
-            late = str(e)
+        if isinstance(e, trio.Cancelled):
+            raise
+
+        if block and isinstance(block, str):
+            return block
+
+        return str(e)
+
+
+async def check_history(
+    session,
+    chain_url: str,
+    url: str,
+    samples: int = 10,
+    timeout: float = 5,
+    sockets: trio.CapacityLimiter | None = None
+) -> dict:
+    '''Fetch one random block out of each of `samples` slices of the chain
+    from the node at `url`, concurrently and under a single `timeout`, each
+    sample holding one of `sockets` if given.
+    Returns the coverage map of slice label to (block id, block num) or the
+    error text, samples still pending when time runs out are "timeout".
+    '''
+    chain_info = await get_info(session, chain_url)
 
-    return (early, late)
-
-
-async def get_avg_performance_this_month(chain_url: str, producer: str):
-    # Get current UTC date and time
-    now = datetime.utcnow()
-
-    # Set hour, minute, second, and microsecond to 0
-    first_day_month = str(
-        now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)).replace(' ', 'T')
-
-    # build API call
-    url = f'{chain_url}/v2/history/get_actions?filter=eosmechanics:cpu'
-    url += '&producer=' + producer
-    # url += "limit=2&" # url += "sort=desc&"
-    url += '&after=' + first_day_month
-
-    # make API call
-    response = await call_with_retry(asks.get, url)
-
-    try:
-        response = response.json()
-
-        if 'actions' not in response:
-            raise json.JSONDecodeError()
-
-        actions = response['actions']
-
-    except json.JSONDecodeError:
-        return 'json decode error on get_performance query'
-
-    total_actions = len(actions)
-
-    if total_actions == 0:
-        return 'bp hasn\'t called eosmechanics:cpu this month'
-
-    sum_cpu = 0
-    for action in actions:
-        sum_cpu += action['cpu_usage_us']
+    head_block_num = chain_info['head_block_num']
 
-    return f'{sum_cpu / total_actions:.2f} us'
+    blocks = sample_block_numbers(head_block_num, samples)
+    coverage = {label: 'timeout' for label in blocks}
+
+    async def _sample(label: str, block_num: int):
+        if sockets is None:
+            coverage[label] = await _sample_block(session, url, block_num)
+            return
+
+        async with traced_wait(sockets, 'wait producer sockets'):
+            coverage[label] = await _sample_block(session, url, block_num)
+
+    with trio.move_on_after(timeout):
+        async with trio.open_nursery() as n:
+            for label, block_num in blocks.items():
+                n.start_soon(_sample, label, block_num)
+
+    return coverage
+
+
+async def update_cpu_aggregate(
+    session,
+    chain_url: str,
+    aggregate: CPUAggregate,
+    page_size: int = 100,
+    max_pages: int = 100
+) -> str | None:
+    '''Page through the eosmechanics:cpu actions of the aggregate's producer
+    that came after its cursor and fold them in, returns an error text if the
+    query fails, actions folded before the failure are kept
+    '''
+    after = aggregate.last_timestamp
+    if not after:
+        after = month_start(aggregate.month).isoformat()
+
+    for _ in range(max_pages):
+        # build API call
+        url = f'{chain_url}/v2/history/get_actions?filter=eosmechanics:cpu'
+        url += '&producer=' + aggregate.owner
+        url += '&sort=asc'
+        url += f'&limit={page_size}'
+        url += '&after=' + after
+
+        # make API call
+        response = await call_with_retry(session.get, url)
+
+        try:
+            actions = response.json()['actions']
+
+        except (json.JSONDecodeError, KeyError, TypeError):
+            return 'json decode error on get_performance query'
+
+        folded = 0
+        for action in actions:
+            if aggregate.fold(action):
+                folded += 1
+
+        # a short page is the last one, no need to ask for an empty one
+        if folded == 0 or len(actions) < page_size:
+            break
+
+        after = aggregate.last_timestamp
+
+    return None
+
+
+async def get_avg_performance_this_month(
+    session,
+    chain_url: str,
+    producer: str,
+    aggregate: CPUAggregate | None = None
+):
+    '''Average eosmechanics:cpu result for `producer` this month, pass the
+    aggregate persisted by the previous run to only fetch newer actions
+    '''
+    month = month_key(datetime.utcnow())
+    if aggregate is None or aggregate.month != month:
+        aggregate = CPUAggregate(producer, month)
+
+    error = await update_cpu_aggregate(session, chain_url, aggregate)
+    if error:
+        return error
+
+    return aggregate.summary()
+
+
+async def scan_cpu_benchmarks(
+    session,
+    chain_url: str,
+    month: str,
+    aggregates: dict[str, CPUAggregate],
+    cursor: dict,
+    page_size: int = 100,
+    max_skip: int = 5000,
+    max_pages: int = 1000
+) -> str | None:
+    '''Single sequential scan of every eosmechanics:cpu action after `cursor`
+    for the whole chain, actions get grouped by producer into `aggregates`
+    while streaming. Pages with limit/skip from a fixed `after`, once skip
+    grows past `max_skip` it restarts from the last seen action. `cursor`
+    is updated as actions are folded so an interrupted scan resumes where
+    it stopped, returns an error text if the query fails.
+    '''
+    after = cursor.get('last_timestamp') or month_start(month).isoformat()
+    skip = 0
+
+    for _ in range(max_pages):
+        # build API call
+        url = f'{chain_url}/v2/history/get_actions?filter=eosmechanics:cpu'
+        url += '&sort=asc'
+        url += f'&limit={page_size}'
+        url += f'&skip={skip}'
+        url += '&after=' + after
+
+        # make API call
+        response = await call_with_retry(session.get, url)
+
+        try:
+            actions = response.json()['actions']
+
+        except (json.JSONDecodeError, KeyError, TypeError):
+            return 'json decode error on get_performance query'
+
+        if len(actions) == 0:
+            break
+
+        for action in actions:
+            global_sequence = action.get('global_sequence', 0)
+            last_global_sequence = cursor.get('last_global_sequence', 0)
+            # same guard as CPUAggregate.fold, actions without a sequence
+            # can't be told apart and always get folded
+            if global_sequence and global_sequence <= last_global_sequence:
+                continue
+
+            producer = action['producer']
+            if producer not in aggregates:
+                aggregates[producer] = CPUAggregate(producer, month)
+
+            aggregates[producer].fold(action)
+            cursor['last_global_sequence'] = max(
+                last_global_sequence, global_sequence)
+            cursor['last_timestamp'] = aggregates[producer].last_timestamp
+
+        if len(actions) < page_size:
+            break
+
+        skip += len(actions)
+        if skip >= max_skip:
+            after = cursor.get('last_timestamp') or after
+            skip = 0
+
+    return None
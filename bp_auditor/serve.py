@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+import ssl
+import logging
+
+from datetime import datetime, timedelta
+
+import trio
+
+from .queries import get_chain_id, get_all_producers
+from .db import (
+    read_http_cache,
+    store_http_cache,
+    read_latency_samples,
+    store_latency_samples,
+    store_live_report,
+    read_live_reports,
+    store_reports,
+    read_endpoint_health,
+    store_endpoint_health
+)
+from .cpu import month_key
+from .audit import (
+    LATENCY_WINDOW,
+    audit_producer,
+    load_cpu_benchmarks,
+    store_cpu_benchmarks
+)
+from .session import AuditSession, HTTPCache
+from .checks import Check, CheckRunner, CPUBenchmarks
+from .dns import CachingResolver
+from .probes import EndpointProbes
+from .health import EndpointHealth
+from .timeouts import Timeouts
+from .timings import current_chain
+from .utils import NetworkError, MalformedJSONError
+
+
+'''Long running alternative to the once a day gather, audits every producer
+once per interval on a staggered schedule instead of all of them in a burst,
+keeping the connection pool, caches, learned timeouts and producer table
+snapshot warm in between. Each report lands on the db as soon as its audit
+completes and once a day the latest report of every producer gets stored as
+a regular run, the same snapshot `produce` reads from a gather.
+'''
+
+
+def seconds_until_hour(hour: int, now: datetime) -> float:
+    '''Seconds from `now` to the next time the clock hits `hour`:00
+    '''
+    target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+
+    return (target - now).total_seconds()
+
+
+class RollingAuditor:
+    '''Audits each of the top producers of every chain in `chain_urls` once
+    every `interval` seconds, spreading a chain's producers evenly over the
+    interval in rank order. The producer table gets refreshed at the start
+    of every interval.
+
+    `refresh` is how long tls and p2p probe results and the cpu benchmark
+    scan stay fresh, `flush_interval` how often caches, cpu aggregates,
+    latencies and endpoint health get persisted and `snapshot_hour` the UTC
+    hour the daily run is stored at. The remaining options mean the same as on
+    `check_all_chains`.
+    '''
+
+    def __init__(
+        self,
+        chain_urls: list[str],
+        db_location: str = 'reports.db',
+        interval: float = 6 * 3600,
+        concurrency: int = 4,
+        sockets_per_producer: int = 4,
+        connections: int = 32,
+        connections_per_host: int = 4,
+        transport=None,
+        checks: list[Check] | None = None,
+        probe_concurrency: int = 32,
+        refresh: float = 600,
+        cpu_mode: str = 'bulk',
+        top: int = 42,
+        active_only: bool = False,
+        snapshot_hour: int = 0,
+        flush_interval: float = 600,
+        retry_delay: float = 60,
+        resolver: CachingResolver | None = None,
+        ssl_context: ssl.SSLContext | None = None,
+        recheck_dead: float = 24 * 3600
+    ):
+        self.chain_urls = chain_urls
+        self.db_location = db_location
+        self.interval = interval
+        self.sockets_per_producer = sockets_per_producer
+        self.connections = connections
+        self.connections_per_host = connections_per_host
+        self.transport = transport
+        self.refresh = refresh
+        self.bulk = cpu_mode == 'bulk'
+        self.top = top
+        self.active_only = active_only
+        self.snapshot_hour = snapshot_hour
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+
+        self.http_cache = HTTPCache(*read_http_cache(db_location))
+        self.timeouts = Timeouts(read_latency_samples(
+            db_location, datetime.utcnow() - LATENCY_WINDOW))
+        self.resolver = resolver if resolver is not None else CachingResolver()
+        self.runner = CheckRunner(checks)
+        self.health = EndpointHealth(
+            read_endpoint_health(db_location),
+            recheck_after=timedelta(seconds=recheck_dead)
+        )
+        self.probes = EndpointProbes(
+            probe_concurrency,
+            ssl_context=ssl_context,
+            timeouts=self.timeouts,
+            ttl=refresh,
+            health=self.health
+        )
+        self.limit = trio.CapacityLimiter(concurrency)
+        self.cpu: dict[str, CPUBenchmarks] = {}
+
+        # chain url -> producers of the latest table snapshot
+        self.producers: dict[str, list[dict]] = {}
+        self.audits = 0
+
+    def _benchmarks(self, chain_url: str) -> CPUBenchmarks:
+        # a new month starts its aggregates from scratch
+        month = month_key(datetime.utcnow())
+        cpu = self.cpu.get(chain_url)
+        if cpu is None or cpu.month != month:
+            if cpu is not None:
+                store_cpu_benchmarks(self.db_location, chain_url, cpu)
+
+            cpu = load_cpu_benchmarks(
+                self.db_location, chain_url, month,
+                bulk=self.bulk, rescan_after=self.refresh)
+            self.cpu[chain_url] = cpu
+
+        return cpu
+
+    async def _audit(
+        self,
+        session: AuditSession,
+        chain_url: str,
+        chain_id: str,
+        rank: int,
+        producer: dict
+    ):
+        report = await audit_producer(
+            session, chain_url, chain_id, rank, producer, self.limit,
+            sockets_per_producer=self.sockets_per_producer,
+            runner=self.runner,
+            probes=self.probes,
+            cpu=self._benchmarks(chain_url)
+        )
+        store_live_report(self.db_location, chain_url, report)
+        self.audits += 1
+        logging.info(f'{chain_url}: audited {producer["owner"]}')
+
+    async def _schedule(self, session: AuditSession, chain_url: str):
+        current_chain.set(chain_url)
+        while True:
+            start = trio.current_time()
+            try:
+                chain_id = await get_chain_id(session, chain_url)
+                producers = await get_all_producers(
+                    session, chain_url,
+                    top=self.top, active_only=self.active_only)
+
+            # network errors aren't Exception subclasses here
+            except (Exception, NetworkError, MalformedJSONError):
+                logging.exception(f'{chain_url}: could not read producers')
+                await trio.sleep(self.retry_delay)
+                continue
+
+            self.producers[chain_url] = producers
+            step = self.interval / max(len(producers), 1)
+            logging.info(
+                f'{chain_url}: auditing {len(producers)} producers, '
+                f'one every {step:.1f}s')
+
+            async with trio.open_nursery() as n:
+                for rank, producer in enumerate(producers, start=1):
+                    await trio.sleep_until(start + (rank - 1) * step)
+                    n.start_soon(
+                        self._audit, session, chain_url, chain_id,
+                        rank, producer)
+
+            await trio.sleep_until(start + self.interval)
+
+    def snapshot(self):
+        '''Store the latest report of every producer in each chain's current
+        table snapshot as a run, reports older than two intervals are left
+        out
+        '''
+        since = datetime.utcnow() - timedelta(seconds=2 * self.interval)
+        for chain_url in self.chain_urls:
+            owners = set(
+                producer['owner']
+                for producer in self.producers.get(chain_url, [])
+            )
+            reports = sorted(
+                (
+                    report
+                    for report in read_live_reports(
+                        self.db_location, chain_url, since=since)
+                    if not owners or report['owner'] in owners
+                ),
+                key=lambda report: report.get('rank', 0)
+            )
+            if reports:
+                store_reports(self.db_location, reports, chain=chain_url)
+                logging.info(
+                    f'{chain_url}: stored snapshot of {len(reports)} reports')
+
+    def flush(self):
+        '''Persist the caches, cpu aggregates, latencies and endpoint health
+        learned so far
+        '''
+        store_http_cache(
+            self.db_location, self.http_cache.entries, self.http_cache.paths)
+
+        for chain_url, cpu in self.cpu.items():
+            store_cpu_benchmarks(self.db_location, chain_url, cpu)
+
+        store_latency_samples(
+            self.db_location,
+            self.timeouts.commit(),
+            prune_before=datetime.utcnow() - LATENCY_WINDOW
+        )
+        store_endpoint_health(self.db_location, self.health.entries)
+
+    async def _snapshots(self):
+        while True:
+            await trio.sleep(
+                seconds_until_hour(self.snapshot_hour, datetime.utcnow()))
+            self.snapshot()
+            self.flush()
+
+    async def _flushes(self):
+        while True:
+            await trio.sleep(self.flush_interval)
+            self.flush()
+            self.runner.log_stats()
+            self.probes.log_stats()
+            self.resolver.log_stats()
+
+    async def run(self, task_status=trio.TASK_STATUS_IGNORED):
+        '''Audit until cancelled, reports started once the session is open
+        '''
+        previous_resolver = trio.socket.set_custom_hostname_resolver(
+            self.resolver)
+        try:
+            async with AuditSession(
+                connections=self.connections,
+                per_host=self.connections_per_host,
+                transport=self.transport,
+                http_cache=self.http_cache,
+                resolver=self.resolver,
+                timeouts=self.timeouts
+            ) as session:
+                async with trio.open_nursery() as n:
+                    for chain_url in self.chain_urls:
+                        n.start_soon(self._schedule, session, chain_url)
+
+                    n.start_soon(self._snapshots)
+                    n.start_soon(self._flushes)
+                    task_status.started()
+
+        finally:
+            trio.socket.set_custom_hostname_resolver(previous_resolver)
+            self.flush()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+import ssl
+import json
+
+from urllib.parse import urlparse, urljoin
+
+import asks
+import trio
+
+from .utils import RequestTimeout, RetryPolicy, AsyncTTLCache
+from .timeouts import Timeouts
+from .timings import timed
+from .trace import traced_wait
+
+
+'''Shared http session used by every query during a gather run
+'''
+
+
+class HTTPCache:
+    '''Conditional GET cache, keeps the validators and body of each cached
+    url plus the bp.json fallback path that worked last time for each
+    producer url, meant to be persisted on the reports db between runs
+    '''
+
+    def __init__(
+        self,
+        entries: dict[str, dict] | None = None,
+        paths: dict[str, str] | None = None
+    ):
+        self.entries = entries if entries is not None else {}
+        self.paths = paths if paths is not None else {}
+        self.hits = 0
+        self.misses = 0
+
+
+class CachedResponse:
+    '''Stands in for an asks response when the server answers 304
+    '''
+
+    def __init__(self, url: str, entry: dict):
+        self.url = url
+        self.status_code = 200
+        self.headers = {}
+        self.content = entry['body']
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self, **kwargs):
+        return json.loads(self.content, **kwargs)
+
+
+class AuditSession:
+    '''Wraps a single pooled `asks.Session` so every query reuses keep-alive
+    connections, `connections` caps the total amount of open sockets and
+    `per_host` caps how many of those can go to the same host.
+
+    `transport` can be any object with an asks like `request` coroutine,
+    usefull to point the whole pipeline at a local stand-in in tests.
+
+    `resolver` is the hostname resolver installed for the run, if any, kept
+    here so its per host resolution timings can be reached from queries.
+
+    Every request is bounded by the http timeout `timeouts` hands out for
+    its host, and its duration is recorded back on success.
+
+    `query_cache` holds the chain queries decorated with `cached_query`, it
+    lives as long as the session. `retry_policy` is how `call_with_retry`
+    retries this session's requests, its per host budgets are shared by
+    every task using the session.
+
+    `block_info_missing` maps the api nodes that answered get_block_info
+    with a 404 to when they did, history samples go straight to get_block
+    on them for `block_info_recheck` seconds.
+    '''
+
+    def __init__(
+        self,
+        connections: int = 32,
+        per_host: int = 4,
+        ssl_context: ssl.SSLContext | None = None,
+        transport=None,
+        http_cache: HTTPCache | None = None,
+        resolver: trio.abc.HostnameResolver | None = None,
+        timeouts: Timeouts | None = None,
+        retry_policy: RetryPolicy | None = None,
+        block_info_recheck: float = 3600
+    ):
+        # share one context between every connection instead of letting
+        # each new socket load the CA store again
+        if ssl_context is None:
+            ssl_context = ssl.create_default_context()
+
+        self.ssl_context = ssl_context
+        if transport is None:
+            transport = asks.Session(
+                connections=connections, ssl_context=ssl_context)
+
+        self.transport = transport
+        self.per_host = per_host
+        self._hosts: dict[str, trio.CapacityLimiter] = {}
+        self.http_cache = http_cache if http_cache is not None else HTTPCache()
+        self.resolver = resolver
+        self.timeouts = timeouts if timeouts is not None else Timeouts()
+        self.query_cache = AsyncTTLCache()
+        self.retry_policy = (
+            retry_policy if retry_policy is not None else RetryPolicy())
+        self.block_info_missing: dict[str, float] = {}
+        self.block_info_recheck = block_info_recheck
+
+    def has_block_info(self, node_url: str) -> bool:
+        '''False if `node_url` recently answered get_block_info with a 404
+        '''
+        missing_since = self.block_info_missing.get(node_url)
+        return (
+            missing_since is None or
+            trio.current_time() - missing_since > self.block_info_recheck
+        )
+
+    def host_limit(self, url: str) -> trio.CapacityLimiter:
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = trio.CapacityLimiter(self.per_host)
+
+        return self._hosts[host]
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        timeout: float | None = None,
+        **kwargs
+    ):
+        host = urlparse(url).netloc
+        if timeout is None:
+            timeout = self.timeouts.timeout('http', host)
+
+        async with traced_wait(self.host_limit(url), 'wait host slot'):
+            start = trio.current_time()
+            with timed('http', url.split('?')[0]) as record:
+                with trio.move_on_after(timeout) as cs:
+                    response = await self.transport.request(
+                        method, url, **kwargs)
+
+                if cs.cancelled_caught:
+                    raise RequestTimeout(
+                        f'timeout after {timeout:.1f}s on {url}')
+
+                record['status'] = response.status_code
+                record['bytes'] = len(response.content or b'')
+
+            self.timeouts.record('http', host, trio.current_time() - start)
+
+        return response
+
+    async def get(self, url: str, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def conditional_get(self, url: str, max_redirects: int = 5, **kwargs):
+        '''GET that sends the cached validators for `url` and serves the
+        cached body on 304, redirects are followed by hand as asks tries
+        to follow a 304 as if it was a redirect
+        '''
+        entry = self.http_cache.entries.get(url)
+        headers = kwargs.pop('headers', {})
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        target = url
+        for _ in range(max_redirects):
+            response = await self.get(
+                target, headers=headers, follow_redirects=False, **kwargs)
+
+            if (response.status_code in [301, 302, 303, 307, 308] and
+                'location' in response.headers):
+                target = urljoin(target, response.headers['location'])
+                continue
+
+            break
+
+        if response.status_code == 304 and entry:
+            self.http_cache.hits += 1
+            return CachedResponse(url, entry)
+
+        self.http_cache.misses += 1
+        if response.status_code == 200:
+            etag = response.headers.get('etag')
+            last_modified = response.headers.get('last-modified')
+            if etag or last_modified:
+                self.http_cache.entries[url] = {
+                    'etag': etag,
+                    'last_modified': last_modified,
+                    'body': response.content
+                }
+
+            else:
+                self.http_cache.entries.pop(url, None)
+
+        return response
+
+    async def close(self):
+        if hasattr(self.transport, 'close'):
+            await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import math
+
+from collections import defaultdict
+
+import trio
+
+
+'''Timeouts learned from the latencies of previous runs, every network
+operation of a gather asks the run's `Timeouts` how long it may take instead
+of using a fixed literal, and reports back how long it actually took so the
+next run can learn from it
+'''
+
+
+# fixed timeouts used while there is no history, also the ceiling of the
+# learned ones
+DEFAULT_TIMEOUTS = {
+    'http': 10,
+    'tls': 10,
+    'p2p': 5,
+    'history': 5
+}
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+
+class Timeouts:
+    '''Per operation kind and per host timeouts, computed as the `q`
+    percentile of the previous successful durations times `factor`, bounded
+    by `floor` and the kind's default. A host without enough history of its
+    own gets the timeout learned across all hosts of that kind, so a host
+    that never answers costs what a typical one takes, not the ceiling.
+
+    `deadline` (trio clock) bounds every timeout handed out, so nothing
+    started during the run outlives it.
+    '''
+
+    def __init__(
+        self,
+        samples: dict[tuple[str, str], list[float]] | None = None,
+        defaults: dict[str, float] | None = None,
+        q: float = 0.99,
+        factor: float = 3,
+        floor: float = 1,
+        min_samples: int = 5,
+        deadline: float = math.inf
+    ):
+        self.samples = samples if samples is not None else {}
+        self.defaults = dict(DEFAULT_TIMEOUTS, **(defaults or {}))
+        self.q = q
+        self.factor = factor
+        self.floor = floor
+        self.min_samples = min_samples
+        self.deadline = deadline
+        self.recorded: dict[tuple[str, str], list[float]] = defaultdict(list)
+        self._index()
+
+    def _index(self):
+        self._by_kind: dict[str, list[float]] = defaultdict(list)
+        for (kind, host), durations in self.samples.items():
+            self._by_kind[kind] += durations
+
+    def start(self, seconds: float | None):
+        '''Set the run deadline `seconds` from now
+        '''
+        self.deadline = (
+            trio.current_time() + seconds if seconds else math.inf)
+
+    def remaining(self) -> float:
+        if self.deadline == math.inf:
+            return math.inf
+
+        return max(self.deadline - trio.current_time(), 0)
+
+    def timeout(
+        self,
+        kind: str,
+        host: str = '',
+        default: float | None = None
+    ) -> float:
+        ceiling = default if default is not None else self.defaults[kind]
+
+        samples = self.samples.get((kind, host), [])
+        if len(samples) < self.min_samples:
+            samples = self._by_kind.get(kind, [])
+
+        value = ceiling
+        if len(samples) >= self.min_samples:
+            value = min(
+                max(percentile(samples, self.q) * self.factor, self.floor),
+                ceiling
+            )
+
+        return min(value, self.remaining())
+
+    def record(self, kind: str, host: str, duration: float):
+        '''Successful operation of `kind` against `host` took `duration`
+        '''
+        self.recorded[(kind, host)].append(duration)
+
+    def commit(self, keep: int = 100) -> dict[tuple[str, str], list[float]]:
+        '''Learn from the durations recorded since the last commit and hand
+        them out to be persisted, for processes that outlive a single run.
+        Only the latest `keep` samples of each host are learned from.
+        '''
+        recorded, self.recorded = self.recorded, defaultdict(list)
+        for key, durations in recorded.items():
+            self.samples[key] = (self.samples.get(key, []) + durations)[-keep:]
+
+        self._index()
+        return recorded
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+
+import trio
+
+
+'''Timing instrumentation of every outbound operation of a gather run, each
+http request, tls probe, port check and block fetch leaves a record with its
+phase timings tagged with the producer and check it was made for.
+
+The producer and check come from context variables set by the audit and the
+check runner, trio tasks inherit them from the task that spawned them so
+queries don't need to pass them around.
+'''
+
+
+current_chain: ContextVar[str | None] = ContextVar(
+    'current_chain', default=None)
+current_owner: ContextVar[str | None] = ContextVar(
+    'current_owner', default=None)
+current_check: ContextVar[str | None] = ContextVar(
+    'current_check', default=None)
+current_attempt: ContextVar[int] = ContextVar('current_attempt', default=0)
+
+_recorder: ContextVar['Timings | None'] = ContextVar(
+    'timings_recorder', default=None)
+_operation: ContextVar[dict | None] = ContextVar(
+    'timings_operation', default=None)
+
+
+TIMING_FIELDS = [
+    'owner',
+    'check_name',
+    'kind',
+    'target',
+    'attempt',
+    'dns',
+    'connect',
+    'tls',
+    'first_byte',
+    'total',
+    'bytes',
+    'status',
+    'error'
+]
+
+
+class Timings:
+    '''Collects the timing records of a run, `install` makes it the recorder
+    for the current task and every task it spawns afterwards
+    '''
+
+    def __init__(self):
+        self.records: list[dict] = []
+
+    def install(self):
+        return _recorder.set(self)
+
+
+def _new_record(kind: str, target: str) -> dict:
+    record = dict.fromkeys(TIMING_FIELDS)
+    record.update(
+        # not persisted, runs are stored per chain
+        chain=current_chain.get(),
+        owner=current_owner.get(),
+        check_name=current_check.get(),
+        kind=kind,
+        target=target,
+        attempt=current_attempt.get()
+    )
+    return record
+
+
+@contextmanager
+def timed(kind: str, target: str):
+    '''Time the operation in the with block, yields its record so the caller
+    can fill in the phases it can tell apart, dns time is filled in by the
+    hostname resolver
+    '''
+    record = _new_record(kind, target)
+    recorder = _recorder.get()
+    token = _operation.set(record)
+    start = trio.current_time()
+    try:
+        yield record
+
+    except BaseException as e:
+        record['error'] = (
+            'cancelled' if isinstance(e, trio.Cancelled) else str(e)[:200])
+        raise
+
+    finally:
+        record['total'] = trio.current_time() - start
+        _operation.reset(token)
+        if recorder is not None:
+            recorder.records.append(record)
+
+
+def record_timing(kind: str, target: str, total: float, **fields):
+    '''Record an operation timed by the caller
+    '''
+    recorder = _recorder.get()
+    if recorder is None:
+        return
+
+    record = _new_record(kind, target)
+    record.update(total=total, **fields)
+    recorder.records.append(record)
+
+
+def add_dns_time(duration: float):
+    '''Attribute a name lookup to the operation in progress, if any
+    '''
+    record = _operation.get()
+    if record is not None:
+        record['dns'] = (record['dns'] or 0) + duration
+
+
+def _slowest(
+    records: list[dict],
+    key,
+    limit: int
+) -> list[tuple[str, int, float, float]]:
+    groups = defaultdict(list)
+    for record in records:
+        groups[key(record)].append(record['total'] or 0)
+
+    return sorted(
+        (
+            (name, len(totals), sum(totals) / len(totals), max(totals))
+            for name, totals in groups.items()
+        ),
+        key=lambda row: row[3],
+        reverse=True
+    )[:limit]
+
+
+def summarize_timings(records: list[dict], limit: int = 10) -> str:
+    '''Text table of the slowest producers, checks and endpoints of a run
+    '''
+    sections = [
+        (
+            'producers',
+            [r for r in records if r['kind'] == 'producer'],
+            lambda r: r['owner']
+        ),
+        (
+            'checks',
+            [r for r in records if r['kind'] == 'check'],
+            lambda r: r['target']
+        ),
+        (
+            'endpoints',
+            [r for r in records if r['kind'] not in ['producer', 'check']],
+            lambda r: f'{r["kind"]} {r["target"]}'
+        )
+    ]
+
+    lines = []
+    for title, group, key in sections:
+        lines.append(f'slowest {title}:')
+        lines.append(f'{"max":>9} {"avg":>9} {"count":>6}  name')
+        for name, count, avg, worst in _slowest(group, key, limit):
+            lines.append(f'{worst:8.2f}s {avg:8.2f}s {count:6}  {name}')
+
+        lines.append('')
+
+    return '\n'.join(lines)
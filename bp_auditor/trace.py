@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import json
+import time
+
+from contextlib import asynccontextmanager
+
+import trio
+
+from .timings import current_owner, current_check
+
+
+'''Scheduling trace of a gather run in the Chrome trace event format, opens
+in chrome://tracing or ui.perfetto.dev.
+
+Every task gets its own track with a span covering its whole life, each
+scheduler step a task runs is drawn on the "run loop" track, and time spent
+waiting on a capacity limiter shows up as a span on the waiting task's track.
+Spans are tagged with the producer owner and check the task works for.
+'''
+
+
+# tracer of the run in progress, limiter waits are reported to it
+_active: 'ChromeTracer | None' = None
+
+
+class ChromeTracer(trio.abc.Instrument):
+
+    def __init__(self):
+        self.events: list[dict] = []
+        self._start = time.perf_counter()
+        self._tids: dict[trio.lowlevel.Task, int] = {}
+        self._spawned: dict[trio.lowlevel.Task, float] = {}
+        self._step: float | None = None
+
+    def _now(self) -> float:
+        return (time.perf_counter() - self._start) * 1e6
+
+    def _tid(self, task: trio.lowlevel.Task) -> int:
+        if task not in self._tids:
+            self._tids[task] = len(self._tids) + 1
+
+        return self._tids[task]
+
+    def _tags(self, task: trio.lowlevel.Task) -> dict:
+        tags = {'task': task.name}
+        for var in [current_owner, current_check]:
+            value = task.context.get(var)
+            if value is not None:
+                tags[var.name.removeprefix('current_')] = value
+
+        return tags
+
+    def _label(self, task: trio.lowlevel.Task) -> str:
+        tags = self._tags(task)
+        if 'owner' in tags:
+            return ' '.join(
+                tags[key] for key in ['owner', 'check'] if key in tags)
+
+        return task.name.rsplit('.', 1)[-1]
+
+    def span(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        task: trio.lowlevel.Task,
+        **args
+    ):
+        self.events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': start,
+            'dur': end - start,
+            'pid': 1,
+            'tid': self._tid(task),
+            'args': dict(self._tags(task), **args)
+        })
+
+    def before_run(self):
+        global _active
+        _active = self
+
+    def after_run(self):
+        global _active
+        _active = None
+
+    def task_spawned(self, task):
+        self._spawned[task] = self._now()
+        self._tid(task)
+
+    def before_task_step(self, task):
+        self._step = self._now()
+
+    def after_task_step(self, task):
+        self.events.append({
+            'name': self._label(task),
+            'ph': 'X',
+            'ts': self._step,
+            'dur': self._now() - self._step,
+            'pid': 1,
+            'tid': 0,
+            'args': self._tags(task)
+        })
+
+    def task_exited(self, task):
+        start = self._spawned.pop(task, self._now())
+        self.span(self._label(task), start, self._now(), task)
+
+        self.events.append({
+            'name': 'thread_name',
+            'ph': 'M',
+            'pid': 1,
+            'tid': self._tid(task),
+            'args': {'name': self._label(task)}
+        })
+
+    def write(self, path: str):
+        with open(path, 'w') as trace_file:
+            json.dump({
+                'traceEvents': [{
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': 1,
+                    'tid': 0,
+                    'args': {'name': 'run loop'}
+                }] + self.events,
+                'displayTimeUnit': 'ms'
+            }, trace_file)
+
+
+@asynccontextmanager
+async def traced_wait(limiter: trio.CapacityLimiter, name: str):
+    '''Acquire `limiter` like `async with limiter`, if a tracer is running
+    the time spent waiting for it gets recorded as a span named `name`
+    '''
+    tracer = _active
+    if tracer is None:
+        async with limiter:
+            yield
+
+        return
+
+    start = tracer._now()
+    async with limiter:
+        end = tracer._now()
+        # only record actual waits, uncontended acquires are instant
+        if end - start > 1:
+            tracer.span(
+                name, start, end, trio.lowlevel.current_task(),
+                borrowed=limiter.borrowed_tokens,
+                total=limiter.total_tokens
+            )
+
+        yield
@@ -1,15 +1,29 @@
 #!/usr/bin/env python3
 
 import sys
-
-from random import randint
+import ssl
+import socket
+
+from random import randint, uniform
+from datetime import datetime, timezone
+from functools import wraps
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 from pathlib import Path
 
+import trio
+
+from .timings import current_attempt
+
 
 class NetworkError(BaseException):
     ...
 
 
+class RequestTimeout(NetworkError):
+    ...
+
+
 class MalformedJSONError(BaseException):
     ...
 
@@ -42,48 +56,324 @@ def validate_block(block: dict):
     ], block)
 
 
+def validate_block_info(block: dict):
+    '''Header fields returned by get_block_info, a subset of get_block
+    '''
+    _validate_fields([
+        "timestamp",
+        "producer",
+        "confirmed",
+        "previous",
+        "transaction_mroot",
+        "action_mroot",
+        "schedule_version",
+        "producer_signature",
+        "id",
+        "block_num",
+        "ref_block_prefix"
+    ], block)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    '''Seconds to wait from a Retry-After header, either delay seconds or
+    an http date, None if missing or unreadable
+    '''
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0)
+
+    except ValueError:
+        ...
+
+    try:
+        when = parsedate_to_datetime(value)
+
+    except (TypeError, ValueError):
+        return None
+
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+class RetryPolicy:
+    '''How `call_with_retry` deals with failed calls:
+
+    - `retry_on`: exceptions worth another attempt, unless they are also in
+      `give_up_on`. Anything else, trio cancellation included, is raised
+      right away. Timeouts and certificate or name resolution failures
+      won't go away by asking again, so they aren't retried.
+    - `statuses`: http statuses of responses worth another attempt, once
+      out of attempts the last response is returned.
+    - `backoff` and `max_backoff`: attempt n waits a random time between
+      zero and `backoff * 2 ** n` seconds, capped at `max_backoff`.
+    - `max_retry_after`: a Retry-After header is honored over the backoff,
+      if it asks for longer than this the call gives up instead.
+    - `budget` and `budget_refill`: retries each host can get across all
+      tasks, refilled by `budget_refill` per second, so a host in trouble
+      doesn't get hammered by every producer at once.
+    '''
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        retry_on: tuple[type, ...] = (Exception, NetworkError),
+        give_up_on: tuple[type, ...] = (
+            RequestTimeout,
+            ssl.SSLCertVerificationError,
+            socket.gaierror
+        ),
+        statuses: frozenset[int] = frozenset({429, 502, 503, 504}),
+        backoff: float = 0.25,
+        max_backoff: float = 5,
+        max_retry_after: float = 30,
+        budget: float = 10,
+        budget_refill: float = 0.5
+    ):
+        self.attempts = attempts
+        self.retry_on = retry_on
+        self.give_up_on = give_up_on
+        self.statuses = statuses
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+        self.budget_refill = budget_refill
+        # host -> (tokens left, time of last update)
+        self._budgets: dict[str, tuple[float, float]] = {}
+        self.retries = 0
+        self.denied = 0
+
+    def retryable(self, error: BaseException) -> bool:
+        return (
+            isinstance(error, self.retry_on) and
+            not isinstance(error, self.give_up_on)
+        )
+
+    def delay(self, attempt: int, response=None) -> float | None:
+        '''Seconds to wait before the attempt after `attempt`, None to give
+        up
+        '''
+        headers = getattr(response, 'headers', None) or {}
+        retry_after = parse_retry_after(headers.get('retry-after'))
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+
+        return uniform(0, min(self.backoff * 2 ** attempt, self.max_backoff))
+
+    def spend(self, host: str) -> bool:
+        '''Take one retry out of `host`'s budget, False if it ran out
+        '''
+        now = trio.current_time()
+        tokens, last = self._budgets.get(host, (self.budget, now))
+        tokens = min(self.budget, tokens + (now - last) * self.budget_refill)
+        if tokens < 1:
+            self._budgets[host] = (tokens, now)
+            self.denied += 1
+            return False
+
+        self._budgets[host] = (tokens - 1, now)
+        self.retries += 1
+        return True
+
+
 async def call_with_retry(
     call, *args, **kwargs
 ):
-    '''Attempts to run the same call 3 times, and caches the exception
-    if it runs out of tries raises, usefull for network functions to
-    discard unrelated network errors to the query at hand
+    '''Run `call` retrying failures as the `RetryPolicy` of the session
+    `call` is bound to says, a default policy if it has none. The first
+    argument is taken as the url whose host pays for the retries.
+
+    Raises the last error or returns the last response once out of
+    attempts, usefull for network functions to discard unrelated network
+    errors to the query at hand
+    '''
+    policy = getattr(getattr(call, '__self__', None), 'retry_policy', None)
+    if policy is None:
+        policy = RetryPolicy()
+
+    host = urlparse(args[0]).netloc if args and isinstance(args[0], str) else ''
+    for attempt in range(policy.attempts):
+        # lets the timing records tell retries apart
+        token = current_attempt.set(attempt)
+        try:
+            result = await call(*args, **kwargs)
+            error = None
+            if getattr(result, 'status_code', None) not in policy.statuses:
+                return result
+
+        except BaseException as e:
+            if not policy.retryable(e):
+                raise
+
+            result, error = None, e
+
+        finally:
+            current_attempt.reset(token)
+
+        if attempt + 1 == policy.attempts:
+            break
+
+        delay = policy.delay(attempt, result)
+        if delay is None or not policy.spend(host):
+            break
+
+        await trio.sleep(delay)
+
+    if error is not None:
+        raise error
+
+    return result
+
+
+class SingleFlight:
+    '''Coalesces concurrent calls that share a key, the first caller runs
+    the call and everyone else arriving while it is in flight waits for and
+    gets the same result (or exception)
     '''
-    ex = None
-    for i in range(3):
+
+    def __init__(self):
+        self._calls: dict = {}
+
+    async def call(self, key, call, *args, **kwargs):
+        while key in self._calls:
+            done, outcome = self._calls[key]
+            await done.wait()
+
+            # if the leader got cancelled its result means nothing to us,
+            # loop and either join the next flight or lead one ourselves
+            if isinstance(outcome.get('error'), trio.Cancelled):
+                continue
+
+            if 'error' in outcome:
+                raise outcome['error']
+
+            return outcome['result']
+
+        done, outcome = trio.Event(), {}
+        self._calls[key] = (done, outcome)
         try:
-            return await call(*args, **kwargs)
+            outcome['result'] = await call(*args, **kwargs)
+            return outcome['result']
 
         except BaseException as e:
-            ex = e
+            outcome['error'] = e
+            raise
+
+        finally:
+            del self._calls[key]
+            done.set()
 
-    raise ex
 
+class AsyncTTLCache:
+    '''Results of async calls kept for a time to live each, concurrent misses
+    on the same key share a single call through `SingleFlight`. Failed calls
+    aren't cached.
+    '''
 
-def get_random_block_number(head_block: int, percentile: int):
-    '''Gets a random block number from the bottom 10% or top 90%
-    of blocks
+    def __init__(self):
+        self._entries: dict = {}
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    async def _fill(self, key, ttl: float, call, *args, **kwargs):
+        self.misses += 1
+        result = await call(*args, **kwargs)
+        self._entries[key] = (trio.current_time() + ttl, result)
+        return result
+
+    async def get(self, key, ttl: float, call, *args, **kwargs):
+        '''Cached result for `key`, `call(*args, **kwargs)` fills it on a
+        miss and the result is kept for `ttl` seconds
+        '''
+        if key in self._entries:
+            expires, result = self._entries[key]
+            if trio.current_time() < expires:
+                self.hits += 1
+                return result
+
+        return await self._flights.call(
+            key, self._fill, key, ttl, call, *args, **kwargs)
+
+
+def cached_query(ttl: float):
+    '''Cache a `query(session, url, ...)` coroutine on the session's query
+    cache for `ttl` seconds, keyed by query, url and arguments. Sessions
+    without one run the query every time.
     '''
-    match percentile:
-        case 10:
-            value = randint(1, round(head_block * 0.1))
-        case 90:
-            value = randint(round(head_block * 0.9), head_block)
+    def decorator(query):
+        @wraps(query)
+        async def wrapper(session, url: str, *args, **kwargs):
+            cache = getattr(session, 'query_cache', None)
+            if cache is None:
+                return await query(session, url, *args, **kwargs)
+
+            key = (query.__name__, url, args, tuple(sorted(kwargs.items())))
+            return await cache.get(
+                key, ttl, query, session, url, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def history_sample_label(i: int, samples: int) -> str:
+    '''"early" for the oldest slice of the chain, "late" for the newest and
+    the slice start percentage for the ones in between
+    '''
+    if i == 0:
+        return 'early'
+
+    if i == samples - 1:
+        return 'late'
+
+    return f'{round(100 * i / samples)}%'
+
+
+def history_sample_order(label: str) -> float:
+    match label:
+        case 'early':
+            return 0
+        case 'late':
+            return 100
         case _:
-            raise ValueError('percentile must be 10 or 90')
+            return float(label.rstrip('%'))
 
-    return round(value, 0)
+
+def sample_block_numbers(head_block: int, samples: int) -> dict[str, int]:
+    '''One random block number out of each of `samples` equal slices of the
+    chain, keyed by `history_sample_label`
+    '''
+    samples = max(samples, 2)
+    blocks = {}
+    for i in range(samples):
+        low = round(head_block * i / samples) + 1
+        high = max(low, round(head_block * (i + 1) / samples))
+        blocks[history_sample_label(i, samples)] = randint(low, high)
+
+    return blocks
 
 
 _templates_dir = Path(__file__).resolve().parent / 'templates'
 _binary_dir = Path(sys.executable).resolve().parent
-def install_sysmted_service(chain: str, url: str, db: str = 'reports.db'):
-    with (
-        open(_templates_dir / 'auditor.service') as service_template_file,
-        open(_templates_dir / 'auditor.timer') as timer_template_file,
-    ):
+def install_sysmted_service(
+    chain: str,
+    url: str,
+    db: str = 'reports.db',
+    serve: bool = False
+):
+    '''Generate the systemd units of the auditor in the working directory
+    and optionally link them into the systemd unit directory, a once a day
+    timer running gather or with `serve` a single long running serve service
+    '''
+    with open(
+        _templates_dir / ('auditor-serve.service' if serve else 'auditor.service')
+    ) as service_template_file:
         service_template = service_template_file.read()
-        timer_template = timer_template_file.read()
 
     work_dir = Path().cwd()
 
@@ -97,23 +387,32 @@ def install_sysmted_service(chain: str, url: str, db: str = 'reports.db'):
         db_location=db,
         work_dir=str(work_dir)
     )
-    timer_unit = timer_template.format(
-        chain=chain
-    )
 
     service_unit_path = work_dir / f'bpaudit-{chain}.service'
-    timer_unit_path = work_dir / f'bpaudit-{chain}.timer'
-
-    with (
-        open(service_unit_path, 'w+') as service_template_file,
-        open(timer_unit_path, 'w+') as timer_template_file,
-    ):
+    with open(service_unit_path, 'w+') as service_template_file:
         service_template_file.write(service_unit)
-        timer_template_file.write(timer_unit)
 
-    print('Generated .service and .timer files:\n')
-    print(str(service_unit_path))
-    print(str(timer_unit_path))
+    unit_paths = [service_unit_path]
+    if serve:
+        print('Generated .service file:\n')
+
+    else:
+        with open(_templates_dir / 'auditor.timer') as timer_template_file:
+            timer_template = timer_template_file.read()
+
+        timer_unit = timer_template.format(
+            chain=chain
+        )
+
+        timer_unit_path = work_dir / f'bpaudit-{chain}.timer'
+        with open(timer_unit_path, 'w+') as timer_template_file:
+            timer_template_file.write(timer_unit)
+
+        unit_paths.append(timer_unit_path)
+        print('Generated .service and .timer files:\n')
+
+    for unit_path in unit_paths:
+        print(str(unit_path))
 
     while True:
         resp = input('Do you wish to install units? y/n: ')
@@ -126,26 +425,28 @@ def install_sysmted_service(chain: str, url: str, db: str = 'reports.db'):
 
                 systemd_dir = Path(systemd_dir).resolve()
 
-                service_link = systemd_dir / service_unit_path.name
-                if service_link.is_file():
-                    service_link.unlink()
-                service_link.symlink_to(service_unit_path)
-
-                timer_link = systemd_dir / timer_unit_path.name
-                if timer_link.is_file():
-                    timer_link.unlink()
-                timer_link.symlink_to(timer_unit_path)
+                for unit_path in unit_paths:
+                    unit_link = systemd_dir / unit_path.name
+                    if unit_link.is_file():
+                        unit_link.unlink()
+                    unit_link.symlink_to(unit_path)
 
                 print(f'Done! create symlinks on {systemd_dir} to the generated unit files.\n')
                 print('To make systemd daemon aware of the new unit files please run:\n')
                 print('\t\"systemctl daemon-reload\"\n')
 
-                print('To run data gatherer manually:\n')
-                print(f'\t\"systemctl start {service_unit_path.name}\"\n')
+                if serve:
+                    print('To start the rolling audit daemon (and on every boot):\n')
+                    print(f'\t\"systemctl enable {service_unit_path.name}\"\n')
+                    print(f'\t\"systemctl start {service_unit_path.name}\"\n')
+
+                else:
+                    print('To run data gatherer manually:\n')
+                    print(f'\t\"systemctl start {service_unit_path.name}\"\n')
 
-                print('To start timer (will run data gatherer every day at 00:00 UTC):\n')
-                print(f'\t\"systemctl enable {timer_unit_path.name}\"\n')
-                print(f'\t\"systemctl start {timer_unit_path.name}\"\n')
+                    print('To start timer (will run data gatherer every day at 00:00 UTC):\n')
+                    print(f'\t\"systemctl enable {timer_unit_path.name}\"\n')
+                    print(f'\t\"systemctl start {timer_unit_path.name}\"\n')
 
                 print('IMPORTANT: add \"--user\" to systemd commands if installed at user level.')
 
@@ -1,24 +1,24 @@
 #!/usr/bin/python3
 
-import json
-
 from pathlib import Path
 from datetime import datetime
 from contextlib import contextmanager
 
-import openpyxl
-
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
-from openpyxl.styles import PatternFill, Alignment, Font
+from openpyxl.styles import PatternFill, Alignment, Font, NamedStyle
 
-from .db import read_all_reports_from
+from .db import read_rendered_rows_from, read_run_chains
+from .evaluate import evaluate_report, RENDER_VERSION
 
 
 @contextmanager
 def open_calc_book(doc_location: str = 'report.xlsx'):
-    # Create a new workbook
-    wb = Workbook()
+    # Create a new streaming workbook, rows get flushed to disk as they are
+    # appended so memory use doesn't grow with the amount of reports
+    wb = Workbook(write_only=True)
+    add_styles(wb)
 
     yield wb
 
@@ -53,39 +53,117 @@ COLORS_CPU = [
     [COLOR_WHITE, COLOR_CPU_RED],
 ]
 
+# precomputed cell styles, registered once per workbook and shared by name
+STYLE_HEADER = 'bpaudit-header'
+STYLE_CELL = 'bpaudit-cell'
+STYLE_PASSED = 'bpaudit-passed'
+STYLE_FAILED = 'bpaudit-failed'
+STYLES_CPU = ['bpaudit-cpu-green', 'bpaudit-cpu-yellow', 'bpaudit-cpu-red']
+
+HEADER = ['', 'URL', 'BP_JSON', 'TLS/SSL', 'P2P', 'History', 'CPU']
+
+
+def _colored_style(
+    name: str,
+    fg_color: str,
+    bg_color: str,
+    alignment: Alignment | None = None
+) -> NamedStyle:
+    style = NamedStyle(name=name)
+    style.fill = PatternFill(start_color=bg_color, fill_type='solid')
+    style.font = Font(color=fg_color)
+    if alignment:
+        style.alignment = alignment
+
+    return style
+
+
+def add_styles(wb):
+    top_left = Alignment(horizontal='left', vertical='top')
+
+    wb.add_named_style(
+        _colored_style(STYLE_HEADER, COLOR_HEADER_FG, COLOR_HEADER_BG))
+
+    cell = NamedStyle(name=STYLE_CELL)
+    cell.alignment = top_left
+    wb.add_named_style(cell)
+
+    wb.add_named_style(
+        _colored_style(STYLE_PASSED, *COLORS_PASSED, alignment=top_left))
+    wb.add_named_style(
+        _colored_style(STYLE_FAILED, *COLORS_FAILED, alignment=top_left))
+
+    for name, colors in zip(STYLES_CPU, COLORS_CPU):
+        wb.add_named_style(
+            _colored_style(name, *colors, alignment=top_left))
+
 
-def set_cell_color(ws, coord: str, fg_color: str, bg_color: str):
-    # Create a new fill object with the gradient type set to 'path'
-    ws[coord].fill = PatternFill(start_color=bg_color, fill_type='solid')
-    ws[coord].font = Font(color=fg_color)
+def _row_height(value) -> int | None:
+    if value:
+        return max(10, len(value.split('\n'))) * 3
 
+    return None
 
-def get_sheet_or_create(wb, sheet_name: str):
-    try:
-        return wb.get_sheet_by_name(sheet_name)
 
-    except KeyError:
-        ws = wb.create_sheet(sheet_name)
-        # Header
-        ws['B1'] = 'URL'
-        ws['C1'] = 'BP_JSON'
-        ws['D1'] = 'TLS/SSL'
-        ws['E1'] = 'P2P'
-        ws['F1'] = 'History'
-        ws['G1'] = 'CPU'
+def _styled(ws, value, style: str):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
 
-        for ord_col in range(ord('A'), ord('G') + 1):
-            coord = chr(ord_col) + '1'
-            set_cell_color(ws, coord, COLOR_HEADER_FG, COLOR_HEADER_BG)
 
-        return ws
+def create_sheet(wb, sheet_name: str, first_row: dict):
+    '''Create a producer sheet, on write only sheets column widths must be set
+    before any row is written so they get sized from the first data row
+    '''
+    ws = wb.create_sheet(sheet_name)
 
+    cells = first_row['cells']
+    for col in range(1, len(HEADER) + 1):
+        value = cells[col - 1] if col <= len(cells) else None
+        length = max(20, len(str(value)))
+        ws.column_dimensions[get_column_letter(col)].width = length
+
+    ws.row_dimensions[1].height = _row_height(HEADER[3])
+    ws.append([_styled(ws, value, STYLE_HEADER) for value in HEADER])
+
+    return ws
+
+
+def render_row(ws, row: dict):
+    if row['exception'] is not None:
+        ws.append(row['cells'])
+        return
+
+    cells = []
+    for col, value in enumerate(row['cells']):
+        style = STYLE_CELL
+        match col:
+            case 3:
+                style = STYLE_PASSED if row['tls'] else STYLE_FAILED
+            case 4:
+                style = STYLE_PASSED if row['p2p'] else STYLE_FAILED
+            case 5:
+                style = STYLE_PASSED if row['history'] else STYLE_FAILED
+            case 6:
+                if row['cpu_rank'] is not None:
+                    style = STYLES_CPU[row['cpu_rank']]
+
+        cells.append(_styled(ws, value, style))
+
+    ws.append(cells)
 
 
 def produce_monthly_report(
     db_location: str,
-    doc_location: str
+    doc_location: str,
+    since: datetime | None = None,
+    chain: str | None = None
 ):
+    '''Write the report of every run since `since`, the start of the current
+    month by default, to `doc_location`. A report covers a single chain, so
+    `chain` is required when runs of more than one chain were stored in the
+    period.
+    '''
 
     # Get the current month and year
     now = datetime.utcnow()
@@ -94,145 +172,56 @@ def produce_monthly_report(
 
     # Get the timestamp for the first day of the current month at 00:00 UTC
     first_day_of_month = datetime(current_year, current_month, 1, 0, 0, 0)
+    if since:
+        first_day_of_month = since
+
+    if chain is None:
+        chains = read_run_chains(db_location, first_day_of_month)
+        if len(chains) > 1:
+            raise ValueError(
+                f'runs from {len(chains)} chains since {first_day_of_month}, '
+                f'produce a report per chain: {", ".join(chains)}')
 
     with open_calc_book(doc_location=doc_location) as workbook:
-        # Get the default worksheet
-        default_ws = workbook.active
+        # Welcome sheet goes first but is written last, once the report
+        # period is known
+        default_ws = workbook.create_sheet('Sheet')
+        default_ws.column_dimensions['A'].width = 128
+        default_ws.row_dimensions[1].height = 256
 
+        # owner -> (worksheet, next row index)
         sheets = {}
 
         first_report_time = None
         last_report_time = None
 
         # Iterate through the rows and add data to cells
-        for timestamp, reports in read_all_reports_from(db_location, first_day_of_month):
+        # only runs added since the last produce get evaluated, the rest
+        # come already rendered from the db
+        for timestamp, rows in read_rendered_rows_from(
+            db_location, first_day_of_month, RENDER_VERSION, evaluate_report,
+            chain=chain
+        ):
             if not first_report_time:
                 first_report_time = datetime.fromisoformat(timestamp)
 
             last_report_time = datetime.fromisoformat(timestamp)
 
-            for report in reports:
-                owner = report['owner']
+            for row in rows:
+                owner = row['owner']
                 if owner not in sheets:
-                    sheets[owner] = 2
-
-                ws = get_sheet_or_create(workbook, owner)
-
-                ssl_report = ''
-                ssl_passed = False
-                if 'ssl_endpoints' in report:
-                    for ssl_endpoint in report['ssl_endpoints']:
-                        capabilities, url, tlsv = ssl_endpoint
-                        ssl_passed = ssl_passed or (
-                            ('query' in capabilities and tlsv in ['TLSv1.3', 'TLSv1.2']) or
-                            ('full' in capabilities and tlsv in ['TLSv1.3', 'TLSv1.2'])
-                        )
-                        ssl_report += f'{json.dumps(capabilities)}, {tlsv}\n'
-
-                p2p_report = ''
-                p2p_passed = False
-                if 'p2p_endpoints' in report:
-                    for p2p_endpoint in report['p2p_endpoints']:
-                        capabilities, url, status = p2p_endpoint
-                        p2p_passed = p2p_passed or ('seed' in capabilities and status == 'ok')
-                        p2p_report += f'{json.dumps(capabilities)}, {status}\n'
-
-                hist_report = ''
-                hist_passed = False
-                if 'history' in report:
-                    early = report['history']['early']
-                    late = report['history']['late']
-
-                    hist_report = 'early: '
-                    early_passed = False
-                    if len(early) == 2:
-                        _id, block_num = early
-                        hist_report += f'{block_num}\n'
-                        early_passed = True
-                    else:
-                        hist_report += early + '\n'
-
-                    hist_report += 'late: '
-                    late_passed = False
-                    if len(late) == 2:
-                        _id, block_num = late
-                        hist_report += f'{block_num}\n'
-                        late_passed = True
-                    else:
-                        hist_report += late + '\n'
-
-                    hist_passed = early_passed and late_passed
-
-                if 'exception' in report:
-                    ws.append([timestamp, report['exception']])
-                else:
-                    ws.append([
-                        timestamp,
-                        report['url'],
-                        report['bp_json'],
-                        ssl_report,
-                        p2p_report,
-                        hist_report,
-                        report['cpu'] if 'cpu' in report else ''
-                    ])
-
-                    # Set alignment
-                    for ord_col in range(ord('A'), ord('G') + 1):
-                        col = chr(ord_col)
-                        coord = col + str(sheets[owner])
-
-                        if col == 'D':
-                            if ssl_passed:
-                                set_cell_color(ws, coord, *COLORS_PASSED)
-                            else:
-                                set_cell_color(ws, coord, *COLORS_FAILED)
-
-                        if col == 'E':
-                            if p2p_passed:
-                                set_cell_color(ws, coord, *COLORS_PASSED)
-                            else:
-                                set_cell_color(ws, coord, *COLORS_FAILED)
-
-                        if col == 'F':
-                            if hist_passed:
-                                set_cell_color(ws, coord, *COLORS_PASSED)
-                            else:
-                                set_cell_color(ws, coord, *COLORS_FAILED)
-
-                        if col == 'G':
-                            cpu_val = ws[coord].value
-                            if 'us' in cpu_val:
-                                val = float(cpu_val.split(' ')[0])
-                                rank = 2
-                                if val >= 0 and val <= 300:
-                                    rank = 0
-                                elif val > 300 and val < 500:
-                                    rank = 1
-                                else:
-                                    rank = 2
-
-                                set_cell_color(ws, coord, *COLORS_CPU[rank])
-
-                        ws[coord].alignment = Alignment(
-                            horizontal='left', vertical='top')
-
-                    sheets[owner] += 1
-
-        # Fix column size
-        for sheet in sheets:
-            ws = workbook[sheet]
-
-            for col in range(ws.min_column, ws.max_column + 1):
-                cell = ws[get_column_letter(col)+'2']
-                length = max(20, len(str(cell.value)))
-                ws.column_dimensions[get_column_letter(col)].width = length
-
-            for row in range(ws.min_row, ws.max_row + 1):
-                row = str(row)
-                cell = ws['D'+row]
-                if cell.value:
-                    length = max(10, len(cell.value.split('\n')))
-                    ws.row_dimensions[int(row)].height = length * 3
+                    sheets[owner] = (create_sheet(workbook, owner, row), 2)
+
+                ws, row_idx = sheets[owner]
+                height = None
+                if row['exception'] is None:
+                    height = _row_height(row['cells'][3])
+
+                if height:
+                    ws.row_dimensions[row_idx].height = height
+
+                render_row(ws, row)
+                sheets[owner] = (ws, row_idx + 1)
 
         ws = default_ws
 
@@ -243,9 +232,4 @@ def produce_monthly_report(
         diff = f'{diff.days} days, {diff.seconds//3600} hours, {(diff.seconds//60)%60} minutes, {diff.seconds%60} seconds'
         welcome_txt += f'a period of {diff}'
 
-        ws.alignment = Alignment(horizontal='center', vertical='center')
-
-        ws['A1'] = welcome_txt
-        ws.column_dimensions['A'].width = 128
-        ws.row_dimensions[1].height = 256
-
+        ws.append([welcome_txt])
@@ -14,7 +14,14 @@ setup(
     install_requires=[
         'trio',
         'asks',
-        'click',
-        'openpyxl'
+        'click'
     ],
+    extras_require={
+        # monthly report spreadsheet, needed by `bpaudit produce`
+        'xlsx': ['openpyxl'],
+        # report delivery, needed by `bpaudit sendtg`
+        'telegram': ['pyTelegramBotAPI'],
+        # local mock network for tests and benchmarks
+        'mocknet': ['trustme']
+    },
 )
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import json
+
+import trio
+
+
+'''Fakes and sample reports shared by the test modules, tests import them
+from here instead of from each other
+'''
+
+
+chain_url = 'http://chain.local'
+chain_id = 'aa' * 32
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int, body, headers: dict | None = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = json.dumps(body)
+        self.content = self.text.encode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeTransport:
+    '''Answers the handful of endpoints a gather run touches
+    '''
+
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, method: str, url: str, **kwargs):
+        self.requests.append((method, url))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await trio.sleep(0.01)
+        self.in_flight -= 1
+
+        if url.endswith('/v1/chain/get_info'):
+            return FakeResponse(200, {
+                'chain_id': chain_id, 'head_block_num': 1000})
+
+        if url.endswith('/v1/chain/get_table_rows'):
+            return FakeResponse(200, {'rows': [
+                {'owner': f'producer{i}', 'url': f'http://bp{i}.local',
+                 'total_votes': str(1000 - i)}
+                for i in range(42)
+            ], 'more': False})
+
+        if url.endswith('/chains.json'):
+            return FakeResponse(404, {})
+
+        if url.endswith('/bp.json'):
+            if kwargs['headers'].get('If-None-Match') == '"v1"':
+                return FakeResponse(304, None)
+
+            return FakeResponse(200, {
+                'producer_account_name': url.split('//')[1].split('.')[0],
+                'org': {},
+                'nodes': []
+            }, headers={'etag': '"v1"'})
+
+        if '/v2/history/get_actions' in url:
+            # a single benchmark per producer, all on the first page
+            if '&skip=' in url and '&skip=0' not in url:
+                return FakeResponse(200, {'actions': []})
+
+            return FakeResponse(200, {'actions': [{
+                '@timestamp': '2023-05-01T12:00:00.000',
+                'global_sequence': i + 1,
+                'producer': f'bp{i}',
+                'cpu_usage_us': 200
+            } for i in range(42)]})
+
+        return FakeResponse(404, {})
+
+
+# one report of each shape a gather run stores
+report_ok = {
+    'owner': 'goodproducer',
+    'url': 'https://good.example',
+    'rank': 1,
+    'total_votes': 1000.5,
+    'bp_json': 'ok',
+    'ssl_endpoints': [
+        ['query', 'https://api.good.example', 'TLSv1.3'],
+        ['seed', 'https://down.good.example', 'timeout connecting to endpoint']
+    ],
+    'ssl_details': [
+        {
+            'version': 'TLSv1.3',
+            'cipher': 'TLS_AES_256_GCM_SHA384',
+            'alpn': 'h2',
+            'cert_expiry': '2030-01-01 00:00:00',
+            'connect_time': 0.05,
+            'handshake_time': 0.1
+        },
+        None
+    ],
+    'p2p_endpoints': [[['seed', 'query'], 'p2p.good.example:9876', 'ok']],
+    'api_endpoints': [['query', 'https://api.good.example']],
+    'history': {'early': ['00ff', 1234], 'late': 'timeout'},
+    'cpu': '250.50 us'
+}
+
+report_bad_json = {
+    'owner': 'badproducer',
+    'url': 'https://bad.example',
+    'bp_json': '404: bp json not found'
+}
+
+report_exception = {
+    'owner': 'crashproducer',
+    'url': 'https://crash.example',
+    'exception': 'Traceback...'
+}
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import trio
+
+from bp_auditor.queries import get_info, get_chain_id
+from bp_auditor.session import AuditSession
+
+from conftest import FakeTransport, chain_url, chain_id
+
+
+async def test_get_info_single_flight(autojump_clock):
+    transport = FakeTransport()
+    async with AuditSession(transport=transport) as session:
+        # 42 producers asking at once share one request
+        async with trio.open_nursery() as n:
+            for _ in range(42):
+                n.start_soon(get_info, session, chain_url)
+
+        # a different chain gets its own entry
+        await get_info(session, 'http://other.local')
+
+        assert await get_chain_id(session, chain_url) == chain_id
+
+        # expired entries get fetched again
+        await trio.sleep(5)
+        await get_info(session, chain_url)
+
+    requests = [url for _, url in transport.requests]
+    assert requests.count(f'{chain_url}/v1/chain/get_info') == 2
+    assert requests.count('http://other.local/v1/chain/get_info') == 1
+    assert session.query_cache.misses == 4
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import trio
+
+from bp_auditor.audit import check_all_producers
+from bp_auditor.checks import Check
+
+from conftest import FakeTransport, chain_url
+
+
+async def test_checks_run_as_dag(tmp_path):
+    order = []
+
+    class First(Check):
+        name = 'first'
+
+        async def run(self, ctx):
+            await trio.sleep(0.1)
+            order.append('first')
+            return 'first output'
+
+    class Second(Check):
+        name = 'second'
+        requires = ('first',)
+
+        async def run(self, ctx, first):
+            order.append(f'second got {first}')
+            ctx.report['second'] = first
+            return None
+
+    class Third(Check):
+        name = 'third'
+        requires = ('second',)
+
+        async def run(self, ctx, second):
+            order.append('third')
+
+    class Independent(Check):
+        name = 'independent'
+        timeout = 0.05
+
+        async def run(self, ctx):
+            ctx.report['independent'] = 'timeout'
+            await trio.sleep(1)
+            ctx.report['independent'] = 'done'
+
+    reports = await check_all_producers(
+        chain_url,
+        db_location=str(tmp_path / 'reports.db'),
+        transport=FakeTransport(),
+        checks=[First(), Second(), Third(), Independent()]
+    )
+
+    assert len(reports) == 42
+    assert order.count('first') == 42
+    assert order.count('second got first output') == 42
+    assert 'third' not in order
+    assert all(report['second'] == 'first output' for report in reports)
+    assert all(report['independent'] == 'timeout' for report in reports)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import subprocess
+
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from bp_auditor.cli import bpaudit, COMMANDS
+
+
+def _modules_after(args: list[str]) -> set[str]:
+    # fresh interpreter, this one already imported everything
+    result = subprocess.run(
+        [
+            sys.executable, '-c',
+            'import sys, json\n'
+            'from bp_auditor.cli import bpaudit\n'
+            f'bpaudit({args!r}, standalone_mode=False)\n'
+            'print(json.dumps(list(sys.modules)))'
+        ],
+        capture_output=True, text=True, check=True,
+        cwd=Path(__file__).resolve().parent.parent
+    )
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def test_gather_skips_optional_imports():
+    modules = _modules_after(['gather', '--help'])
+    assert 'bp_auditor.audit' in modules
+    assert 'openpyxl' not in modules
+    assert 'telebot' not in modules
+    assert 'bp_auditor.xlsx' not in modules
+
+
+def test_help_lists_commands_without_importing_them():
+    modules = _modules_after(['--help'])
+    assert not any(module.startswith('bp_auditor.commands.') for module in modules)
+
+    result = CliRunner().invoke(bpaudit, ['--help'])
+    assert all(name in result.output for name in COMMANDS)
+
+
+def test_install_links_units(tmp_path):
+    systemd_dir = tmp_path / 'systemd'
+    systemd_dir.mkdir()
+
+    runner = CliRunner()
+    with runner.isolated_filesystem(temp_dir=tmp_path):
+        result = runner.invoke(
+            bpaudit, ['install'], input=f'\ny\n{systemd_dir}\n')
+        assert result.exit_code == 0, result.output
+        assert 'systemctl enable bpaudit-telos-mainnet.timer' in result.output
+
+        result = runner.invoke(
+            bpaudit, ['install', '--serve', '-c', 'telos-testnet'],
+            input=f'\ny\n{systemd_dir}\n')
+        assert result.exit_code == 0, result.output
+        assert 'systemctl enable bpaudit-telos-testnet.service' in result.output
+
+    assert sorted(link.name for link in systemd_dir.iterdir()) == [
+        'bpaudit-telos-mainnet.service',
+        'bpaudit-telos-mainnet.timer',
+        'bpaudit-telos-testnet.service'
+    ]
+    assert all(link.is_symlink() for link in systemd_dir.iterdir())
+    assert 'bpaudit serve' in (
+        systemd_dir / 'bpaudit-telos-testnet.service').read_text()
+
+
+def test_missing_extra_is_reported(monkeypatch):
+    def fail_import(name: str):
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+
+    monkeypatch.setattr(
+        'bp_auditor.cli.import_module', lambda _: fail_import('openpyxl'))
+    result = CliRunner().invoke(bpaudit, ['produce'])
+    assert result.exit_code == 1
+    assert 'install the "xlsx" extra' in result.output
+
+    # broken internal imports are not blamed on extras
+    monkeypatch.setattr(
+        'bp_auditor.cli.import_module', lambda _: fail_import('bp_auditor.xlsxx'))
+    result = CliRunner().invoke(bpaudit, ['produce'])
+    assert isinstance(result.exception, ModuleNotFoundError)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+
+from bp_auditor.cpu import CPUAggregate, month_key
+from bp_auditor.db import (
+    read_cpu_aggregates,
+    store_cpu_aggregates,
+    read_cpu_scan_cursor,
+    store_cpu_scan_cursor
+)
+from bp_auditor.checks import CPUBenchmarks
+from bp_auditor.queries import get_avg_performance_this_month
+from bp_auditor.session import AuditSession
+
+from conftest import FakeResponse
+
+
+class FakeHyperion:
+    '''Serves a growing list of eosmechanics:cpu actions, paginated by `after`,
+    `skip` and `limit` the way hyperion does
+    '''
+
+    def __init__(self, actions: list[dict]):
+        self.actions = actions
+        self.requests = []
+
+    async def request(self, method: str, url: str, **kwargs):
+        query = parse_qs(urlparse(url).query)
+        self.requests.append(query)
+        after = query['after'][0]
+        limit = int(query['limit'][0])
+        skip = int(query.get('skip', ['0'])[0])
+        page = [
+            action for action in self.actions
+            if action['@timestamp'] >= after
+        ][skip:skip + limit]
+        return FakeResponse(200, {'actions': page})
+
+
+def make_actions(
+    start: int,
+    count: int,
+    producers: list[str] = ['producer1']
+) -> list[dict]:
+    month = month_key(datetime.utcnow())
+    return [
+        {
+            '@timestamp': f'{month}-01T{i // 3600:02}:{(i // 60) % 60:02}:{i % 60:02}.000',
+            'global_sequence': i,
+            'producer': producers[i % len(producers)],
+            'cpu_usage_us': 100 + i
+        }
+        for i in range(start, start + count)
+    ]
+
+
+async def test_incremental_aggregate(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    hyperion = FakeHyperion(make_actions(1, 250))
+    aggregate = CPUAggregate('producer1', month_key(datetime.utcnow()))
+
+    async with AuditSession(transport=hyperion) as session:
+        result = await get_avg_performance_this_month(
+            session, 'http://chain.local', 'producer1', aggregate=aggregate)
+
+    # every action is folded in, not just the first page, the short third
+    # page ends the scan
+    assert aggregate.count == 250
+    assert len(hyperion.requests) == 3
+    assert result == f'{sum(range(101, 351)) / 250:.2f} us'
+    assert aggregate.min_us == 101 and aggregate.max_us == 350
+    assert abs(aggregate.percentile(0.5) - 225) / 225 < 0.05
+
+    store_cpu_aggregates(db_location, 'chain', [aggregate.to_dict()])
+
+    # next run only pages through what came after the cursor
+    hyperion.actions += make_actions(251, 10)
+    hyperion.requests.clear()
+    stored = read_cpu_aggregates(db_location, 'chain', aggregate.month)
+    aggregate = CPUAggregate(**stored[0])
+
+    async with AuditSession(transport=hyperion) as session:
+        await get_avg_performance_this_month(
+            session, 'http://chain.local', 'producer1', aggregate=aggregate)
+
+    assert aggregate.count == 260
+    assert len(hyperion.requests) == 1
+    assert hyperion.requests[0]['after'] == [stored[0]['last_timestamp']]
+
+
+async def test_bulk_scan(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    producers = ['producer1', 'producer2', 'producer3']
+    hyperion = FakeHyperion(make_actions(1, 300, producers))
+    month = month_key(datetime.utcnow())
+    cpu = CPUBenchmarks(month)
+
+    async with AuditSession(transport=hyperion) as session:
+        results = [
+            await cpu.result(session, 'http://chain.local', producer)
+            for producer in producers + ['producer4']
+        ]
+
+    # one scan for the whole chain, every producer reads from it
+    assert len(hyperion.requests) == 4
+    assert all(aggregate.count == 100 for aggregate in cpu.aggregates.values()
+               if aggregate.owner != 'producer4')
+    assert results[0] == f'{sum(range(103, 401, 3)) / 100:.2f} us'
+    assert results[3] == 'bp hasn\'t called eosmechanics:cpu this month'
+    assert cpu.cursor['last_global_sequence'] == 300
+
+    store_cpu_scan_cursor(db_location, 'chain', month, cpu.cursor)
+
+    # next run resumes from the stored cursor
+    hyperion.actions += make_actions(301, 6, producers)
+    hyperion.requests.clear()
+    cpu = CPUBenchmarks(
+        month,
+        aggregates=cpu.aggregates,
+        cursor=read_cpu_scan_cursor(db_location, 'chain', month)
+    )
+
+    async with AuditSession(transport=hyperion) as session:
+        await cpu.result(session, 'http://chain.local', 'producer1')
+
+    assert cpu.aggregates['producer1'].count == 102
+    assert len(hyperion.requests) == 1
+    assert hyperion.requests[0]['after'] == [make_actions(300, 1)[0]['@timestamp']]
+
+
+async def test_bulk_scan_without_global_sequence():
+    actions = make_actions(1, 30, ['producer1', 'producer2'])
+    for action in actions:
+        del action['global_sequence']
+
+    hyperion = FakeHyperion(actions)
+    cpu = CPUBenchmarks(month_key(datetime.utcnow()))
+
+    async with AuditSession(transport=hyperion) as session:
+        await cpu.result(session, 'http://chain.local', 'producer1')
+
+    # same as folding them one by one, nothing to dedupe them by
+    assert cpu.aggregates['producer1'].count == 15
+    assert cpu.aggregates['producer2'].count == 15
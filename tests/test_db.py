@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import json
+import sqlite3
+
+from datetime import datetime
+
+from click.testing import CliRunner
+
+from bp_auditor.db import (
+    open_db,
+    store_reports,
+    read_all_reports_from,
+    read_producer_reports,
+    rollup_runs_before,
+    read_monthly_rollups,
+    vacuum_db
+)
+from bp_auditor.evaluate import evaluate_report
+from bp_auditor.cli import bpaudit
+
+from conftest import report_ok, report_bad_json, report_exception
+
+
+def test_store_and_read_roundtrip(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    reports = [report_ok, report_bad_json, report_exception]
+    store_reports(db_location, reports)
+    store_reports(db_location, reports)
+
+    runs = list(read_all_reports_from(db_location, datetime(2000, 1, 1)))
+    assert len(runs) == 2
+    for timestamp, run in runs:
+        datetime.fromisoformat(timestamp)
+        assert run == reports
+
+    history = read_producer_reports(db_location, 'goodproducer')
+    assert [report for _, report in history] == [report_ok, report_ok]
+
+
+def test_migrate_legacy_blobs(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    conn = sqlite3.connect(db_location)
+    conn.execute('CREATE TABLE reports (timestamp TIMESTAMP, text BLOB)')
+    conn.execute(
+        'INSERT INTO reports (timestamp, text) VALUES (?, ?)',
+        ('2023-05-02 00:00:01.000123', json.dumps([report_ok, report_bad_json]))
+    )
+    conn.commit()
+    conn.close()
+
+    runs = list(read_all_reports_from(db_location, datetime(2023, 5, 1)))
+    assert runs == [
+        ('2023-05-02 00:00:01.000123', [report_ok, report_bad_json])]
+
+    conn = open_db(db_location)
+    tables = [row[0] for row in conn.execute(
+        'SELECT name FROM sqlite_master WHERE type = \'table\'')]
+    assert 'reports' not in tables
+    assert conn.execute('SELECT avg_us FROM cpu_checks').fetchone()[0] == 250.5
+    conn.close()
+
+
+def test_exceptions_stored_once(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    for _ in range(3):
+        store_reports(db_location, [report_exception])
+
+    conn = open_db(db_location)
+    assert conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0] == 1
+    assert conn.execute(
+        'SELECT COUNT(*) FROM producer_reports WHERE exception IS NOT NULL'
+    ).fetchone()[0] == 0
+    conn.close()
+
+    runs = list(read_all_reports_from(db_location, datetime(2000, 1, 1)))
+    assert [run for _, run in runs] == [[report_exception]] * 3
+
+
+def test_rollup_old_runs(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    reports = [report_ok, report_bad_json, report_exception]
+    for _ in range(3):
+        store_reports(db_location, reports, chain='https://chain.example')
+
+    store_reports(db_location, [report_ok], chain='https://chain.example')
+
+    # first three runs happened back in may
+    conn = open_db(db_location)
+    with conn:
+        conn.execute(
+            'UPDATE runs SET timestamp = \'2023-05-02 00:00:00\' WHERE id < 4')
+    conn.close()
+
+    assert rollup_runs_before(
+        db_location, datetime(2023, 6, 1), evaluate_report) == 3
+    vacuum_db(db_location)
+
+    rollups = {
+        rollup['owner']: rollup
+        for rollup in read_monthly_rollups(
+            db_location, chain='https://chain.example')
+    }
+    assert set(rollups) == {'goodproducer', 'badproducer', 'crashproducer'}
+    good = rollups['goodproducer']
+    assert good['month'] == '2023-05'
+    assert good['runs'] == 3
+    assert good['bp_json_ok'] == good['tls_ok'] == good['p2p_ok'] == 3
+    assert good['history_ok'] == 0
+    assert good['cpu_green'] == 3
+    assert rollups['crashproducer']['exceptions'] == 3
+
+    # only the recent run is left, along with nothing it doesn't reference
+    runs = list(read_all_reports_from(db_location, datetime(2000, 1, 1)))
+    assert [run for _, run in runs] == [[report_ok]]
+
+    conn = open_db(db_location)
+    assert conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0] == 0
+    assert conn.execute('SELECT COUNT(*) FROM tls_checks').fetchone()[0] == 2
+    conn.close()
+
+
+def test_prune_command(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    store_reports(db_location, [report_ok])
+    store_reports(db_location, [report_ok])
+
+    conn = open_db(db_location)
+    with conn:
+        conn.execute(
+            'UPDATE runs SET timestamp = \'2020-01-10 00:00:00\' WHERE id = 1')
+    conn.close()
+
+    result = CliRunner().invoke(bpaudit, ['prune', '--db', db_location])
+    assert result.exit_code == 0, result.output
+    assert 'rolled up 1 runs' in result.output
+
+    rollup, = read_monthly_rollups(db_location)
+    assert rollup['month'] == '2020-01'
+    runs = list(read_all_reports_from(db_location, datetime(2000, 1, 1)))
+    assert len(runs) == 1
+
+
+def test_prune_legacy_exception_reports(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    # before owners were recorded on exception reports
+    legacy_exception = {
+        'url': 'https://good.example',
+        'exception': 'Traceback...'
+    }
+    conn = sqlite3.connect(db_location)
+    conn.execute('CREATE TABLE reports (timestamp TIMESTAMP, text BLOB)')
+    conn.executemany(
+        'INSERT INTO reports (timestamp, text) VALUES (?, ?)',
+        [
+            ('2023-05-02 00:00:01', json.dumps([report_ok])),
+            ('2023-05-03 00:00:01', json.dumps([
+                legacy_exception,
+                {'url': 'https://gone.example', 'exception': 'Traceback...'}
+            ]))
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+    assert rollup_runs_before(
+        db_location, datetime(2023, 6, 1), evaluate_report) == 2
+
+    rollups = {
+        rollup['owner']: rollup
+        for rollup in read_monthly_rollups(db_location)
+    }
+    assert set(rollups) == {'goodproducer', 'https://gone.example'}
+    assert rollups['goodproducer']['runs'] == 2
+    assert rollups['goodproducer']['exceptions'] == 1
+    assert rollups['https://gone.example']['exceptions'] == 1
+    assert list(read_all_reports_from(db_location, datetime(2000, 1, 1))) == []
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import socket
+
+import trio
+
+from bp_auditor import dns
+from bp_auditor.dns import CachingResolver
+
+
+async def test_resolver_caches_and_coalesces(monkeypatch):
+    lookups = []
+    def fake_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+        if not flags & socket.AI_NUMERICHOST:
+            lookups.append(host)
+
+        if flags & socket.AI_NUMERICHOST or host == b'dead.example':
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.1', 0))]
+
+    monkeypatch.setattr(dns.socket, 'getaddrinfo', fake_getaddrinfo)
+
+    resolver = CachingResolver()
+    previous = trio.socket.set_custom_hostname_resolver(resolver)
+    try:
+        results = []
+        async def resolve(port):
+            results.append(await trio.socket.getaddrinfo(
+                'api.example', port, type=socket.SOCK_STREAM))
+
+        async with trio.open_nursery() as n:
+            for port in [443, 9876, 8888] * 5:
+                n.start_soon(resolve, port)
+
+        for _ in range(3):
+            try:
+                await trio.socket.getaddrinfo(
+                    'dead.example', 443, type=socket.SOCK_STREAM)
+
+            except socket.gaierror:
+                ...
+
+    finally:
+        trio.socket.set_custom_hostname_resolver(previous)
+
+    assert lookups == [b'api.example', b'dead.example']
+    assert sorted(set(r[0][4] for r in results)) == [
+        ('10.0.0.1', 443), ('10.0.0.1', 8888), ('10.0.0.1', 9876)]
+    assert list(resolver.timings.keys()) == ['api.example', 'dead.example']
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import socket
+
+from datetime import datetime, timedelta
+
+import trio
+
+from bp_auditor.db import read_endpoint_health, store_endpoint_health
+from bp_auditor.health import EndpointHealth
+from bp_auditor.probes import EndpointProbes
+
+
+def _closed_port() -> int:
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_known_dead_and_recheck():
+    health = EndpointHealth(threshold=3, recheck_after=timedelta(hours=1))
+    key = ('tls', 'dead.local', 443)
+    for _ in range(3):
+        assert not health.known_dead(key)
+        health.record(key, False, error='timeout')
+
+    assert health.known_dead(key)
+
+    # due for a full check again
+    health.entries[key]['last_full_check'] -= timedelta(hours=2)
+    assert not health.known_dead(key)
+
+    health.record(key, True, latency=0.5)
+    health.record(key, True, latency=1.5)
+    assert health.failures(key) == 0
+    assert health.entries[key]['latency'] == 0.5 * 0.8 + 1.5 * 0.2
+
+
+def test_health_round_trip(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    health = EndpointHealth()
+    health.record(('p2p', 'a.local', 9876), True, latency=0.1)
+    health.record(('tls', 'b.local', 443), False, error='refused')
+    store_endpoint_health(db_location, health.entries)
+
+    entries = read_endpoint_health(db_location)
+    assert entries == health.entries
+    assert isinstance(entries[('p2p', 'a.local', 9876)]['last_success'], datetime)
+
+
+async def test_known_dead_fail_fast():
+    port = _closed_port()
+    health = EndpointHealth(threshold=2)
+    sockets = trio.CapacityLimiter(4)
+
+    # the first runs' failures get the full probe
+    for _ in range(2):
+        probes = EndpointProbes(health=health)
+        result = await probes.tls(f'https://127.0.0.1:{port}', sockets)
+        assert 'failing for' not in result
+
+    # then only the quick connect, which fails
+    probes = EndpointProbes(health=health)
+    result = await probes.tls(f'https://127.0.0.1:{port}', sockets)
+    assert result.endswith('failing for 3 checks')
+    assert health.fast_failed == 1
+
+    # a listener that accepts again gets its full check back
+    listeners = await trio.open_tcp_listeners(0, host='127.0.0.1')
+    port = listeners[0].socket.getsockname()[1]
+    key = ('p2p', '127.0.0.1', port)
+    for _ in range(2):
+        health.record(key, False, error='refused')
+
+    assert await probes.p2p(f'127.0.0.1:{port}', sockets) == 'ok'
+    assert health.failures(key) == 0
+    await listeners[0].aclose()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import trio
+import pytest
+
+from bp_auditor.evaluate import evaluate_report
+from bp_auditor.queries import check_history
+from bp_auditor.session import AuditSession
+
+from conftest import FakeResponse, chain_url, chain_id
+
+
+class FakeNode:
+    '''Api node that keeps blocks from `first_block` on, optionally without
+    the get_block_info endpoint
+    '''
+
+    def __init__(self, first_block: int, block_info: bool = True):
+        self.first_block = first_block
+        self.block_info = block_info
+        self.requests = []
+
+    async def request(self, method: str, url: str, **kwargs):
+        self.requests.append(url)
+        await trio.sleep(0.01)
+
+        if url.endswith('/v1/chain/get_info'):
+            return FakeResponse(200, {
+                'chain_id': chain_id, 'head_block_num': 1000})
+
+        if url.endswith('/v1/chain/get_block_info'):
+            if not self.block_info:
+                return FakeResponse(404, {'code': 404, 'message': 'Not Found'})
+
+            block_num = kwargs['json']['block_num']
+
+        elif url.endswith('/v1/chain/get_block'):
+            block_num = int(kwargs['json']['block_num_or_id'])
+
+        else:
+            return FakeResponse(404, {})
+
+        if block_num < self.first_block:
+            return FakeResponse(400, {'code': 400, 'message': 'unknown block'})
+
+        block = {
+            field: ''
+            for field in [
+                'timestamp', 'producer', 'confirmed', 'previous',
+                'transaction_mroot', 'action_mroot', 'schedule_version',
+                'producer_signature', 'ref_block_prefix'
+            ]
+        }
+        block.update(id=f'{block_num:064x}', block_num=block_num)
+        if url.endswith('/get_block'):
+            block.update(transactions=[], new_producers=None)
+
+        return FakeResponse(200, block)
+
+
+async def test_coverage_map(autojump_clock):
+    node = FakeNode(first_block=501)
+    async with AuditSession(transport=node, per_host=16) as session:
+        start = trio.current_time()
+        coverage = await check_history(
+            session, chain_url, 'http://node.local', samples=10)
+        elapsed = trio.current_time() - start
+
+    # get_info, then every sample at once, only touching the header endpoint
+    assert elapsed == pytest.approx(0.02)
+    assert not any(url.endswith('/get_block') for url in node.requests)
+    assert list(coverage) == [
+        'early', '10%', '20%', '30%', '40%', '50%', '60%', '70%', '80%', 'late']
+    assert coverage['early'] == '400: not found'
+    assert coverage['late'][1] > 900
+
+    row = evaluate_report('2023-05-01 00:00:00', {
+        'owner': 'producer', 'url': 'http://bp.local', 'bp_json': 'ok',
+        'history': coverage
+    })
+    assert not row['history']
+    assert 'coverage: 5/10' in row['cells'][5]
+
+
+async def test_get_block_fallback():
+    node = FakeNode(first_block=1, block_info=False)
+    async with AuditSession(transport=node) as session:
+        coverage = await check_history(
+            session, chain_url, 'http://node.local', samples=4)
+
+        assert list(coverage) == ['early', '25%', '50%', 'late']
+        assert all(len(result) == 2 for result in coverage.values())
+        assert sum(url.endswith('/get_block') for url in node.requests) == 4
+
+        # the node is remembered, later samples go straight to get_block
+        node.requests.clear()
+        await check_history(
+            session, chain_url, 'http://node.local', samples=4)
+
+    assert sum(url.endswith('/get_block_info') for url in node.requests) == 0
+    assert sum(url.endswith('/get_block') for url in node.requests) == 4
+
+
+async def test_samples_share_producer_sockets(autojump_clock):
+    node = FakeNode(first_block=1)
+    async with AuditSession(transport=node, per_host=16) as session:
+        start = trio.current_time()
+        coverage = await check_history(
+            session, chain_url, 'http://node.local', samples=10,
+            sockets=trio.CapacityLimiter(4))
+        elapsed = trio.current_time() - start
+
+    # get_info, then the samples in three rounds of at most four
+    assert elapsed == pytest.approx(0.04)
+    assert all(len(result) == 2 for result in coverage.values())
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import pytest
+
+# the mock network needs the `mocknet` extra
+pytest.importorskip('trustme')
+
+from bp_auditor.audit import check_all_producers
+from bp_auditor.mocknet import open_mocknet
+
+
+async def test_gather_against_mocknet(tmp_path):
+    async with open_mocknet(
+        producers=42, latency=0.001, failure_rate=0.2, seed=7
+    ) as net:
+        reports = await check_all_producers(
+            net.chain_url,
+            db_location=str(tmp_path / 'reports.db'),
+            resolver=net.resolver(),
+            ssl_context=net.client_ssl_context(),
+            concurrency=42,
+            deadline=3
+        )
+
+    states = {producer.owner: producer.state for producer in net.producers}
+    assert 'failing' in states.values()
+    assert len(reports) == 42
+
+    for report in reports:
+        assert report['bp_json'] == 'ok'
+        (_, _, tls), = report['ssl_endpoints']
+        (_, _, p2p), = report['p2p_endpoints']
+
+        if states[report['owner']] == 'ok':
+            assert tls == 'TLSv1.3'
+            assert p2p == 'ok'
+            assert report['cpu'].endswith(' us')
+            assert len(report['history']['late']) == 2
+
+        else:
+            assert tls == 'timeout'
+            assert p2p.startswith('Could not connect')
+            assert isinstance(report['history']['late'], str)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+from datetime import datetime
+
+from bp_auditor.db import (
+    store_reports,
+    read_all_reports_from,
+    read_http_cache
+)
+from bp_auditor.audit import check_all_chains
+
+from conftest import FakeTransport, FakeResponse, chain_url
+
+
+testnet_url = 'http://testnet.local'
+testnet_id = 'bb' * 32
+
+
+class TwoChainTransport(FakeTransport):
+    '''Same producers registered on two chains
+    '''
+
+    async def request(self, method: str, url: str, **kwargs):
+        if url == f'{testnet_url}/v1/chain/get_info':
+            self.requests.append((method, url))
+            return FakeResponse(200, {
+                'chain_id': testnet_id, 'head_block_num': 1000})
+
+        return await super().request(method, url, **kwargs)
+
+
+async def test_gather_two_chains(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    transport = TwoChainTransport()
+    results = await check_all_chains(
+        [chain_url, testnet_url],
+        db_location=db_location,
+        transport=transport,
+        connections_per_host=2
+    )
+
+    assert set(results) == {chain_url, testnet_url}
+    for reports in results.values():
+        assert len(reports) == 42
+        assert all(report['bp_json'] == 'ok' for report in reports)
+        assert sorted(r['rank'] for r in reports) == list(range(1, 43))
+
+    # each chain scanned its own cpu benchmarks
+    for url in [chain_url, testnet_url]:
+        assert any(
+            request.startswith(f'{url}/v2/history/get_actions')
+            for _, request in transport.requests
+        )
+
+    for url, reports in results.items():
+        store_reports(db_location, reports, chain=url)
+
+    (_, stored), = read_all_reports_from(
+        db_location, datetime(2000, 1, 1), chain=testnet_url)
+    assert len(stored) == 42
+    assert len(list(read_all_reports_from(
+        db_location, datetime(2000, 1, 1)))) == 2
+
+
+class OneChainDown(FakeTransport):
+    '''Testnet api refuses every connection
+    '''
+
+    async def request(self, method: str, url: str, **kwargs):
+        if url.startswith(testnet_url):
+            self.requests.append((method, url))
+            raise ConnectionRefusedError(f'connection refused on {url}')
+
+        return await super().request(method, url, **kwargs)
+
+
+async def test_unreachable_chain_keeps_the_rest(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    results = await check_all_chains(
+        [chain_url, testnet_url],
+        db_location=db_location,
+        transport=OneChainDown()
+    )
+
+    assert len(results[chain_url]) == 42
+    assert results[testnet_url] == []
+
+    # learned state got stored anyway
+    entries, _ = read_http_cache(db_location)
+    assert len(entries) == 42
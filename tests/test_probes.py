@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import ssl
+
+from functools import partial
+
+import trio
+import pytest
+
+from bp_auditor import probes
+from bp_auditor.dns import CachingResolver
+from bp_auditor.queries import create_ssl_context
+from bp_auditor.queries.network import probe_tls
+from bp_auditor.timings import Timings
+from bp_auditor.utils import NetworkError
+from bp_auditor.probes import EndpointProbes, normalize_ssl_endpoint
+
+
+def test_normalize_ssl_endpoint():
+    assert normalize_ssl_endpoint('https://API.example') == ('api.example', 443)
+    assert normalize_ssl_endpoint('https://api.example:8443/') == (
+        'api.example', 8443)
+
+    # bare host[:port], common on bp.json files
+    assert normalize_ssl_endpoint('api.example:443') == ('api.example', 443)
+    assert normalize_ssl_endpoint(' other.example ') == ('other.example', 443)
+    assert normalize_ssl_endpoint('[::1]:8443') == ('::1', 8443)
+
+    with pytest.raises(ValueError):
+        normalize_ssl_endpoint('https://:443')
+
+
+async def test_each_unique_endpoint_probed_once(monkeypatch):
+    probed = []
+
+    async def fake_tls(url, ssl_context, timeout):
+        probed.append(url)
+        await trio.sleep(0.1)
+        return {'version': 'TLSv1.3'}
+
+    async def fake_port(domain, port, timeout):
+        probed.append((domain, port))
+        await trio.sleep(0.1)
+        if domain == 'dead.example':
+            raise NetworkError('timed out')
+
+    monkeypatch.setattr(probes, 'probe_tls', fake_tls)
+    monkeypatch.setattr(probes, 'check_port', fake_port)
+
+    endpoint_probes = EndpointProbes()
+    results = {}
+
+    async def run(kind, endpoint):
+        sockets = trio.CapacityLimiter(2)
+        probe = getattr(endpoint_probes, kind)
+        results[(kind, endpoint)] = await probe(endpoint, sockets)
+
+    async with trio.open_nursery() as n:
+        for endpoint in [
+            'https://api.example', 'https://API.example:443',
+            'https://api.example/', ' https://api.example'
+        ] * 3:
+            n.start_soon(run, 'tls', endpoint)
+
+        for endpoint in ['p2p.example:9876', 'P2P.example:9876', 'dead.example:9876']:
+            n.start_soon(run, 'p2p', endpoint)
+
+    assert sorted(map(str, probed)) == sorted(map(str, [
+        'https://api.example:443',
+        ('p2p.example', 9876),
+        ('dead.example', 9876)
+    ]))
+    assert results[('tls', 'https://API.example:443')] == {'version': 'TLSv1.3'}
+    assert results[('p2p', 'P2P.example:9876')] == 'ok'
+    assert results[('p2p', 'dead.example:9876')] == 'timed out'
+
+    # later requests get the memoized result
+    assert await endpoint_probes.tls(
+        'https://api.example', trio.CapacityLimiter(1)) == {'version': 'TLSv1.3'}
+    assert len(probed) == 3
+
+
+class SlowResolver(CachingResolver):
+    '''Sends every name to the loopback after a slow lookup
+    '''
+
+    async def _lookup(self, host, port, family, type, proto, flags):
+        await trio.sleep(0.3)
+        return await super()._lookup(
+            '127.0.0.1', port, family, type, proto, flags)
+
+
+async def test_tls_connect_time_excludes_dns():
+    trustme = pytest.importorskip('trustme')
+    ca = trustme.CA()
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ca.issue_cert('api.example').configure_cert(server_context)
+    client_context = create_ssl_context()
+    ca.configure_trust(client_context)
+
+    async def handler(stream):
+        await stream.do_handshake()
+        await stream.aclose()
+
+    timings = Timings()
+    timings.install()
+    previous = trio.socket.set_custom_hostname_resolver(SlowResolver())
+    try:
+        async with trio.open_nursery() as n:
+            listener, = await n.start(partial(
+                trio.serve_ssl_over_tcp, handler, 0, server_context,
+                host='127.0.0.1'))
+            port = listener.transport_listener.socket.getsockname()[1]
+            result = await probe_tls(
+                f'https://api.example:{port}', client_context)
+            n.cancel_scope.cancel()
+
+    finally:
+        trio.socket.set_custom_hostname_resolver(previous)
+
+    record, = timings.records
+    assert record['dns'] >= 0.3
+    assert result['connect_time'] == record['connect']
+    assert result['connect_time'] < record['dns']
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+from bp_auditor.queries import get_all_producers
+from bp_auditor.session import AuditSession
+
+from conftest import FakeResponse, chain_url
+
+
+class FakeProducerTable:
+    '''Serves the eosio producers table by votes, like nodeos it returns at
+    most `max_rows` rows per call and points at the rest through `next_key`
+    '''
+
+    def __init__(self, rows: list[dict], max_rows: int = 30):
+        self.rows = rows
+        self.max_rows = max_rows
+        self.calls = []
+
+    async def request(self, method: str, url: str, **kwargs):
+        params = kwargs['json']
+        self.calls.append(params)
+        start = int(params.get('lower_bound', 0))
+        end = min(start + params['limit'], start + self.max_rows)
+        more = end < len(self.rows)
+        return FakeResponse(200, {
+            'rows': self.rows[start:end],
+            'more': more,
+            'next_key': str(end) if more else ''
+        })
+
+
+def make_rows(count: int, inactive: set[int] = set()) -> list[dict]:
+    return [
+        {
+            'owner': f'producer{i}',
+            'url': f'http://bp{i}.local',
+            'total_votes': str(float(1000 - i)),
+            'is_active': 0 if i in inactive else 1
+        }
+        for i in range(count)
+    ]
+
+
+async def test_top_n():
+    table = FakeProducerTable(make_rows(100))
+
+    async with AuditSession(transport=table) as session:
+        producers = await get_all_producers(session, chain_url, top=42)
+
+    # follows next_key and stops at exactly top-N, no duplicates
+    assert [p['owner'] for p in producers] == [
+        f'producer{i}' for i in range(42)]
+    assert len(table.calls) == 2
+    assert table.calls[1]['lower_bound'] == '30'
+    assert table.calls[1]['limit'] == 42
+
+
+async def test_active_only():
+    table = FakeProducerTable(make_rows(50, inactive={0, 3, 5}))
+
+    async with AuditSession(transport=table) as session:
+        producers = await get_all_producers(
+            session, chain_url, top=42, active_only=True)
+
+    assert len(producers) == 42
+    assert all(p['is_active'] for p in producers)
+    assert producers[-1]['owner'] == 'producer44'
+
+    # a table shorter than top-N ends the scan
+    table = FakeProducerTable(make_rows(10))
+
+    async with AuditSession(transport=table) as session:
+        producers = await get_all_producers(session, chain_url, top=42)
+
+    assert len(producers) == 10
+    assert len(table.calls) == 1
+
+
+class FakeVoteIndex(FakeProducerTable):
+    '''Pages by the vote key itself like the real secondary index does,
+    `lower_bound` lands on the first row with that many votes, so rows that
+    tie on votes come back on every page that starts on them
+    '''
+
+    async def request(self, method: str, url: str, **kwargs):
+        params = kwargs['json']
+        self.calls.append(params)
+        start = 0
+        if 'lower_bound' in params:
+            start = next(
+                i for i, row in enumerate(self.rows)
+                if float(row['total_votes']) <= float(params['lower_bound'])
+            )
+
+        end = min(start + params['limit'], start + self.max_rows)
+        more = end < len(self.rows)
+        return FakeResponse(200, {
+            'rows': self.rows[start:end],
+            'more': more,
+            'next_key': self.rows[end]['total_votes'] if more else ''
+        })
+
+
+async def test_tied_votes_end_the_scan():
+    rows = make_rows(40) + [
+        {
+            'owner': f'retired{i}',
+            'url': f'http://retired{i}.local',
+            'total_votes': '0.0',
+            'is_active': 0
+        }
+        for i in range(60)
+    ]
+    table = FakeVoteIndex(rows)
+
+    async with AuditSession(transport=table) as session:
+        producers = await get_all_producers(
+            session, chain_url, top=42, active_only=True)
+
+    # the third page starts back on the zero vote rows, nothing new
+    assert len(producers) == 40
+    assert len(table.calls) == 3
+    assert all(call['limit'] == 42 for call in table.calls)
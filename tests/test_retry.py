@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import trio
+
+from bp_auditor.session import AuditSession
+from bp_auditor.utils import (
+    RetryPolicy, RequestTimeout, call_with_retry, parse_retry_after)
+
+from conftest import FakeResponse
+
+
+class FlakyTransport:
+    '''Answers each url with the statuses queued for it, then 200
+    '''
+
+    def __init__(self, statuses: dict[str, list], headers: dict | None = None):
+        self.statuses = statuses
+        self.headers = headers or {}
+        self.requests = []
+
+    async def request(self, method: str, url: str, **kwargs):
+        self.requests.append((trio.current_time(), url))
+        queued = self.statuses.get(url, [])
+        status = queued.pop(0) if queued else 200
+        if status == 'hang':
+            await trio.sleep_forever()
+
+        if status == 'refused':
+            raise OSError('connection refused')
+
+        return FakeResponse(status, {}, headers=self.headers)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+async def test_retry_statuses_with_backoff(autojump_clock):
+    url = 'http://lb.local/v1/chain/get_info'
+    transport = FlakyTransport({url: [503, 502]})
+    async with AuditSession(transport=transport) as session:
+        response = await call_with_retry(session.get, url)
+
+    assert response.status_code == 200
+    assert len(transport.requests) == 3
+
+    # out of attempts the last response is handed back
+    transport = FlakyTransport({url: [503] * 5})
+    async with AuditSession(transport=transport) as session:
+        response = await call_with_retry(session.get, url)
+
+    assert response.status_code == 503
+    assert len(transport.requests) == 3
+
+
+async def test_retry_after(autojump_clock):
+    url = 'http://lb.local/v1/chain/get_info'
+    transport = FlakyTransport({url: [429]}, headers={'retry-after': '7'})
+    async with AuditSession(transport=transport) as session:
+        await call_with_retry(session.get, url)
+
+    (first, _), (second, _) = transport.requests
+    assert second - first == 7
+
+    # asking for longer than the policy tolerates gives up
+    transport = FlakyTransport({url: [429]}, headers={'retry-after': '120'})
+    async with AuditSession(transport=transport) as session:
+        response = await call_with_retry(session.get, url)
+
+    assert response.status_code == 429
+    assert len(transport.requests) == 1
+
+
+async def test_no_retry_on_timeout_or_cancel(autojump_clock):
+    url = 'http://dead.local/bp.json'
+    transport = FlakyTransport({url: ['hang'] * 3})
+    async with AuditSession(transport=transport) as session:
+        try:
+            await call_with_retry(session.get, url)
+            assert False
+
+        except RequestTimeout:
+            ...
+
+    assert len(transport.requests) == 1
+
+    calls = []
+    async def hang():
+        calls.append(None)
+        await trio.sleep_forever()
+
+    with trio.move_on_after(1):
+        await call_with_retry(hang)
+
+    assert len(calls) == 1
+
+
+async def test_host_retry_budget(autojump_clock):
+    urls = [f'http://down.local/{i}' for i in range(20)]
+    transport = FlakyTransport({url: ['refused'] * 3 for url in urls})
+    policy = RetryPolicy(budget=5, budget_refill=0)
+
+    async def fetch(session, url):
+        try:
+            await call_with_retry(session.get, url)
+
+        except OSError:
+            ...
+
+    async with AuditSession(
+        transport=transport, retry_policy=policy
+    ) as session:
+        async with trio.open_nursery() as n:
+            for url in urls:
+                n.start_soon(fetch, session, url)
+
+    # every url got its first attempt, only 5 retries overall
+    assert len(transport.requests) == 25
+    assert policy.retries == 5
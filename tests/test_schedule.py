@@ -5,21 +5,24 @@ import logging
 
 from bp_auditor.queries import *
 from bp_auditor.audit import check_producer
+from bp_auditor.session import AuditSession
 
 
 url = 'https://testnet.telos.net'
 
 
 async def test_check_one():
-    chain_id = await get_chain_id(url)
-    logging.info(f'{url} chain id {chain_id}')
-
-    # get top 42 producers ordered by vote
-    producers = await get_all_producers(url)
-
-    logging.info(
-        json.dumps(
-            (await check_producer(url, producers[random.randint(0, 41)], chain_id)),
-            indent=4
+    async with AuditSession() as session:
+        chain_id = await get_chain_id(session, url)
+        logging.info(f'{url} chain id {chain_id}')
+
+        # get top 42 producers ordered by vote
+        producers = await get_all_producers(session, url)
+
+        logging.info(
+            json.dumps(
+                (await check_producer(
+                    session, url, producers[random.randint(0, 41)], chain_id)),
+                indent=4
+            )
         )
-    )
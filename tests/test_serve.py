@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+from datetime import datetime
+
+import trio
+
+from bp_auditor.db import read_live_reports, read_all_reports_from
+from bp_auditor.serve import RollingAuditor, seconds_until_hour
+from bp_auditor.utils import RequestTimeout
+
+from conftest import FakeTransport, chain_url
+
+
+def test_seconds_until_hour():
+    assert seconds_until_hour(0, datetime(2023, 5, 1, 23, 0)) == 3600
+    assert seconds_until_hour(0, datetime(2023, 5, 1, 0, 0)) == 24 * 3600
+    assert seconds_until_hour(11, datetime(2023, 5, 1, 10, 30)) == 1800
+
+
+async def test_rolling_audit(tmp_path, autojump_clock):
+    db_location = str(tmp_path / 'reports.db')
+    transport = FakeTransport()
+    # one producer every 10 seconds
+    auditor = RollingAuditor(
+        [chain_url],
+        db_location=db_location,
+        transport=transport,
+        interval=420,
+        concurrency=42
+    )
+
+    async with trio.open_nursery() as n:
+        await n.start(auditor.run)
+        start = trio.current_time()
+
+        # producers 1 to 21 are due in the first 205 seconds
+        await trio.sleep_until(start + 205)
+        assert auditor.audits == 21
+
+        # the whole table, then the first 5 producers of the next cycle
+        await trio.sleep_until(start + 465)
+        assert auditor.audits == 47
+        n.cancel_scope.cancel()
+
+    # each cycle re-reads the producer table, it outlived its cache ttl
+    table_reads = [
+        url for _, url in transport.requests
+        if url.endswith('/v1/chain/get_table_rows')
+    ]
+    assert len(table_reads) == 2
+
+    # a single cpu scan serves both cycles
+    scans = [
+        url for _, url in transport.requests
+        if '/v2/history/get_actions' in url and '&skip=0' in url
+    ]
+    assert len(scans) == 1
+
+    live = read_live_reports(db_location, chain_url)
+    assert len(live) == 42
+    assert all(report['bp_json'] == 'ok' for report in live)
+
+    auditor.snapshot()
+    (_, reports), = read_all_reports_from(
+        db_location, datetime(2000, 1, 1), chain=chain_url)
+    assert [report['rank'] for report in reports] == list(range(1, 43))
+
+
+class FlakyChain(FakeTransport):
+    '''Chain api that times out on its first `failures` get_info requests
+    '''
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    async def request(self, method: str, url: str, **kwargs):
+        if url.endswith('/v1/chain/get_info') and self.failures:
+            self.failures -= 1
+            self.requests.append((method, url))
+            raise RequestTimeout(f'timeout on {url}')
+
+        return await super().request(method, url, **kwargs)
+
+
+async def test_rolling_audit_survives_chain_timeouts(tmp_path, autojump_clock):
+    transport = FlakyChain(failures=3)
+    auditor = RollingAuditor(
+        [chain_url],
+        db_location=str(tmp_path / 'reports.db'),
+        transport=transport,
+        interval=420,
+        concurrency=42,
+        retry_delay=60
+    )
+
+    async with trio.open_nursery() as n:
+        await n.start(auditor.run)
+        await trio.sleep(600)
+        n.cancel_scope.cancel()
+
+    # the producer table read got retried until the chain answered
+    assert transport.failures == 0
+    assert auditor.audits > 0
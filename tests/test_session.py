@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import trio
+
+from bp_auditor.audit import check_all_producers
+from bp_auditor.session import AuditSession
+
+from conftest import FakeTransport, chain_url
+
+
+async def test_gather_with_stand_in_transport(tmp_path):
+    transport = FakeTransport()
+    reports = await check_all_producers(
+        chain_url,
+        db_location=str(tmp_path / 'reports.db'),
+        transport=transport,
+        connections_per_host=2
+    )
+
+    assert len(reports) == 42
+    assert all(report['bp_json'] == 'ok' for report in reports)
+    assert all(report['cpu'] == '200.00 us' for report in reports)
+    assert sorted(report['rank'] for report in reports) == list(range(1, 43))
+
+
+async def test_bp_json_conditional_cache(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    await check_all_producers(
+        chain_url, db_location=db_location, transport=FakeTransport())
+
+    # second run goes straight to the path that worked and gets 304s
+    transport = FakeTransport()
+    reports = await check_all_producers(
+        chain_url, db_location=db_location, transport=transport)
+
+    assert all(report['bp_json'] == 'ok' for report in reports)
+    assert not any(url.endswith('chains.json') for _, url in transport.requests)
+
+
+async def test_per_host_limit():
+    transport = FakeTransport()
+    async with AuditSession(per_host=3, transport=transport) as session:
+        async with trio.open_nursery() as n:
+            for _ in range(20):
+                n.start_soon(session.get, f'{chain_url}/v1/chain/get_info')
+
+    assert len(transport.requests) == 20
+    assert transport.max_in_flight == 3
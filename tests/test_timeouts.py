@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import math
+
+from datetime import datetime
+
+import trio
+
+from bp_auditor.audit import check_all_producers
+from bp_auditor.db import read_latency_samples
+from bp_auditor.timeouts import Timeouts
+
+from conftest import FakeTransport, chain_url
+
+
+def test_learned_timeouts():
+    timeouts = Timeouts({
+        ('http', 'fast.local'): [0.1] * 10,
+        ('http', 'slow.local'): [0.1] * 9 + [3],
+        ('http', 'once.local'): [0.2]
+    })
+
+    # p99 times the factor, bounded by floor and the default ceiling
+    assert timeouts.timeout('http', 'fast.local') == 1
+    assert timeouts.timeout('http', 'slow.local') == 9
+    assert timeouts.timeout('http', 'slow.local', default=5) == 5
+
+    # hosts without enough history of their own use the one of their kind
+    assert timeouts.timeout('http', 'once.local') == 9
+    assert timeouts.timeout('http', 'new.local') == 9
+
+    # nothing learned yet
+    assert timeouts.timeout('p2p', 'new.local:9876') == 5
+    assert timeouts.timeout('check:cpu', default=math.inf) == math.inf
+
+
+async def test_deadline_bounds_timeouts(autojump_clock):
+    timeouts = Timeouts()
+    timeouts.start(3)
+    assert timeouts.timeout('http', 'any.local') == 3
+
+    await trio.sleep(2)
+    assert timeouts.timeout('http', 'any.local') == 1
+
+    await trio.sleep(2)
+    assert timeouts.timeout('http', 'any.local') == 0
+
+
+class HangingTransport(FakeTransport):
+    '''Half of the producers never answer their bp.json requests
+    '''
+
+    async def request(self, method: str, url: str, **kwargs):
+        if url.endswith('.local/bp.json') and int(url.split('.')[0][9:]) % 2:
+            await trio.sleep_forever()
+
+        return await super().request(method, url, **kwargs)
+
+
+async def test_gather_deadline(tmp_path, autojump_clock):
+    db_location = str(tmp_path / 'reports.db')
+
+    # first run has nothing to learn from, dead producers cost the default
+    # timeout, once as timeouts aren't retried
+    start = trio.current_time()
+    reports = await check_all_producers(
+        chain_url, db_location=db_location, transport=HangingTransport())
+    first_run = trio.current_time() - start
+
+    assert len(reports) == 42
+    assert sum(report['bp_json'] == 'ok' for report in reports) == 21
+
+    samples = read_latency_samples(db_location, datetime(2000, 1, 1))
+    assert ('http', 'chain.local') in samples
+
+    # the next one cuts them short based on how fast the live ones answer
+    start = trio.current_time()
+    reports = await check_all_producers(
+        chain_url, db_location=db_location, transport=HangingTransport())
+
+    assert trio.current_time() - start < first_run / 5
+    assert sum(report['bp_json'] == 'ok' for report in reports) == 21
+
+    # and the deadline bounds the whole run, every producer still gets its
+    # report
+    start = trio.current_time()
+    reports = await check_all_producers(
+        chain_url,
+        db_location=str(tmp_path / 'fresh.db'),
+        transport=HangingTransport(),
+        deadline=5
+    )
+
+    assert trio.current_time() - start <= 5
+    assert len(reports) == 42
+    assert all(report['bp_json'] == 'timeout' for report in reports
+               if report['owner'] in ['producer1', 'producer41'])
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+from bp_auditor.db import store_reports, read_run_timings
+from bp_auditor.audit import check_all_producers
+from bp_auditor.timings import Timings, summarize_timings
+
+from conftest import FakeTransport, chain_url
+
+
+async def test_gather_timings(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    timings = Timings()
+    reports = await check_all_producers(
+        chain_url,
+        db_location=db_location,
+        transport=FakeTransport(),
+        timings=timings
+    )
+
+    kinds = {record['kind'] for record in timings.records}
+    assert {'http', 'check', 'producer'} <= kinds
+
+    # bp.json requests are tagged with the producer and check they were for
+    bp_json = [
+        record for record in timings.records
+        if record['kind'] == 'http' and record['target'].endswith('/bp.json')
+    ]
+    assert len(bp_json) == 42
+    assert all(record['check_name'] == 'bp_json' for record in bp_json)
+    assert {record['owner'] for record in bp_json} == {
+        f'producer{i}' for i in range(42)}
+    assert all(record['status'] == 200 and record['bytes'] for record in bp_json)
+
+    store_reports(db_location, reports, timings=timings.records)
+    run_id, records = read_run_timings(db_location)
+    assert run_id == 1
+    assert len(records) == len(timings.records)
+
+    summary = summarize_timings(records, limit=5)
+    assert 'slowest producers:' in summary
+    assert 'slowest checks:' in summary
+    assert 'slowest endpoints:\n' in summary and '  http http://' in summary
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import json
+
+from functools import partial
+
+import trio
+
+from bp_auditor.audit import check_all_producers
+from bp_auditor.trace import ChromeTracer
+
+from conftest import FakeTransport, chain_url
+
+
+def test_gather_trace(tmp_path):
+    tracer = ChromeTracer()
+    trio.run(
+        partial(
+            check_all_producers,
+            chain_url,
+            db_location=str(tmp_path / 'reports.db'),
+            transport=FakeTransport(),
+            concurrency=5,
+            connections_per_host=2
+        ),
+        instruments=[tracer]
+    )
+
+    trace = str(tmp_path / 'trace.json')
+    tracer.write(trace)
+    with open(trace) as trace_file:
+        events = json.load(trace_file)['traceEvents']
+
+    spans = [event for event in events if event['ph'] == 'X']
+    assert all(span['dur'] >= 0 for span in spans)
+
+    # producers queue up behind the concurrency limiter
+    waits = [span for span in spans if span['name'] == 'wait producer slot']
+    assert len(waits) >= 30
+    assert all(span['args']['total'] == 5 for span in waits)
+
+    # check tasks are tagged with the producer and check they run
+    assert any(
+        span['args'].get('owner') == 'producer7' and
+        span['args'].get('check') == 'bp_json'
+        for span in spans
+    )
+    assert any(
+        event['ph'] == 'M' and event['args']['name'] == 'producer7 bp_json'
+        for event in events
+    )
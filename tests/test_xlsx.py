@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import pytest
+import openpyxl
+
+from bp_auditor import xlsx
+from bp_auditor.db import store_reports
+from bp_auditor.evaluate import evaluate_report
+from bp_auditor.xlsx import (
+    produce_monthly_report,
+    STYLE_PASSED,
+    STYLE_FAILED,
+    STYLES_CPU
+)
+
+from conftest import report_ok, report_bad_json, report_exception
+
+
+def test_produce_monthly_report(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    doc_location = str(tmp_path / 'report.xlsx')
+    for _ in range(3):
+        store_reports(
+            db_location, [report_ok, report_bad_json, report_exception])
+
+    produce_monthly_report(db_location, doc_location)
+
+    wb = openpyxl.load_workbook(doc_location)
+    assert wb.sheetnames == [
+        'Sheet', 'goodproducer', 'badproducer', 'crashproducer']
+
+    ws = wb['goodproducer']
+    assert ws.max_row == 4
+    assert ws['B1'].value == 'URL'
+    assert ws['B2'].value == 'https://good.example'
+    assert ws['D2'].style == STYLE_PASSED
+    assert ws['E2'].style == STYLE_PASSED
+    assert ws['F2'].style == STYLE_FAILED
+    assert ws['G2'].style == STYLES_CPU[0]
+    assert ws['D2'].alignment.vertical == 'top'
+
+    ws = wb['crashproducer']
+    assert ws['B2'].value == 'Traceback...'
+
+    assert wb['Sheet']['A1'].value.startswith('Welcome')
+
+
+def test_produce_only_renders_new_runs(tmp_path, monkeypatch):
+    db_location = str(tmp_path / 'reports.db')
+    doc_location = str(tmp_path / 'report.xlsx')
+    store_reports(db_location, [report_ok, report_bad_json])
+
+    rendered = []
+    def counting_evaluate(timestamp, report):
+        rendered.append(report['owner'])
+        return evaluate_report(timestamp, report)
+
+    monkeypatch.setattr(xlsx, 'evaluate_report', counting_evaluate)
+
+    produce_monthly_report(db_location, doc_location)
+    assert len(rendered) == 2
+
+    store_reports(db_location, [report_ok, report_bad_json])
+    produce_monthly_report(db_location, doc_location)
+    assert len(rendered) == 4
+
+    produce_monthly_report(db_location, doc_location)
+    assert len(rendered) == 4
+
+    wb = openpyxl.load_workbook(doc_location)
+    assert wb['goodproducer'].max_row == 3
+    assert wb['goodproducer']['D3'].style == STYLE_PASSED
+
+
+def test_produce_needs_chain_with_several_chains(tmp_path):
+    db_location = str(tmp_path / 'reports.db')
+    doc_location = str(tmp_path / 'report.xlsx')
+    # legacy run from before chains were recorded
+    store_reports(db_location, [report_ok])
+    store_reports(db_location, [report_ok], chain='https://mainnet.example')
+    store_reports(db_location, [report_ok], chain='https://testnet.example')
+
+    with pytest.raises(ValueError, match='2 chains'):
+        produce_monthly_report(db_location, doc_location)
+
+    produce_monthly_report(
+        db_location, doc_location, chain='https://testnet.example')
+    wb = openpyxl.load_workbook(doc_location)
+    assert wb['goodproducer'].max_row == 2